@@ -4,7 +4,6 @@ import pandas as pd
 import sys
 import os
 import torch
-import SALib
 import numpy as np
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
@@ -9,7 +9,6 @@
 
 # Where 'x' represents prey population and 'y' predators population. It’s a system of first-order ordinary differential equations.
 import torch
-import SALib
 import numpy as np
 import matplotlib.pyplot as plt
 import scipy
@@ -5,7 +5,6 @@ Created on Mon May 31 12:33:44 2021
 @author: user
 """
 import torch
-import SALib
 import numpy as np
 import os
 import matplotlib.pyplot as plt
@@ -199,16 +198,6 @@ for n in range(3,10):
     
         start = time.time()
 
-        model_arch = torch.nn.Sequential(
-            torch.nn.Linear(1, 256),
-            torch.nn.ReLU(),
-            torch.nn.Linear(256, 64),
-            torch.nn.ReLU(),
-            torch.nn.Linear(64, 1024),
-            torch.nn.ReLU(),
-            torch.nn.Linear(1024, 1)
-        )
-
         equation = Equation(grid, legendre_poly, bconds).set_strategy('mat')
 
         model = mat_model(grid, legendre_poly)
@@ -223,7 +212,7 @@ for n in range(3,10):
                                          use_cache=True,cache_dir='../cache/',cache_verbose=False,
                                          save_always=False,print_every=None,
                                          patience=5,loss_oscillation_window=100,no_improvement_patience=1000,
-                                         model_randomize_parameter=1e-5,optimizer_mode='LBFGS',cache_model=model_arch,step_plot_print=False,step_plot_save=True,image_save_dir=img_dir)
+                                         model_randomize_parameter=1e-5,optimizer_mode='LBFGS',step_plot_print=False,step_plot_save=True,image_save_dir=img_dir)
 
         end = time.time()
     
@@ -0,0 +1,83 @@
+import torch
+import numpy as np
+import os
+import sys
+import time
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..')))
+
+from tedeous.data import Domain, Conditions, Equation
+from tedeous.model import Model
+from tedeous.domain_decomposition import DomainDecomposition
+
+# Laplace equation u_xx + u_yy = 0 on the unit square,
+# u = sin(pi*x) at y=1 and u = 0 on the other sides.
+# Exact solution u = sin(pi*x) * sinh(pi*y) / sinh(pi).
+# The square is split along y into two overlapping subdomains, every subdomain
+# has its own network, subdomains are trained in two worker processes and
+# exchange the interface values (Schwarz iterations).
+
+torch.manual_seed(0)
+
+n = 20
+
+domain = Domain()
+domain.variable('x', [0, 1], n)
+domain.variable('y', [0, 1], n)
+
+x = torch.linspace(0, 1, n + 1)
+
+boundaries = Conditions()
+boundaries.dirichlet({'x': [0, 1], 'y': 0}, value=0)
+boundaries.dirichlet({'x': 0, 'y': [0, 1]}, value=0)
+boundaries.dirichlet({'x': 1, 'y': [0, 1]}, value=0)
+boundaries.dirichlet({'x': [0, 1], 'y': 1}, value=torch.sin(np.pi * x))
+
+equation = Equation()
+
+laplace = {
+    'd2u/dx2':
+        {
+            'coeff': 1,
+            'd2u/dx2': [0, 0],
+            'pow': 1
+        },
+    'd2u/dy2':
+        {
+            'coeff': 1,
+            'd2u/dy2': [1, 1],
+            'pow': 1
+        }
+}
+
+equation.add(laplace)
+
+
+def net():
+    return torch.nn.Sequential(
+        torch.nn.Linear(2, 24),
+        torch.nn.Tanh(),
+        torch.nn.Linear(24, 24),
+        torch.nn.Tanh(),
+        torch.nn.Linear(24, 1))
+
+
+equal_cls = Model(net(), domain, equation, boundaries).compile('autograd')
+
+grid = domain.build('autograd')
+
+dd = DomainDecomposition(grid, equal_cls, net, n_subdomains=2, axis=1, overlap=2)
+
+start = time.time()
+
+model = dd.solve(n_iterations=4, workers=2, tmin=500, tmax=1000, learning_rate=1e-2,
+                 lambda_bound=100, verbose=0)
+
+end = time.time()
+
+exact = torch.sin(np.pi * grid[:, 0]) * torch.sinh(np.pi * grid[:, 1]) / np.sinh(np.pi)
+error = torch.max(torch.abs(model(grid).reshape(-1) - exact)).item()
+
+print('Time taken {:.2f}, max error {:.4f}'.format(end - start, error))
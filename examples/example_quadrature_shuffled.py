@@ -0,0 +1,41 @@
+import torch
+import numpy as np
+import os
+import sys
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..')))
+
+from tedeous.quadrature import Quadrature
+
+# Quadrature does not depend on the order of the grid points:
+# shuffled grid should give the same integrals as the cartesian_prod ordered one.
+
+x = torch.linspace(0, 1, 21, dtype=torch.float64)
+t = torch.linspace(0, 2, 31, dtype=torch.float64)
+grid = torch.cartesian_prod(x, t)
+func = torch.sin(np.pi * grid[:, 0]) * torch.exp(-grid[:, 1])
+
+torch.manual_seed(0)
+perm = torch.randperm(len(grid))
+
+for power in (1, 2):
+    ordered = Quadrature(grid).integrate(func, power=power)
+    shuffled = Quadrature(grid[perm]).integrate(func[perm], power=power)
+    print('power={}: ordered={:.6f}, shuffled={:.6f}'.format(power, float(ordered), float(shuffled)))
+    assert torch.allclose(ordered, shuffled)
+
+# exact value of the integral for power=1
+exact = 2 / np.pi * (1 - np.exp(-2))
+print('exact={:.6f}'.format(exact))
+assert abs(float(Quadrature(grid[perm]).integrate(func[perm], power=1)) - exact) < 1e-2
+
+# not cartesian grid (some points are removed) and linear weights in the grid order
+subset = perm[:len(perm) - 40]
+subset_sorted = torch.sort(subset).values
+quadrature = Quadrature(grid[subset])
+assert torch.allclose(quadrature.integrate(func[subset], power=1),
+                      Quadrature(grid[subset_sorted]).integrate(func[subset_sorted], power=1))
+assert torch.allclose(quadrature.weights @ func[subset], quadrature.integrate(func[subset], power=1))
+print('Quadrature of the shuffled grid is correct')
@@ -6,7 +6,6 @@ import os
 import time
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
-import SALib
 import scipy
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
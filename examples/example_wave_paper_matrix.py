@@ -142,16 +142,6 @@ for grid_res in range(40, 110, 10):
         
         start = time.time()
         
-        model_arch = torch.nn.Sequential(
-            torch.nn.Linear(2, 256),
-            torch.nn.ReLU(),
-            torch.nn.Linear(256, 64),
-            torch.nn.ReLU(),
-            torch.nn.Linear(64, 1024),
-            torch.nn.ReLU(),
-            torch.nn.Linear(1024, 1)
-        )
-
         equation = Equation(grid, wave_eq, bconds).set_strategy('mat')
 
         model= mat_model(grid, wave_eq)
@@ -166,7 +156,7 @@ for grid_res in range(40, 110, 10):
                                          use_cache=True,cache_dir='../cache/',cache_verbose=False,
                                          save_always=False, print_every=100,
                                          patience=5, loss_oscillation_window=100, no_improvement_patience=100,
-                                         model_randomize_parameter=1e-5,optimizer_mode='LBFGS',cache_model=model_arch,step_plot_print=False,step_plot_save=True,image_save_dir=img_dir)
+                                         model_randomize_parameter=1e-5,optimizer_mode='LBFGS',step_plot_print=False,step_plot_save=True,image_save_dir=img_dir)
 
 
 
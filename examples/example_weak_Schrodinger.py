@@ -1,5 +1,4 @@
 import torch
-import SALib
 import numpy as np
 import matplotlib.pyplot as plt
 import scipy
@@ -6,17 +6,34 @@ Created on Tue Aug 24 11:50:12 2021
 """
 
 import datetime
+import hashlib
+import json
 import os
 import glob
+import pickle
 import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
-from typing import Union, Tuple, Any
+from typing import Union, Tuple, Any, List
 import torch
 import numpy as np
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 from tedeous.solution import Solution
-from tedeous.input_preprocessing import Equation
-from tedeous.device import device_type, check_device
+from tedeous.device import device_type
+
+# process umask (read once, os.umask can only be read by setting it)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 
 def count_output(model: torch.Tensor) -> int:
@@ -36,6 +53,296 @@ def count_output(model: torch.Tensor) -> int:
     return output_layer
 
 
+def count_input(model: torch.nn.Module) -> int:
+    """ Determine the in features of the model.
+
+    Args:
+        model (torch.nn.Module): torch neural network.
+
+    Returns:
+        int: number of in features.
+    """
+    for layer in model.modules():
+        if hasattr(layer, 'in_features'):
+            return layer.in_features
+    return None
+
+
+_CONFIG_ACTIVATIONS = ('Tanh', 'ReLU', 'Sigmoid', 'SiLU', 'Mish', 'Softsign', 'Identity')
+
+
+def model_config(model: torch.nn.Module) -> Union[list, None]:
+    """ Architecture config of the plain torch.nn.Sequential model
+        (Linear layers and activations without parameters).
+
+    Args:
+        model (torch.nn.Module): model.
+
+    Returns:
+        Union[list, None]: description of every layer (None if the
+        architecture could not be described by the config).
+    """
+    if type(model) is not torch.nn.Sequential:
+        return None
+    config = []
+    for layer in model:
+        layer_type = type(layer).__name__
+        if type(layer) is torch.nn.Linear:
+            config.append({'type': 'Linear',
+                           'in_features': layer.in_features,
+                           'out_features': layer.out_features,
+                           'bias': layer.bias is not None})
+        elif layer_type in _CONFIG_ACTIVATIONS and type(layer) is getattr(torch.nn, layer_type):
+            config.append({'type': layer_type})
+        else:
+            return None
+    return config
+
+
+def model_from_config(config: list) -> torch.nn.Sequential:
+    """ Creates the model skeleton (parameters on *meta* device) from the config.
+
+    Args:
+        config (list): architecture config (see model_config).
+
+    Returns:
+        torch.nn.Sequential: model, parameters should be loaded with assign=True.
+    """
+    layers = []
+    with torch.device('meta'):
+        for item in config:
+            params = dict(item)
+            layer_type = params.pop('type')
+            layers.append(getattr(torch.nn, layer_type)(**params))
+    return torch.nn.Sequential(*layers)
+
+
+def _hash_update(hasher: Any, obj: Any) -> None:
+    """ Recursive update of the hash by operator or boundary conditions items.
+    """
+    if isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            hasher.update(str(key).encode())
+            _hash_update(hasher, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(str(len(obj)).encode())
+        for item in obj:
+            _hash_update(hasher, item)
+    elif isinstance(obj, (torch.Tensor, np.ndarray)):
+        array = obj.detach().cpu().numpy() if isinstance(obj, torch.Tensor) else obj
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        hasher.update(str(array.shape).encode())
+        hasher.update(array.tobytes())
+    elif callable(obj):
+        hasher.update(getattr(obj, '__qualname__', type(obj).__name__).encode())
+    else:
+        hasher.update(repr(obj).encode())
+
+
+def equation_hash(equal_cls: Any) -> Union[str, None]:
+    """ Hash of the operator and boundary conditions (equal problems
+        have equal hashes).
+
+    Args:
+        equal_cls (Any): Equation_{NN, mat, autograd} object.
+
+    Returns:
+        Union[str, None]: hex digest (None if equal_cls is None).
+    """
+    if equal_cls is None:
+        return None
+    hasher = hashlib.sha1()
+    _hash_update(hasher, equal_cls.operator)
+    _hash_update(hasher, equal_cls.bconds)
+    return hasher.hexdigest()
+
+
+def _operator_signature(operator: Union[dict, list, None]) -> Tuple[list, list]:
+    """ Structure (derivative directions, powers and variables of the terms)
+        and numeric coefficients of the operator. Names of the terms are ignored,
+        tensor coefficients are summarized by mean and standard deviation.
+    """
+    if operator is None:
+        return [], []
+    if isinstance(operator, dict):
+        operator = [operator]
+    structure, values = [], []
+    for equation in operator:
+        terms = []
+        for term in equation.values():
+            term_structure, term_values = [], []
+            for key, value in term.items():
+                if key != 'coeff':
+                    term_structure.append(repr(value) if key in ('pow', 'var') else
+                                          'dirs:' + repr(value))
+            coeff = term['coeff']
+            if isinstance(coeff, (int, float)):
+                term_values.append(float(coeff))
+            elif isinstance(coeff, torch.Tensor):
+                coeff = coeff.detach().double()
+                term_values += [float(coeff.mean()), float(coeff.std()) if coeff.numel() > 1 else 0.]
+                term_structure.append('tensor')
+            else:
+                term_structure.append(getattr(coeff, '__qualname__', type(coeff).__name__))
+            terms.append((sorted(term_structure), term_values))
+        terms.sort(key=lambda item: repr(item[0]))
+        structure.append([term_structure for term_structure, _ in terms])
+        values += [value for _, term_values in terms for value in term_values]
+    return structure, values
+
+
+def equation_signature(equal_cls: Any) -> Union[dict, None]:
+    """ Signature of the problem for the search of the nearest solved problems
+        of the equation family: hash of the structure (operator terms, types
+        of boundary conditions) and vector of the numeric coefficients and
+        boundary values summaries (mean and standard deviation).
+
+    Args:
+        equal_cls (Any): Equation_{NN, mat, autograd} object.
+
+    Returns:
+        Union[dict, None]: {'structure': hex digest, 'vector': list of floats}
+        (None if equal_cls is None).
+    """
+    if equal_cls is None:
+        return None
+    structure, vector = _operator_signature(equal_cls.operator)
+    for bcond in equal_cls.bconds:
+        bop_structure, bop_values = _operator_signature(bcond['bop'])
+        structure.append([bcond['type'], repr(bcond['var']), bop_structure])
+        vector += bop_values
+        bval = bcond['bval']
+        if isinstance(bval, torch.Tensor):
+            bval = bval.detach().double()
+            vector += [float(bval.mean()), float(bval.std()) if bval.numel() > 1 else 0.]
+        elif isinstance(bval, (int, float)):
+            vector += [float(bval), 0.]
+    return {'structure': hashlib.sha1(repr(structure).encode()).hexdigest(),
+            'vector': vector}
+
+
+def signature_distance(first: Union[dict, None], second: Union[dict, None]) -> float:
+    """ Relative distance between the coefficient vectors of the problems
+        with the same structure.
+
+    Args:
+        first (Union[dict, None]): signature (see equation_signature).
+        second (Union[dict, None]): signature.
+
+    Returns:
+        float: distance (inf for different structures).
+    """
+    if first is None or second is None or first['structure'] != second['structure'] or \
+            len(first['vector']) != len(second['vector']):
+        return np.inf
+    first, second = np.array(first['vector']), np.array(second['vector'])
+    return float(np.linalg.norm(np.abs(first - second) /
+                                (np.abs(first) + np.abs(second) + 1e-8)))
+
+
+def grid_bounds(grid: torch.Tensor) -> List[list]:
+    """ Bounds of the grid in *NN, autograd* form.
+
+    Args:
+        grid (torch.Tensor): grid points (n_points, n_dims).
+
+    Returns:
+        List[list]: [min, max] along every axis.
+    """
+    grid = grid.detach().reshape(-1, grid.shape[-1])
+    return [[float(low), float(high)] for low, high in
+            zip(grid.min(0).values, grid.max(0).values)]
+
+
+def probe_grid(bounds: List[list], n_probe: int = 16) -> torch.Tensor:
+    """ Fixed pseudo-random points inside the bounds.
+
+    Args:
+        bounds (List[list]): [min, max] along every axis.
+        n_probe (int, optional): number of points. Defaults to 16.
+
+    Returns:
+        torch.Tensor: probe points (n_probe, n_dims).
+    """
+    generator = torch.Generator().manual_seed(0)
+    bounds = torch.tensor(bounds, dtype=torch.float64)
+    points = torch.rand((n_probe, len(bounds)), generator=generator, dtype=torch.float64)
+    return bounds[:, 0] + points * (bounds[:, 1] - bounds[:, 0])
+
+
+def mat_axes(grid: torch.Tensor) -> List[torch.Tensor]:
+    """ Axes of the *mat* mode grid.
+
+    Args:
+        grid (torch.Tensor): grid (n_dims, n_1, ..., n_dims).
+
+    Returns:
+        List[torch.Tensor]: nodes along every axis.
+    """
+    return [grid[k].movedim(k, 0).reshape(grid.shape[k + 1], -1)[:, 0].contiguous()
+            for k in range(grid.shape[0])]
+
+
+def mat_interpolate(values: torch.Tensor,
+                    axes: List[torch.Tensor],
+                    new_axes: List[torch.Tensor]) -> torch.Tensor:
+    """ Multilinear interpolation of *mat* model values from one cartesian
+        grid to another (values outside the axes range are extrapolated by
+        the nearest ones). Interpolation is done axis by axis.
+
+    Args:
+        values (torch.Tensor): *mat* model (n_out, n_1, ..., n_dims).
+        axes (List[torch.Tensor]): nodes of the values grid along every axis.
+        new_axes (List[torch.Tensor]): nodes of the new grid along every axis.
+
+    Returns:
+        torch.Tensor: *mat* model on the new grid.
+    """
+    for k, (axis, new_axis) in enumerate(zip(axes, new_axes)):
+        axis = axis.to(values)
+        new_axis = new_axis.to(values)
+        if len(axis) == 1:
+            index = torch.zeros(len(new_axis), dtype=torch.long, device=values.device)
+            values = values.index_select(k + 1, index)
+            continue
+        index = torch.searchsorted(axis, new_axis, right=True) - 1
+        index = torch.clamp(index, 0, len(axis) - 2)
+        weight = ((new_axis - axis[index]) / (axis[index + 1] - axis[index])).clamp(0, 1)
+        shape = [1] * values.dim()
+        shape[k + 1] = -1
+        weight = weight.reshape(shape)
+        values = values.index_select(k + 1, index) * (1 - weight) + \
+                 values.index_select(k + 1, index + 1) * weight
+    return values
+
+
+class BlendedModel(torch.nn.Module):
+    """
+    Weighted sum of the cached models outputs (warm start from the nearest
+    solved problems of the equation family).
+    """
+    def __init__(self, models: List[torch.nn.Module], weights: List[float]):
+        """
+        Args:
+            models (List[torch.nn.Module]): cached models.
+            weights (List[float]): weights of the models.
+        """
+        super().__init__()
+        self.models = torch.nn.ModuleList(models)
+        self.weights = list(weights)
+
+    def forward(self, grid: torch.Tensor) -> torch.Tensor:
+        """ Forward pass of the blend.
+
+        Args:
+            grid (torch.Tensor): points.
+
+        Returns:
+            torch.Tensor: weighted sum of the models outputs.
+        """
+        return sum(weight * model(grid) for weight, model in zip(self.weights, self.models))
+
+
 def create_random_fn(eps: float) -> callable:
     """ Create random tensors to add some variance to torch neural network.
 
@@ -71,6 +378,332 @@ def remove_all_files(folder: str) -> None:
             print('Failed to delete %s. Reason: %s' % (file_path, e))
 
 
+_held_locks = threading.local()
+
+
+@contextmanager
+def file_lock(path: str):
+    """ Advisory exclusive lock (fcntl, msvcrt on Windows) of the lock file,
+        that is shared by the processes working with the same cache directory.
+        The lock is reentrant in the thread that holds it.
+
+    Args:
+        path (str): lock file path (created if missing).
+    """
+    path = os.path.abspath(path)
+    held = _held_locks.__dict__.setdefault('paths', set())
+    if path in held:
+        yield
+        return
+    with open(path, 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        held.add(path)
+        try:
+            yield
+        finally:
+            held.discard(path)
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_temp(path: str, write_fn: callable, mode: str = 'wb') -> str:
+    """ Writes the file to the hidden temporary file next to *path*,
+        the file is moved to *path* by os.replace (atomic rename),
+        so the readers never see a partially written file. The temporary file
+        gets the usual permissions of the new file (mkstemp creates it with 0600),
+        so the shared cache stays readable for the other users.
+
+    Args:
+        path (str): final file path.
+        write_fn (callable): function that writes the content to the file object.
+        mode (str, optional): file mode. Defaults to 'wb'.
+
+    Returns:
+        str: temporary file path.
+    """
+    directory, file = os.path.split(path)
+    descriptor, temp_path = tempfile.mkstemp(prefix='.' + file, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(descriptor, mode) as temp_file:
+            write_fn(temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.chmod(temp_path, 0o666 & ~_UMASK)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+class CacheIndex():
+    """
+    JSON sidecar of the cache directory with metadata of every cached model
+    (architecture, input/output dims, equation hash, grid bounds, final loss
+    and outputs on the probe grid). Lookup filters and ranks the models by
+    the index, so model files are opened only for the chosen candidates.
+    The index and model files are written atomically, read-modify-write of
+    the index is done under the advisory lock, so the cache directory
+    may be shared by several processes.
+    """
+
+    file_name = 'cache_index.json'
+    lock_name = 'cache_index.lock'
+
+    def __init__(self, cache_dir: str):
+        """
+        Args:
+            cache_dir (str): cache directory.
+        """
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, self.file_name)
+        self.lock_path = os.path.join(cache_dir, self.lock_name)
+
+    def lock(self):
+        """ Inter-process lock of the index (see file_lock).
+        """
+        return file_lock(self.lock_path)
+
+    def load(self) -> dict:
+        """ Read the index.
+
+        Returns:
+            dict: metadata of every model (key is the model name).
+        """
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def dump(self, entries: dict) -> None:
+        """ Write the index.
+
+        Args:
+            entries (dict): metadata of every model.
+        """
+        temp_path = write_temp(self.path, lambda index_file: json.dump(entries, index_file), 'w')
+        os.replace(temp_path, self.path)
+
+    def add(self, name: str, entry: dict, temp_path: Union[str, None] = None) -> None:
+        """ Add (or replace) model metadata.
+
+        Args:
+            name (str): model name.
+            entry (dict): model metadata.
+            temp_path (Union[str, None], optional): temporary model file (see write_temp),
+                that is moved to the entry file under the same lock, so the model file
+                and its metadata appear together. Defaults to None.
+        """
+        with self.lock():
+            if temp_path is not None:
+                os.replace(temp_path, os.path.join(self.cache_dir, entry['file']))
+            entries = self.load()
+            entries[name] = entry
+            self.dump(entries)
+
+    def remove(self, names: List[str]) -> None:
+        """ Remove models metadata.
+
+        Args:
+            names (List[str]): model names.
+        """
+        with self.lock():
+            entries = self.load()
+            for name in names:
+                entries.pop(name, None)
+            self.dump(entries)
+
+    def hit(self, name: str) -> None:
+        """ Records the reuse of the model (hits number and last hit time).
+
+        Args:
+            name (str): model name.
+        """
+        with self.lock():
+            entries = self.load()
+            if name not in entries:
+                return
+            entries[name]['hits'] = entries[name].get('hits', 0) + 1
+            entries[name]['last_hit'] = datetime.datetime.now().timestamp()
+            self.dump(entries)
+
+
+class CachePolicy():
+    """
+    Bounds the cache size. After every save the models are evicted until
+    the cache fits the limits: number of models of the same equation,
+    total number of models and total size of model files.
+    Eviction order is *lru* (least recently reused or saved first)
+    or *worst_loss* (maximal final loss first, unknown loss is the worst).
+    """
+
+    def __init__(self,
+                 max_bytes: Union[int, None] = None,
+                 max_entries: Union[int, None] = None,
+                 eviction: str = 'lru',
+                 per_equation: Union[int, None] = None):
+        """
+        Args:
+            max_bytes (Union[int, None], optional): maximal total size of model files.
+                Defaults to None (unlimited).
+            max_entries (Union[int, None], optional): maximal number of models.
+                Defaults to None (unlimited).
+            eviction (str, optional): eviction order, *lru* or *worst_loss*. Defaults to 'lru'.
+            per_equation (Union[int, None], optional): maximal number of models
+                of the same equation (equal equation hash). Defaults to None (unlimited).
+
+        Raises:
+            ValueError: unknown eviction order.
+        """
+        if eviction not in ('lru', 'worst_loss'):
+            raise ValueError('Unknown eviction policy: {}'.format(eviction))
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.eviction = eviction
+        self.per_equation = per_equation
+
+    def _order(self, entries: dict) -> List[str]:
+        """ Model names in eviction order (first is evicted first).
+        """
+        if self.eviction == 'lru':
+            def key(name):
+                entry = entries[name]
+                last_hit = entry.get('last_hit')
+                return entry['time'] if last_hit is None else last_hit
+        else:
+            def key(name):
+                loss = entries[name]['loss']
+                return -np.inf if loss is None else -loss
+        return sorted(entries, key=key)
+
+    def select(self, entries: dict, sizes: dict) -> List[str]:
+        """ Chooses models for eviction.
+
+        Args:
+            entries (dict): index entries.
+            sizes (dict): size of every model file in bytes.
+
+        Returns:
+            List[str]: names of evicted models.
+        """
+        evicted = []
+        order = self._order(entries)
+        if self.per_equation is not None:
+            counts = {}
+            for name in reversed(order):
+                equation = entries[name]['equation']
+                counts[equation] = counts.get(equation, 0) + 1
+                if counts[equation] > self.per_equation:
+                    evicted.append(name)
+        order = [name for name in order if name not in evicted]
+        total = sum(sizes[name] for name in order)
+        for name in list(order):
+            if (self.max_entries is None or len(order) <= self.max_entries) and \
+                    (self.max_bytes is None or total <= self.max_bytes):
+                break
+            evicted.append(name)
+            order.remove(name)
+            total -= sizes[name]
+        return evicted
+
+    def enforce(self, cache_dir: str) -> List[str]:
+        """ Removes evicted model files and their index entries.
+
+        Args:
+            cache_dir (str): cache directory.
+
+        Returns:
+            List[str]: names of evicted models.
+        """
+        index = CacheIndex(cache_dir)
+        with index.lock():
+            entries = index.load()
+            sizes = {}
+            for name, entry in entries.items():
+                path = os.path.join(cache_dir, entry['file'])
+                sizes[name] = os.path.getsize(path) if os.path.isfile(path) else 0
+            evicted = self.select(entries, sizes)
+            for name in evicted:
+                path = os.path.join(cache_dir, entries[name]['file'])
+                if os.path.isfile(path):
+                    os.remove(path)
+            if evicted:
+                index.remove(evicted)
+        return evicted
+
+
+class _MemoryBudget():
+    """
+    Bounds the total memory estimate of the candidates that are
+    evaluated at the same time (one candidate is always allowed).
+    """
+
+    def __init__(self, limit: Union[int, None]):
+        """
+        Args:
+            limit (Union[int, None]): memory budget in bytes (None is unlimited).
+        """
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, size: int):
+        """ Waits until *size* bytes fit into the budget and holds them.
+
+        Args:
+            size (int): memory estimate in bytes.
+        """
+        with self._condition:
+            while self.limit is not None and self.used > 0 and \
+                    self.used + size > self.limit:
+                self._condition.wait()
+            self.used += size
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.used -= size
+                self._condition.notify_all()
+
+
+class _CandidateModel(torch.nn.Module):
+    """
+    Placeholder model of the lookup Solution: the Solution (prepared operator
+    and boundary conditions) is built once per worker and the cached
+    candidate is substituted before every evaluation.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.model = None
+
+    def forward(self, grid: torch.Tensor) -> torch.Tensor:
+        """ Forward pass of the current candidate.
+
+        Args:
+            grid (torch.Tensor): points.
+
+        Returns:
+            torch.Tensor: candidate outputs.
+        """
+        return self.model(grid)
+
+
 class CacheUtils:
     """ Mixin class with auxiliary methods
     """
@@ -81,6 +714,7 @@ class CacheUtils:
             file = os.getcwd()
 
         self._cache_dir = os.path.normpath((os.path.join(os.path.dirname(file), '..', 'cache')))
+        self.policy = None
 
     def get_cache_dir(self):
         """Get cache dir.
@@ -112,124 +746,297 @@ class CacheUtils:
     cache_dir = property(get_cache_dir, set_cache_dir, clear_cache_dir)
 
     @staticmethod
-    def grid_model_mat(model: torch.Tensor,
-                       grid: torch.Tensor,
-                       cache_model: torch.nn.Module=None) -> Tuple[torch.Tensor, torch.nn.Module]:
-        """ Create grid and model for *NN or autograd* modes from grid
-            and model of *mat* mode.
+    def model_entry(model: torch.nn.Module,
+                    file: str,
+                    grid: Union[torch.Tensor, None] = None,
+                    equal_cls: Any = None,
+                    loss: Union[float, None] = None) -> dict:
+        """ Metadata of the model for the cache index.
 
         Args:
-            model (torch.Tensor): model from *mat* method.
-            grid (torch.Tensor): grid from *mat* method.
-            cache_model (torch.nn.Module, optional): neural network that will 
-                                                     approximate *mat* model. Defaults to None.
+            model (torch.nn.Module): model.
+            file (str): model file name.
+            grid (Union[torch.Tensor, None], optional): training grid in *NN, autograd* form.
+                Defaults to None.
+            equal_cls (Any, optional): Equation_{NN, mat, autograd} object. Defaults to None.
+            loss (Union[float, None], optional): final loss. Defaults to None.
 
         Returns:
-            nn_grid (torch.Tensor): grid satisfying neural network inputs.
-            cache_model (torch.nn.Module): model satisfying the *NN, autograd* methods.
-        """
-        nn_grid = torch.vstack([grid[i].reshape(-1) for i in \
-                                range(grid.shape[0])]).T.float()
-        input_model = grid.shape[0]
-        output_model = model.shape[0]
-
-        if cache_model is None:
-            cache_model = torch.nn.Sequential(
-                torch.nn.Linear(input_model, 100),
-                torch.nn.Tanh(),
-                torch.nn.Linear(100, 100),
-                torch.nn.Tanh(),
-                torch.nn.Linear(100, 100),
-                torch.nn.Tanh(),
-                torch.nn.Linear(100, output_model)
-            )
-
-        return nn_grid, cache_model
+            dict: model metadata.
+        """
+        entry = {'file': file,
+                 'kind': 'model',
+                 'arch': hashlib.sha1(str(model).encode()).hexdigest(),
+                 'config': model_config(model),
+                 'in_features': count_input(model),
+                 'out_features': count_output(model),
+                 'equation': equation_hash(equal_cls),
+                 'signature': equation_signature(equal_cls),
+                 'grid_bounds': None if grid is None else grid_bounds(grid),
+                 'loss': None if loss is None else float(loss),
+                 'probe': None,
+                 'time': datetime.datetime.now().timestamp(),
+                 'hits': 0,
+                 'last_hit': None}
+        if entry['grid_bounds'] is not None:
+            params = next(model.parameters())
+            probe = probe_grid(entry['grid_bounds']).to(params)
+            with torch.no_grad():
+                entry['probe'] = model(probe).reshape(-1).tolist()
+        return entry
 
     @staticmethod
-    def mat_op_coeff(operator: dict) -> dict:
-        """ Preparation of coefficients in the operator of the *mat* method
-            to suit methods *NN, autograd*.
+    def mat_entry(values: torch.Tensor,
+                  axes: List[torch.Tensor],
+                  file: str,
+                  equal_cls: Any = None,
+                  loss: Union[float, None] = None) -> dict:
+        """ Metadata of the *mat* model for the cache index.
 
         Args:
-            operator (dict): operator (equation dict).
+            values (torch.Tensor): *mat* model.
+            axes (List[torch.Tensor]): grid nodes along every axis.
+            file (str): model file name.
+            equal_cls (Any, optional): Equation_mat object. Defaults to None.
+            loss (Union[float, None], optional): final loss. Defaults to None.
 
         Returns:
-            operator (dict): operator (equation dict) with suitable coefficients.
-        """
-        if not isinstance(operator, list):
-            operator = [operator]
-        for op in operator:
-            for label in list(op.keys()):
-                term = op[label]
-                if isinstance(term['coeff'], torch.Tensor):
-                    term['coeff'] = term['coeff'].reshape(-1, 1)
-                elif callable(term['coeff']):
-                    print("Warning: coefficient is callable,\
-                                    it may lead to wrong cache item choice")
-        return operator
+            dict: model metadata.
+        """
+        return {'file': file,
+                'kind': 'mat',
+                'arch': None,
+                'config': None,
+                'in_features': len(axes),
+                'out_features': values.shape[0],
+                'equation': equation_hash(equal_cls),
+                'signature': equation_signature(equal_cls),
+                'grid_bounds': [[float(axis.min()), float(axis.max())] for axis in axes],
+                'loss': None if loss is None else float(loss),
+                'probe': None,
+                'time': datetime.datetime.now().timestamp(),
+                'hits': 0,
+                'last_hit': None}
 
     def save_model(
         self,
         model: torch.nn.Module,
-        name: Union[str, None] = None) -> None:
+        name: Union[str, None] = None,
+        grid: Union[torch.Tensor, None] = None,
+        equal_cls: Any = None,
+        loss: Union[float, None] = None,
+        optimizer: Union[torch.optim.Optimizer, None] = None,
+        scheduler: Any = None) -> None:
         """
-        Saved model in a cache (uses for 'NN' and 'autograd' methods).
+        Saved model in a cache (uses for 'NN' and 'autograd' methods)
+        and adds its metadata to the cache index. Model is saved as
+        architecture config and state dict (see model_config), models that
+        could not be described by the config are saved with the pickled
+        parameterless (*meta*) skeleton. The optimizer and the learning rate
+        scheduler states are saved with the model, so the warm-started
+        training continues from them. If the cache policy
+        is set (see CachePolicy), models are evicted after saving.
         Args:
             model (torch.nn.Module): model to save.
-            (uses only with mixed precision and device=cuda). Defaults to None.
             name (str, optional): name for a model. Defaults to None.
+            grid (torch.Tensor, optional): training grid in *NN, autograd* form. Defaults to None.
+            equal_cls (Any, optional): Equation_{NN, mat, autograd} object. Defaults to None.
+            loss (float, optional): final loss. Defaults to None.
+            optimizer (torch.optim.Optimizer, optional): optimizer of the model. Defaults to None.
+            scheduler (Any, optional): learning rate scheduler of the optimizer. Defaults to None.
         """
 
         if name is None:
             name = str(datetime.datetime.now().timestamp())
         if not os.path.isdir(self.cache_dir):
-            os.mkdir(self.cache_dir)
-        parameters_dict = {'model': model.to('cpu'),
-                           'model_state_dict': model.state_dict()}
+            os.makedirs(self.cache_dir)
+        model = model.to('cpu')
+        config = model_config(model)
+        parameters_dict = {'config': config,
+                           'state_dict': model.state_dict()}
+        if config is None:
+            parameters_dict['skeleton'] = deepcopy(model).to('meta')
+        if isinstance(optimizer, torch.optim.Optimizer):
+            parameters_dict['optimizer'] = {'name': type(optimizer).__name__,
+                                            'state_dict': optimizer.state_dict()}
+            if scheduler is not None:
+                parameters_dict['scheduler'] = {'name': type(scheduler).__name__,
+                                                'state_dict': scheduler.state_dict()}
+        file = name + '.pt'
+        path = os.path.join(self.cache_dir, file)
 
         try:
-            torch.save(parameters_dict, self.cache_dir + '\\' + name + '.tar')
-            print('model is saved in cache')
-        except RuntimeError:
-            torch.save(parameters_dict, self.cache_dir + '\\' + name + '.tar',
-                       _use_new_zipfile_serialization=False)  # cyrrilic in path
-            print('model is saved in cache')
-        except:
+            # file object instead of the path (cyrrilic in path)
+            temp_path = write_temp(path, lambda model_file: torch.save(parameters_dict, model_file))
+        except Exception:
             print('Cannot save model in cache')
+            return
+        grid = None if grid is None else grid.to('cpu')
+        CacheIndex(self.cache_dir).add(
+            name, self.model_entry(model, file, grid, equal_cls, loss), temp_path)
+        print('model is saved in cache')
+        if self.policy is not None:
+            self.policy.enforce(self.cache_dir)
 
     def save_model_mat(self, model: torch.Tensor,
                        grid: torch.Tensor,
-                       cache_model: Union[torch.nn.Module, None] = None,
-                       name: Union[str, None] = None) -> None:
-        """ Saved model in a cache (uses for 'mat' method).
+                       name: Union[str, None] = None,
+                       equal_cls: Any = None,
+                       loss: Union[float, None] = None) -> None:
+        """ Saved model in a cache (uses for 'mat' method) as the tensor
+            of values with the grid axes (see mat_interpolate).
 
         Args:
             model (torch.Tensor): *mat* model
             grid (torch.Tensor): grid from *mat* mode
-            cache_model (Union[torch.nn.Module, None], optional): model to save. Defaults to None.
             name (Union[str, None], optional): name for a model. Defaults to None.
+            equal_cls (Any, optional): Equation_mat object. Defaults to None.
+            loss (Union[float, None], optional): final loss. Defaults to None.
         """
 
-        nn_grid, cache_model = self.grid_model_mat(model, grid, cache_model)
-        optimizer = torch.optim.Adam(cache_model.parameters(), lr=0.001)
-        model_res = model.reshape(-1, model.shape[0])
+        if name is None:
+            name = str(datetime.datetime.now().timestamp())
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        values = model.detach().to('cpu')
+        axes = [axis.detach().to('cpu') for axis in mat_axes(grid)]
+        file = name + '.pt'
 
-        def closure():
-            optimizer.zero_grad()
-            loss = torch.mean((cache_model(check_device(nn_grid)) - model_res) ** 2)
-            loss.backward()
-            return loss
+        try:
+            temp_path = write_temp(os.path.join(self.cache_dir, file),
+                                   lambda model_file: torch.save({'values': values, 'axes': axes},
+                                                                 model_file))
+        except Exception:
+            print('Cannot save model in cache')
+            return
+        CacheIndex(self.cache_dir).add(
+            name, self.mat_entry(values, axes, file, equal_cls, loss), temp_path)
+        print('model is saved in cache')
+        if self.policy is not None:
+            self.policy.enforce(self.cache_dir)
+
+
+class SnapshotWriter():
+    """
+    Background writer of the model snapshots during the training. The training
+    thread only copies the model state off-device (non-blocking copy to pinned
+    memory for cuda), the copies are serialized by the writer thread in the
+    format of the cached models (see CacheUtils.save_model) and only the last
+    *keep* snapshots are kept. If the writer falls behind, the oldest pending
+    snapshots are dropped.
+    """
 
-        loss = np.inf
-        t = 0
-        while loss > 1e-5 and t < 1e5:
-            loss = optimizer.step(closure)
-            t += 1
-            print('Interpolate from trained model t={}, loss={}'.format(
-                    t, loss))
+    def __init__(self,
+                 model: Union[torch.nn.Module, torch.Tensor],
+                 directory: str,
+                 keep: int = 3,
+                 grid: Union[torch.Tensor, None] = None):
+        """
+        Args:
+            model (Union[torch.nn.Module, torch.Tensor]): *mat, NN, autograd* model.
+            directory (str): snapshots directory.
+            keep (int, optional): number of kept snapshots. Defaults to 3.
+            grid (Union[torch.Tensor, None], optional): grid in *mat* form
+                (axes of the *mat* model). Defaults to None.
+        """
+        self.directory = directory
+        self.keep = keep
+        self.snapshots = []
+        if isinstance(model, torch.nn.Module):
+            model_cpu = deepcopy(model).to('cpu')
+            config = model_config(model_cpu)
+            self._header = {'config': config}
+            if config is None:
+                self._header['skeleton'] = model_cpu.to('meta')
+        else:
+            self._header = {'axes': [axis.detach().to('cpu') for axis in mat_axes(grid)]}
+        self._pending = deque(maxlen=keep)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
 
-        self.save_model(cache_model, name=name)
+    @staticmethod
+    def _copy(tensor: torch.Tensor) -> torch.Tensor:
+        """ Off-device copy of the tensor (non-blocking for cuda).
+        """
+        tensor = tensor.detach()
+        if tensor.device.type == 'cuda':
+            return torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True).copy_(
+                tensor, non_blocking=True)
+        return tensor.to('cpu', copy=True)
+
+    def snapshot(self,
+                 model: Union[torch.nn.Module, torch.Tensor],
+                 step: int,
+                 loss: Union[float, None] = None) -> None:
+        """ Takes the snapshot of the model (returns without waiting for the saving).
+
+        Args:
+            model (Union[torch.nn.Module, torch.Tensor]): *mat, NN, autograd* model.
+            step (int): optimization step.
+            loss (Union[float, None], optional): current loss. Defaults to None.
+        """
+        if isinstance(model, torch.nn.Module):
+            tensors = model.state_dict()
+            state = {'state_dict': {key: self._copy(value) for key, value in tensors.items()}}
+            tensors = tensors.values()
+        else:
+            tensors = [model]
+            state = {'values': self._copy(model)}
+        event = None
+        if any(tensor.is_cuda for tensor in tensors):
+            event = torch.cuda.Event()
+            event.record()
+        with self._condition:
+            self._pending.append((step, loss, state, event))
+            self._condition.notify()
+
+    def _run(self) -> None:
+        """ Writer thread loop.
+        """
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                step, loss, state, event = self._pending.popleft()
+            if event is not None:
+                event.synchronize()
+            self._write(step, loss, state)
+
+    def _write(self, step: int, loss: Union[float, None], state: dict) -> None:
+        """ Saves the snapshot and removes the oldest ones.
+        """
+        path = os.path.join(self.directory, 'step_{}.pt'.format(step))
+        parameters_dict = dict(self._header, step=step, loss=loss, **state)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = write_temp(path, lambda model_file: torch.save(parameters_dict, model_file))
+            os.replace(temp_path, path)
+        except Exception:
+            print('Cannot save snapshot {}'.format(path))
+            return
+        if path in self.snapshots:
+            self.snapshots.remove(path)
+        self.snapshots.append(path)
+        while len(self.snapshots) > self.keep:
+            old_path = self.snapshots.pop(0)
+            if os.path.isfile(old_path):
+                os.remove(old_path)
+
+    def close(self) -> List[str]:
+        """ Waits for the pending snapshots and stops the writer thread.
+
+        Returns:
+            List[str]: paths of the kept snapshots (the last is the newest).
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        return list(self.snapshots)
 
 
 class CachePreprocessing:
@@ -239,7 +1046,8 @@ class CachePreprocessing:
                  model: Union[torch.Tensor, torch.nn.Module],
                  mode: str,
                  weak_form: Union[list, None],
-                 mixed_precision: bool):
+                 mixed_precision: bool,
+                 cache_dir: Union[str, None] = None):
         """
         Args:
             grid (torch.Tensor): grid (domain discretization)
@@ -250,6 +1058,8 @@ class CachePreprocessing:
             weak_form (Union[list, None]): list that contains basis function for weak solution.
                                            If None: soluion in strong form.
             mixed_precision (bool): flag for on/off torch.amp.
+            cache_dir (Union[str, None], optional): cache directory. Defaults to None
+                                                    (default CacheUtils directory).
         """
         self.grid = grid
         self.equal_cls = equal_cls
@@ -257,63 +1067,302 @@ class CachePreprocessing:
         self.mode = mode
         self.weak_form = weak_form
         self.mixed_precision = mixed_precision
+        self.cache_dir = CacheUtils().cache_dir if cache_dir is None else cache_dir
+        self.equation = equation_hash(equal_cls)
+        self.signature = equation_signature(equal_cls)
 
     @staticmethod
-    def _cache_files(files: list, nmodels: Union[int, None]=None) -> np.ndarray:
-        """ At some point we may want to reduce the number of models that are
-            checked for the best in the cache.
+    def _load(path: str) -> dict:
+        """ Load the model checkpoint from the cache file. Weights of *.pt*
+            files are memory-mapped and assigned to the model without copies,
+            *.tar* files are the legacy pickled models.
+
+        Args:
+            path (str): path to the model file.
+
+        Returns:
+            dict: checkpoint with 'model', 'model_state_dict', 'optimizer' and 'scheduler'
+            (or 'values' and 'axes' for *mat* model).
+        """
+        if path.endswith('.tar'):
+            checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+            checkpoint['model'].load_state_dict(checkpoint['model_state_dict'])
+            return checkpoint
+        try:
+            data = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+        except pickle.UnpicklingError:
+            data = torch.load(path, map_location='cpu', mmap=True, weights_only=False)
+        if 'values' in data:
+            return data
+        if data['config'] is not None:
+            model = model_from_config(data['config'])
+        else:
+            model = data['skeleton']
+        model.load_state_dict(data['state_dict'], assign=True)
+        return {'model': model, 'model_state_dict': data['state_dict'],
+                'optimizer': data.get('optimizer'), 'scheduler': data.get('scheduler')}
+
+    def _index_legacy(self, index: CacheIndex, entries: dict) -> dict:
+        """ Adds to the index the model files saved without metadata
+            (legacy *.tar* files or files of the lost index entries,
+            grid bounds, equation and loss are unknown for them).
+
+        Files are indexed under the index lock, so concurrent lookups
+        do not index the same files twice.
 
         Args:
-            files (list): list with all model names in cache.
-            nmodels (Union[int, None], optional): models quantity for checking. Defaults to None.
+            index (CacheIndex): cache index.
+            entries (dict): current index entries.
 
         Returns:
-            cache_n (np.ndarray): array with random cache files names.
+            dict: updated index entries.
         """
+        def unindexed(entries: dict) -> List[str]:
+            indexed = {entry['file'] for entry in entries.values()}
+            return [path for pattern in ('*.tar', '*.pt')
+                    for path in glob.glob(os.path.join(self.cache_dir, pattern))
+                    if os.path.basename(path) not in indexed]
+
+        if len(unindexed(entries)) == 0:
+            return entries
+        with index.lock():
+            entries = index.load()
+            legacy = unindexed(entries)
+            if len(legacy) == 0:
+                return entries
+            for path in legacy:
+                file = os.path.basename(path)
+                try:
+                    checkpoint = self._load(path)
+                except Exception:
+                    continue
+                if 'values' in checkpoint:
+                    entry = CacheUtils.mat_entry(checkpoint['values'], checkpoint['axes'], file)
+                else:
+                    entry = CacheUtils.model_entry(checkpoint['model'], file)
+                entries[os.path.splitext(file)[0]] = entry
+            index.dump(entries)
+        return entries
+
+    def _points(self) -> torch.Tensor:
+        """ Grid points in *NN, autograd* form (n_points, n_dims).
+        """
+        if self.mode == 'mat':
+            return torch.cartesian_prod(*mat_axes(self.grid)).reshape(-1, self.grid.shape[0])
+        return self.grid
+
+    def _suitable(self, entries: dict, kinds: Tuple[str] = ('model',)) -> List[str]:
+        """ Cached models of the given kinds with the input/output dims of the problem.
+        """
+        in_features = self._points().shape[-1]
+        out_features = self.model.shape[0] if self.mode == 'mat' else count_output(self.model)
+        return [name for name, entry in entries.items()
+                if entry.get('kind', 'model') in kinds and
+                entry['in_features'] == in_features and
+                entry['out_features'] == out_features]
+
+    def _candidates(self,
+                    entries: dict,
+                    nmodels: Union[int, None] = None,
+                    kinds: Tuple[str] = ('model',)) -> List[str]:
+        """ Filters cached models by kind and input/output dims and ranks them:
+            models of the same equation first, then models of the same equation
+            family by the distance of coefficients (see equation_signature),
+            then by the distance between grid bounds and by the final loss.
+
+        Args:
+            entries (dict): index entries.
+            nmodels (Union[int, None], optional): number of best ranked models. Defaults to None (all).
+            kinds (Tuple[str], optional): kinds of cached models, *model* (neural network)
+                or *mat* (tensor of values). Defaults to ('model',).
+
+        Returns:
+            List[str]: names of the candidates.
+        """
+        bounds = np.array(grid_bounds(self._points()))
+
+        def rank(name: str) -> tuple:
+            entry = entries[name]
+            if entry['grid_bounds'] is None:
+                distance = np.inf
+            else:
+                distance = np.abs(np.array(entry['grid_bounds']) - bounds).sum()
+            loss = np.inf if entry['loss'] is None else entry['loss']
+            return (entry['equation'] != self.equation,
+                    signature_distance(entry.get('signature'), self.signature),
+                    distance, loss)
+
+        names = sorted(self._suitable(entries, kinds), key=rank)
+
+        candidates, probes = [], set()
+        for name in names:
+            probe = entries[name]['probe']
+            if probe is not None:
+                probe = tuple(np.round(probe, 6))
+                if probe in probes:
+                    continue
+                probes.add(probe)
+            candidates.append(name)
+        return candidates if nmodels is None else candidates[:nmodels]
+
+    def _neighbours(self,
+                    entries: dict,
+                    neighbours: int,
+                    kinds: Tuple[str] = ('model',)) -> Tuple[List[str], List[float]]:
+        """ Nearest solved problems of the same equation family
+            (same structure, nearest coefficients, see equation_signature)
+            and their inverse distance weights.
+
+        Args:
+            entries (dict): index entries.
+            neighbours (int): maximal number of the neighbours.
+            kinds (Tuple[str], optional): kinds of cached models. Defaults to ('model',).
 
-        if nmodels is None:
-            # here we take all files that are in cache
-            cache_n = np.arange(len(files))
+        Returns:
+            names (List[str]): names of the neighbours (empty if there is no the same family models).
+            weights (List[float]): inverse distance weights (only exact matches
+            are taken if they exist).
+        """
+        distances = {name: signature_distance(entries[name].get('signature'), self.signature)
+                     for name in self._suitable(entries, kinds)}
+        names = sorted([name for name in distances if distances[name] < np.inf],
+                       key=lambda name: (distances[name], entries[name]['loss'] or np.inf))
+        names = names[:neighbours]
+        if len(names) == 0:
+            return [], []
+        distance = np.array([distances[name] for name in names])
+        if distance.min() == 0:
+            weights = (distance == 0).astype(float)
         else:
-            # here we take random nmodels from the cache
-            cache_n = np.random.choice(len(files), nmodels, replace=False)
+            weights = 1 / distance
+        weights = weights / weights.sum()
+        return ([name for name, weight in zip(names, weights) if weight > 0],
+                [float(weight) for weight in weights if weight > 0])
+
+    def _memory_estimate(self, model: torch.nn.Module) -> int:
+        """ Rough memory estimate of the candidate evaluation: parameters and
+            layer outputs in all grid points (values and two derivative orders).
+
+        Args:
+            model (torch.nn.Module): candidate model.
 
-        return cache_n
+        Returns:
+            int: memory estimate in bytes.
+        """
+        params = list(model.parameters())
+        element_size = params[0].element_size()
+        n_params = sum(param.numel() for param in params)
+        widths = sum(layer.out_features for layer in model.modules()
+                     if hasattr(layer, 'out_features'))
+        n_points = self.grid.reshape(-1, self.grid.shape[-1]).shape[0]
+        return element_size * (n_params + 3 * n_points * widths)
 
     @staticmethod
-    def _model_reform(init_model: Union[torch.nn.Sequential, torch.nn.ModuleList],
-                     model: Union[torch.nn.Sequential, torch.nn.ModuleList]):
+    def _screening_mask(n_points: int, seed: int = 0) -> callable:
+        """ Creates mask function for the random subsample of points. The mask
+            depends only on the number of points, so sides of periodic
+            conditions get the same subsample.
+
+        Args:
+            n_points (int): maximal number of points taken from every point set.
+            seed (int, optional): random seed. Defaults to 0.
+
+        Returns:
+            callable: mask function.
         """
-        As some models are nn.Sequential class objects,
-        but another models are nn.Module class objects.
-        This method does checking the solver model (init_model)
-        and the cache model (model).
+
+        def mask_fn(points: torch.Tensor) -> torch.Tensor:
+            n = points.shape[0]
+            mask = torch.zeros(n, dtype=torch.bool)
+            generator = torch.Generator().manual_seed(seed)
+            mask[torch.randperm(n, generator=generator)[:n_points]] = True
+            return mask.to(points.device)
+
+        return mask_fn
+
+    def _score_candidates(self,
+                          names: List[str],
+                          entries: dict,
+                          solution_fn: callable,
+                          workers: Union[int, None] = None,
+                          memory: Union[int, None] = None,
+                          save_graph: bool = False) -> Tuple[dict, Union[dict, None]]:
+        """ Loads and evaluates the candidates by the pool of threads.
+
         Args:
-            init_model (nn.Sequential or nn.ModuleList): solver model.
-            model (nn.Sequential or nn.ModuleList): cache model.
+            names (List[str]): names of the candidates.
+            entries (dict): index entries.
+            solution_fn (callable): function, that creates Solution for the placeholder model.
+            workers (Union[int, None], optional): number of threads. Defaults to None (one thread).
+            memory (Union[int, None], optional): memory budget in bytes. Defaults to None.
+            save_graph (bool, optional): responsible for saving the computational graph. Defaults to False.
+
         Returns:
-            init_model (nn.Sequential or nn.ModuleList): checked init_model.
-            model (nn.Sequential or nn.ModuleList): checked model.
+            losses (dict): loss of every evaluated candidate.
+            best_checkpoint (Union[dict, None]): checkpoint of the best candidate.
         """
-        try:
-            model[0]
-        except:
-            model = model.model
 
-        try:
-            init_model[0]
-        except:
-            init_model = init_model.model
+        device = device_type()
+        budget = _MemoryBudget(memory)
+        local = threading.local()
+        lock = threading.Lock()
+        losses = {}
+        best = {'loss': np.inf, 'checkpoint': None}
+
+        def score(name: str) -> None:
+            try:
+                checkpoint = self._load(os.path.join(self.cache_dir, entries[name]['file']))
+            except Exception:
+                return
+            model = checkpoint['model'].to(device)
+            if not hasattr(local, 'solution'):
+                local.proxy = _CandidateModel()
+                local.solution = solution_fn(local.proxy)
+            with budget.reserve(self._memory_estimate(model)):
+                local.proxy.model = model
+                loss, _ = local.solution.evaluate(save_graph=save_graph)
+                local.proxy.model = None
+            loss = float(loss)
+            with lock:
+                losses[name] = loss
+                if loss < best['loss']:
+                    best['loss'] = loss
+                    best['checkpoint'] = {'model': model,
+                                          'model_state_dict': model.state_dict(),
+                                          'optimizer': checkpoint.get('optimizer'),
+                                          'scheduler': checkpoint.get('scheduler'),
+                                          'name': name}
+
+        workers = 1 if workers is None else workers
+        if workers == 1:
+            for name in names:
+                score(name)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(score, names))
 
-        return init_model, model
+        return losses, best['checkpoint']
 
     def cache_lookup(self,
                      lambda_operator: float = 1.,
                      lambda_bound: float = 1.,
                      nmodels: Union[int, None] = None,
                      save_graph: bool = False,
-                     cache_verbose: bool = False) -> Union[None, dict, torch.nn.Module]:
+                     cache_verbose: bool = False,
+                     workers: Union[int, None] = None,
+                     memory: Union[int, None] = None,
+                     screening: Union[int, None] = None,
+                     screening_points: int = 256,
+                     neighbours: Union[int, None] = None,
+                     blend: bool = False) -> Union[None, dict, torch.nn.Module]:
         """Looking for the best model (min loss) model from the cache files.
+        Candidates are chosen by the cache index (see CacheIndex), only they are loaded
+        and evaluated. Candidates are loaded and evaluated by the pool of threads.
+        With *screening* all candidates are scored on the random subsample of
+        collocation and boundary points first, and only the best ones are evaluated on the whole grid.
+        With *neighbours* candidates are the nearest solved problems of the same
+        equation family (see equation_signature), with *blend* their outputs are
+        blended with inverse distance weights instead of the evaluation.
 
         Args:
             lambda_operator (float, optional): regulariazation parameter for operator term in loss. Defaults to 1.
@@ -321,101 +1370,298 @@ class CachePreprocessing:
             nmodels (Union[int, None], optional): maximal number of models that are taken from cache dir. Defaults to None.
             save_graph (bool, optional): responsible for saving the computational graph. Defaults to False.
             cache_verbose (bool, optional): verbose cache operations. Defaults to False.
+            workers (Union[int, None], optional): number of threads that evaluate candidates.
+                Defaults to None (one thread).
+            memory (Union[int, None], optional): memory budget (bytes) for candidates
+                evaluated at the same time. Defaults to None (unlimited).
+            screening (Union[int, None], optional): number of candidates, that pass
+                the screening to the full evaluation. Defaults to None (no screening).
+            screening_points (int, optional): maximal number of points taken from
+                the grid and from every boundary condition for the screening. Defaults to 256.
+            neighbours (Union[int, None], optional): number of the nearest problems of the
+                equation family taken as candidates. Defaults to None (all models are ranked).
+            blend (bool, optional): blend the neighbours instead of choosing the best one. Defaults to False.
 
         Returns:
-            Union[None, dict, torch.Tensor]: best model with optimizator state.
+            Union[None, dict, torch.Tensor]: best model with optimizator state
+            (reuse of the model is recorded in the cache index).
         """
 
-        files = glob.glob(CacheUtils().cache_dir + '\*.tar')
-        if len(files) == 0:
-            best_checkpoint = None
-            return best_checkpoint
+        if not os.path.isdir(self.cache_dir):
+            return None
+        index = CacheIndex(self.cache_dir)
+        entries = self._index_legacy(index, index.load())
+        candidates = self._candidates(entries, nmodels)
+        if neighbours is not None:
+            names, weights = self._neighbours(entries, neighbours)
+            if blend and len(names) > 0:
+                return self._blend_checkpoint(index, entries, names, weights, cache_verbose)
+            if len(names) > 0:
+                candidates = names
+        if len(candidates) == 0:
+            return None
+
+        def solution_fn(points_mask: Union[callable, None]) -> callable:
+            return lambda model: Solution(self.grid, self.equal_cls,
+                                          model, self.mode, self.weak_form,
+                                          lambda_operator, lambda_bound, tol=0,
+                                          derivative_points=2, points_mask=points_mask)
+
+        if screening is not None and len(candidates) > screening:
+            losses, _ = self._score_candidates(
+                candidates, entries, solution_fn(self._screening_mask(screening_points)),
+                workers, memory)
+            candidates = sorted(losses, key=losses.get)[:screening]
+            if cache_verbose:
+                print('screening: {} of {} models passed'.format(len(candidates), len(losses)))
 
-        cache_n = self._cache_files(files, nmodels)
+        losses, best_checkpoint = self._score_candidates(
+            candidates, entries, solution_fn(None), workers, memory, save_graph)
+        if best_checkpoint is not None:
+            index.hit(best_checkpoint['name'])
+            if cache_verbose:
+                name = best_checkpoint['name']
+                print('best_model={} , loss={}'.format(name, losses[name]))
 
-        min_loss = np.inf
-        best_checkpoint = {}
+        return best_checkpoint
 
-        device = device_type()
+    def _blend_checkpoint(self,
+                          index: CacheIndex,
+                          entries: dict,
+                          names: List[str],
+                          weights: List[float],
+                          cache_verbose: bool = False) -> Union[dict, None]:
+        """ Checkpoint of the blended neighbours (see BlendedModel),
+            neighbours that could not be loaded (e.g. evicted by another process) are skipped.
+        """
+        models, loaded, loaded_weights = [], [], []
+        for name, weight in zip(names, weights):
+            try:
+                models.append(self._load(os.path.join(self.cache_dir, entries[name]['file']))['model'])
+            except Exception:
+                continue
+            loaded.append(name)
+            loaded_weights.append(weight)
+        if len(models) == 0:
+            return None
+        names = loaded
+        weights = [weight / sum(loaded_weights) for weight in loaded_weights]
+        if len(models) == 1:
+            model = models[0]
+        else:
+            model = BlendedModel(models, weights)
+        model = model.to(device_type())
+        for name in names:
+            index.hit(name)
+        if cache_verbose:
+            print('blended models={} , weights={}'.format(names, weights))
+        return {'model': model, 'model_state_dict': model.state_dict(), 'name': names[0]}
+
+    def _mat_values(self, entry: dict) -> torch.Tensor:
+        """ Values of the cached model on the *mat* grid: *mat* models are
+            interpolated, neural networks are evaluated in the grid points.
 
-        for i in cache_n:
-            file = files[i]
-            checkpoint = torch.load(file)
+        Args:
+            entry (dict): index entry.
 
+        Returns:
+            torch.Tensor: *mat* model.
+        """
+        checkpoint = self._load(os.path.join(self.cache_dir, entry['file']))
+        if 'values' in checkpoint:
+            values = mat_interpolate(checkpoint['values'].to(self.model),
+                                     checkpoint['axes'], mat_axes(self.grid))
+        else:
             model = checkpoint['model']
-            model.load_state_dict(checkpoint['model_state_dict'])
+            points = self._points().to(next(model.parameters()))
+            with torch.no_grad():
+                values = model(points).T.reshape(self.model.shape)
+        return values.to(self.model)
+
+    def mat_lookup(self,
+                   lambda_operator: float = 1.,
+                   lambda_bound: float = 1.,
+                   nmodels: Union[int, None] = None,
+                   cache_verbose: bool = False,
+                   neighbours: Union[int, None] = None,
+                   blend: bool = False) -> Union[torch.Tensor, None]:
+        """ Looking for the best (min loss) initial *mat* model from the cache:
+            cached *mat* models and neural networks are brought to the grid
+            and evaluated in *mat* mode. With *neighbours* candidates are the nearest
+            solved problems of the equation family, with *blend* they are blended.
 
-            # this one for the input shape fix if needed
+        Args:
+            lambda_operator (float, optional): regulariazation parameter for operator term in loss. Defaults to 1.
+            lambda_bound (float, optional): regulariazation parameter for boundary term in loss. Defaults to 1.
+            nmodels (Union[int, None], optional): maximal number of models that are taken from cache dir. Defaults to None.
+            cache_verbose (bool, optional): verbose cache operations. Defaults to False.
+            neighbours (Union[int, None], optional): number of the nearest problems of the
+                equation family taken as candidates. Defaults to None (all models are ranked).
+            blend (bool, optional): blend the neighbours instead of choosing the best one. Defaults to False.
 
-            solver_model, cache_model = self._model_reform(self.model, model)
+        Returns:
+            Union[torch.Tensor, None]: best *mat* model (None if cache has no suitable models).
+        """
 
-            if cache_model[0].in_features != solver_model[0].in_features:
-                continue
+        if not os.path.isdir(self.cache_dir):
+            return None
+        index = CacheIndex(self.cache_dir)
+        entries = self._index_legacy(index, index.load())
+        kinds = ('mat', 'model')
+        candidates = self._candidates(entries, nmodels, kinds)
+        if neighbours is not None:
+            names, weights = self._neighbours(entries, neighbours, kinds)
+            if blend and len(names) > 0:
+                blended, loaded, loaded_weights = [], [], []
+                for name, weight in zip(names, weights):
+                    try:
+                        blended.append(self._mat_values(entries[name]))
+                    except Exception:
+                        continue
+                    loaded.append(name)
+                    loaded_weights.append(weight)
+                    index.hit(name)
+                if len(blended) == 0:
+                    return None
+                if cache_verbose:
+                    print('blended models={} , weights={}'.format(loaded, loaded_weights))
+                return sum(weight / sum(loaded_weights) * values
+                           for weight, values in zip(loaded_weights, blended))
+            if len(names) > 0:
+                candidates = names
+
+        min_loss, best_name, best_values = np.inf, None, None
+        for name in candidates:
             try:
-                if count_output(model) != count_output(self.model):
-                    continue
+                values = self._mat_values(entries[name])
             except Exception:
                 continue
+            loss, _ = Solution(self.grid, self.equal_cls, values, self.mode, self.weak_form,
+                               lambda_operator, lambda_bound, tol=0,
+                               derivative_points=2).evaluate(save_graph=False)
+            if float(loss) < min_loss:
+                min_loss, best_name, best_values = float(loss), name, values
+
+        if best_name is not None:
+            index.hit(best_name)
+            if cache_verbose:
+                print('best_model={} , loss={}'.format(best_name, min_loss))
+        return best_values
 
-            model = model.to(device)
-            loss, loss_normalized = Solution(self.grid, self.equal_cls,
-                                             model, self.mode, self.weak_form,
-                                             lambda_operator, lambda_bound, tol=0,
-                                             derivative_points=2).evaluate(save_graph=save_graph)
+    def _last_layer_fit(self, grid: torch.Tensor, targets: torch.Tensor) -> bool:
+        """ Closed-form least-squares fit (with small ridge regularization)
+            of the last linear layer on the frozen features of the previous layers.
 
-            if loss < min_loss:
-                min_loss = loss
-                best_checkpoint['model'] = model
-                best_checkpoint['model_state_dict'] = model.state_dict()
-                if cache_verbose:
-                    print('best_model_num={} , loss={}'.format(i, min_loss.item()))
-
-        if best_checkpoint == {}:
-            best_checkpoint = None
+        Args:
+            grid (torch.Tensor): grid points.
+            targets (torch.Tensor): cache model outputs.
 
-        return best_checkpoint
+        Returns:
+            bool: True if the model is torch.nn.Sequential with the last linear layer (fit is done).
+        """
+        if not isinstance(self.model, torch.nn.Sequential) or \
+                not isinstance(self.model[-1], torch.nn.Linear):
+            return False
+        last = self.model[-1]
+        with torch.no_grad():
+            features = self.model[:-1](grid)
+            if last.bias is not None:
+                features = torch.cat((features, torch.ones_like(features[:, :1])), dim=1)
+            features, targets = features.double(), targets.double()
+            gram = features.T @ features
+            ridge = 1e-6 * torch.mean(torch.diag(gram))
+            coeffs = torch.linalg.solve(gram + ridge * torch.eye(len(gram), dtype=gram.dtype,
+                                                                 device=gram.device),
+                                        features.T @ targets)
+            last.weight.copy_(coeffs[:last.in_features].T)
+            if last.bias is not None:
+                last.bias.copy_(coeffs[-1])
+        return True
 
     def scheme_interp(self,
                       trained_model: torch.nn.Module,
-                      cache_verbose: bool = False) -> torch.nn.Module:
+                      cache_verbose: bool = False,
+                      tolerance: float = 0.1,
+                      budget: int = 500,
+                      batch_size: int = 4096) -> torch.nn.Module:
         """ If the cache model has another arcitechure to user's model,
             we will not be able to use it. So we train user's model on the
-            outputs of cache model.
+            outputs of cache model. At first the last linear layer is fitted
+            in closed form, if it is not enough, the model is trained by LBFGS
+            on the cache model outputs together with its own PDE loss (on the fixed
+            subsample of points for large grids). Training stops as soon as the PDE
+            loss of the user's model is close to the PDE loss of the cache model
+            or the iterations budget is exhausted.
 
         Args:
             trained_model (torch.nn.Module): the best model (min loss) from cache.
             cache_verbose (bool, optional): verbose on/off of cache operations. Defaults to False.
+            tolerance (float, optional): PDE loss of the user's model should be less than
+                (1 + tolerance) * (PDE loss of the cache model). Defaults to 0.1.
+            budget (int, optional): maximal number of LBFGS iterations. Defaults to 500.
+            batch_size (int, optional): maximal number of points for training. Defaults to 4096.
 
         Returns:
             self.model (torch.nn.Module): model trained on the cache model outputs.
 
         """
-        optimizer = torch.optim.Adam(self.model.parameters(), lr=0.001)
+        grid = self.grid.detach()
+        with torch.no_grad():
+            targets = trained_model(grid).detach()
+
+        def solution(model: torch.nn.Module,
+                     points_mask: Union[callable, None] = None) -> Solution:
+            return Solution(self.grid, self.equal_cls, model, self.mode, self.weak_form,
+                            1, 1, tol=0, derivative_points=2, points_mask=points_mask)
+
+        def pde_loss(solution_cls: Solution) -> float:
+            loss, _ = solution_cls.evaluate(save_graph=False)
+            return float(loss)
+
+        threshold = (1 + tolerance) * pde_loss(solution(trained_model))
+        student = solution(self.model)
+
+        state = deepcopy(self.model.state_dict())
+        if self._last_layer_fit(grid, targets):
+            loss = pde_loss(student)
+            if cache_verbose:
+                print('Interpolate from trained model: last layer fit, loss={}'.format(loss))
+            if loss <= threshold:
+                return self.model
+            self.model.load_state_dict(state)
+
+        if len(grid) > batch_size:
+            points_mask = self._screening_mask(batch_size)
+            batch = points_mask(grid)
+        else:
+            points_mask, batch = None, torch.ones(len(grid), dtype=torch.bool, device=grid.device)
+        train_solution = solution(self.model, points_mask)
 
-        loss = torch.mean(torch.square(
-            trained_model(self.grid) - self.model(self.grid)))
+        max_iter = 20
+        optimizer = torch.optim.LBFGS(self.model.parameters(), lr=1, max_iter=max_iter,
+                                      line_search_fn='strong_wolfe')
 
         def closure():
             optimizer.zero_grad()
-            loss = torch.mean((trained_model(self.grid) - self.model(self.grid)) ** 2)
+            loss, _ = train_solution.evaluate()
+            loss = loss + torch.mean((self.model(grid[batch]) - targets[batch]) ** 2)
             loss.backward()
             return loss
 
-        t = 0
-        while loss > 1e-5 and t < 1e5:
+        for step in range(max(1, budget // max_iter)):
             optimizer.step(closure)
-            loss = torch.mean(torch.square(
-                trained_model(self.grid) - self.model(self.grid)))
-            t += 1
+            loss = pde_loss(student)
             if cache_verbose:
                 print('Interpolate from trained model t={}, loss={}'.format(
-                    t, loss))
+                    (step + 1) * max_iter, loss))
+            if loss <= threshold:
+                break
 
         return self.model
 
     def cache_retrain(self,
                       cache_checkpoint: dict,
-                      cache_verbose: bool = False) -> torch.nn.Module:
+                      cache_verbose: bool = False) -> Tuple[torch.nn.Module, Union[dict, None]]:
         """ The comparison of the user's model and cache model architecture.
             If they are same, we will use model from cache. In the other case
             we use interpolation (scheme_interp method)
@@ -426,12 +1672,14 @@ class CachePreprocessing:
 
         Returns:
             model (torch.nn.Module): the resulting model.
-            optimizer_state (dict): the state of the optimizer.
+            optimizer_state (dict): the state of the optimizer and the learning rate scheduler
+            ('optimizer' and 'scheduler' keys), None if the model is not taken from cache as is.
         """
 
         # do nothing if cache is empty
         if cache_checkpoint is None:
-            return self.model
+            return self.model, None
+        optimizer_state = None
         # if models have the same structure use the cache model state,
         # and the cache model has ordinary structure
         if str(cache_checkpoint['model']) == str(self.model) and \
@@ -440,6 +1688,9 @@ class CachePreprocessing:
             model = cache_checkpoint['model']
             model.load_state_dict(cache_checkpoint['model_state_dict'])
             model.train()
+            if cache_checkpoint.get('optimizer') is not None:
+                optimizer_state = {'optimizer': cache_checkpoint['optimizer'],
+                                   'scheduler': cache_checkpoint.get('scheduler')}
 
             if cache_verbose:
                 print('Using model from cache')
@@ -450,7 +1701,7 @@ class CachePreprocessing:
             cache_model.eval()
             model = self.scheme_interp(
                 cache_model, cache_verbose=cache_verbose)
-        return model
+        return model, optimizer_state
 
 
 class Cache():
@@ -458,16 +1709,19 @@ class Cache():
     Prepares user's model. Serves for computing acceleration.\n
     Saves the trained model to the cache, and subsequently it is possible to use pre-trained model
     (if it saved and if the new model is structurally similar) to sped up computing.\n
-    If there isn't pre-trained model in cache, the training process will start from the beginning.
+    If there isn't pre-trained model in cache, the training process will start from the beginning.\n
+    If the cached model is taken as is, its optimizer and learning rate scheduler states
+    are available in *optimizer_state* attribute.
     """
 
     def __init__(self,
                  grid: torch.Tensor,
-                 equal_cls: Equation,
+                 equal_cls: Any,
                  model: Union[torch.Tensor, torch.nn.Module],
                  mode: str,
                  weak_form: Union[list, None],
-                 mixed_precision: bool):
+                 mixed_precision: bool,
+                 cache_dir: Union[str, None] = None):
         """
         Args:
             grid (torch.Tensor): grid (domain discretization)
@@ -478,6 +1732,8 @@ class Cache():
             weak_form (Union[list, None]): list that contains basis function for weak solution.
                                            If None: soluion in strong form.
             mixed_precision (bool): flag for on/off torch.amp.
+            cache_dir (Union[str, None], optional): cache directory. Defaults to None
+                                                    (default CacheUtils directory).
         """
         self.grid = grid
         self.equal_cls = equal_cls
@@ -485,15 +1741,19 @@ class Cache():
         self.mode = mode
         self.weak_form = weak_form
         self.mixed_precision = mixed_precision
+        self.cache_dir = cache_dir
+        self.optimizer_state = None
         self.cache_preprocessing = CachePreprocessing(grid, equal_cls, model, mode,
-                                                        weak_form, mixed_precision)
+                                                        weak_form, mixed_precision,
+                                                        cache_dir)
 
     def _cache_nn(self,
                  nmodels: Union[int, None],
                  lambda_operator: float,
                  lambda_bound: float,
                  cache_verbose: bool,
-                 model_randomize_parameter: Union[float, None]):
+                 model_randomize_parameter: Union[float, None],
+                 **lookup_params):
         """  Restores the model from the cache and uses it for *NN, autograd* modes.
 
         Args:
@@ -503,6 +1763,8 @@ class Cache():
             cache_verbose (bool): verbose cache operations.
             model_randomize_parameter (Union[float, None]): some error for resulting
             model weights to to avoid local optima.
+            **lookup_params: other parameters of CachePreprocessing.cache_lookup
+            (workers, memory, screening, screening_points, neighbours, blend).
 
         Returns:
             model (torch.nn.Module): final model for optimization
@@ -513,10 +1775,11 @@ class Cache():
         cache_checkpoint = self.cache_preprocessing.cache_lookup(nmodels=nmodels,
                                                                 cache_verbose=cache_verbose,
                                                                 lambda_operator=lambda_operator,
-                                                                lambda_bound=lambda_bound)
+                                                                lambda_bound=lambda_bound,
+                                                                **lookup_params)
 
-        model = self.cache_preprocessing.cache_retrain(cache_checkpoint,
-                                                        cache_verbose=cache_verbose)
+        model, self.optimizer_state = self.cache_preprocessing.cache_retrain(
+            cache_checkpoint, cache_verbose=cache_verbose)
         model.apply(r)
 
         return model
@@ -527,7 +1790,8 @@ class Cache():
                   lambda_bound: float,
                   cache_verbose: bool,
                   model_randomize_parameter: Union[float, None],
-                  cache_model: Union[torch.nn.Module, None]) -> torch.Tensor:
+                  neighbours: Union[int, None] = None,
+                  blend: bool = False) -> torch.Tensor:
         """ Restores the model from the cache and uses it for *mat* mode.
 
         Args:
@@ -537,41 +1801,25 @@ class Cache():
             cache_verbose (bool): verbose cache operations.
             model_randomize_parameter (Union[float, None]): some error for resulting
             model weights to to avoid local optima.
-            cache_model (Union[torch.nn.Module, None]): user defined cache model.
+            neighbours (Union[int, None], optional): number of the nearest problems
+            of the equation family. Defaults to None.
+            blend (bool, optional): blend the neighbours. Defaults to False.
 
         Returns:
             model (torch.Tensor): resulting model for *mat* mode.
         """
 
-        nn_grid, cache_model = CacheUtils.grid_model_mat(self.model, self.grid, cache_model)
-        operator = deepcopy(self.equal_cls.operator)
-        bconds = deepcopy(self.equal_cls.bconds)
-        operator = CacheUtils.mat_op_coeff(operator)
-        r = create_random_fn(model_randomize_parameter)
-        eq = Equation(nn_grid, operator, bconds).set_strategy('autograd')
-        model_cls = CachePreprocessing(nn_grid, eq, cache_model, 'autograd', self.weak_form,
-                                        self.mixed_precision)
-
-        cache_checkpoint = model_cls.cache_lookup(
-            nmodels=nmodels,
-            cache_verbose=cache_verbose,
-            lambda_bound=lambda_bound,
-            lambda_operator=lambda_operator)
-
-        if cache_checkpoint is not None:
-            prepared_model = model_cls.cache_retrain(
-                cache_checkpoint,
-                cache_verbose=cache_verbose)
-
-            prepared_model.apply(r)
-
-            model = prepared_model(nn_grid).reshape(
-                self.cache_preprocessing.model.shape).detach()
-
-        else:
-            model = self.cache_preprocessing.model
-
-        return model
+        values = self.cache_preprocessing.mat_lookup(lambda_operator=lambda_operator,
+                                                     lambda_bound=lambda_bound,
+                                                     nmodels=nmodels,
+                                                     cache_verbose=cache_verbose,
+                                                     neighbours=neighbours,
+                                                     blend=blend)
+        if values is None:
+            return self.model
+        if model_randomize_parameter:
+            values = values + (2 * torch.randn_like(values) - 1) * model_randomize_parameter
+        return values
 
     def cache(self,
               nmodels: Union[int, None],
@@ -579,7 +1827,12 @@ class Cache():
               lambda_bound: float,
               cache_verbose: bool,
               model_randomize_parameter: Union[float, None],
-              cache_model: torch.nn.Module):
+              cache_workers: Union[int, None] = None,
+              cache_memory: Union[int, None] = None,
+              cache_screening: Union[int, None] = None,
+              cache_screening_points: int = 256,
+              cache_neighbours: Union[int, None] = None,
+              cache_blend: bool = False):
         """ Wrap for cache_mat and cache_nn methods.
 
         Args:
@@ -589,16 +1842,35 @@ class Cache():
             cache_verbose (bool):  verbose cache operations.
             model_randomize_parameter (Union[float, None]): some error for resulting
             model weights to to avoid local optima.
-            cache_model (Union[torch.nn.Module, None]): user defined cache model.
+            cache_workers (Union[int, None], optional): number of threads that evaluate
+                cached models. Defaults to None (one thread).
+            cache_memory (Union[int, None], optional): memory budget (bytes) for cached
+                models evaluated at the same time. Defaults to None (unlimited).
+            cache_screening (Union[int, None], optional): number of cached models, that pass
+                the screening on the subsample to the full evaluation. Defaults to None (no screening).
+            cache_screening_points (int, optional): maximal number of grid and boundary
+                points for the screening. Defaults to 256.
+            cache_neighbours (Union[int, None], optional): number of the nearest solved problems
+                of the equation family (see equation_signature) taken as candidates.
+                Defaults to None (all cached models are ranked).
+            cache_blend (bool, optional): blend the nearest problems solutions with inverse
+                distance weights. Defaults to False.
 
         Returns:
             cache.cache_nn or cache.cache_mat
         """
 
+        lookup_params = {'workers': cache_workers,
+                         'memory': cache_memory,
+                         'screening': cache_screening,
+                         'screening_points': cache_screening_points,
+                         'neighbours': cache_neighbours,
+                         'blend': cache_blend}
         if self.mode != 'mat':
             return self._cache_nn(nmodels, lambda_operator, lambda_bound,
-                                 cache_verbose, model_randomize_parameter)
+                                 cache_verbose, model_randomize_parameter,
+                                 **lookup_params)
         elif self.mode == 'mat':
             return self._cache_mat(nmodels, lambda_operator, lambda_bound,
                                   cache_verbose, model_randomize_parameter,
-                                  cache_model)
+                                  cache_neighbours, cache_blend)
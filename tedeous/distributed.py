@@ -0,0 +1,219 @@
+"""Module for data-parallel training over sharded collocation points."""
+
+import os
+from typing import Union, Tuple, Any
+import torch
+import torch.distributed as dist
+
+from tedeous.points_type import Points_type
+from tedeous.utils import bcond_select
+
+
+def init_distributed(backend: str = 'gloo') -> None:
+    """ Initializes the default process group if it is not initialized yet.
+        Rank and world size are taken from the environment (torchrun sets them),
+        otherwise single process group is created.
+
+    Args:
+        backend (str, optional): torch.distributed backend. Defaults to 'gloo'.
+    """
+    if dist.is_initialized():
+        return
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', '29500')
+    os.environ.setdefault('RANK', '0')
+    os.environ.setdefault('WORLD_SIZE', '1')
+    dist.init_process_group(backend=backend, init_method='env://')
+
+
+def is_distributed() -> bool:
+    """ Checks if the default process group is initialized.
+
+    Returns:
+        bool: True if training is data-parallel.
+    """
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    """ Rank of the current process (0 if not distributed).
+    """
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    """ Number of processes in the group (1 if not distributed).
+    """
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    """ Only the main process prints, plots and saves models.
+    """
+    return get_rank() == 0
+
+
+def shard_mask(points: torch.Tensor) -> torch.Tensor:
+    """ Strided shard of the points for the current rank. Point sets that
+        are smaller than the world size are kept on every rank.
+
+    Args:
+        points (torch.Tensor): points (first dimension is the number of points).
+
+    Returns:
+        torch.Tensor: boolean mask of the points belong to the current rank.
+    """
+    n_points = points.shape[0]
+    world_size = get_world_size()
+    if n_points < world_size:
+        return torch.ones(n_points, dtype=torch.bool, device=points.device)
+    return torch.arange(n_points, device=points.device) % world_size == get_rank()
+
+
+def _shard_prepared(obj, n_points: int, mask: torch.Tensor):
+    """ Recursively applies the mask to every per-point tensor of the prepared operator
+        (shifted grids for *NN* mode, tensor coefficients for *NN* and *autograd* modes).
+    """
+    if isinstance(obj, torch.nn.Parameter):
+        return obj
+    if isinstance(obj, torch.Tensor):
+        if obj.dim() > 0 and obj.shape[0] == n_points and n_points > 1:
+            return obj[mask]
+        return obj
+    if isinstance(obj, dict):
+        return {key: _shard_prepared(value, n_points, mask) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_shard_prepared(value, n_points, mask) for value in obj]
+    if isinstance(obj, tuple):
+        return tuple(_shard_prepared(value, n_points, mask) for value in obj)
+    return obj
+
+
+def shard_problem(grid: torch.Tensor,
+                  prepared_operator: list,
+                  prepared_bconds: list,
+                  mode: str,
+                  mask_fn: callable = shard_mask) -> Tuple[torch.Tensor, list, list]:
+    """ Shards collocation points of the prepared problem across ranks.
+        In *NN* mode boundary conditions stay replicated on every rank, since
+        they are prepared for point types. Averaging of the identical
+        contributions during gradient all-reduce keeps them exact.
+
+    Args:
+        grid (torch.Tensor): grid (domain discretization).
+        prepared_operator (list): result of operator_prepare().
+        prepared_bconds (list): result of bnd_prepare().
+        mode (str): *NN or autograd*.
+        mask_fn (callable, optional): function, that returns boolean mask of the
+            selected points. Defaults to shard_mask (points of the current rank).
+
+    Raises:
+        NotImplementedError: *mat* mode grids could not be sharded.
+
+    Returns:
+        grid (torch.Tensor): grid shard for the operator computation.
+        prepared_operator (list): operator shard.
+        prepared_bconds (list): boundary conditions shard.
+    """
+    if mode == 'autograd':
+        mask = mask_fn(grid)
+        prepared_operator = _shard_prepared(prepared_operator, grid.shape[0], mask)
+        prepared_bconds = bcond_select(prepared_bconds, mask_fn)
+        grid = grid[mask].detach()
+    elif mode == 'NN':
+        central = Points_type(grid).grid_sort()['central']
+        mask = mask_fn(central)
+        prepared_operator = _shard_prepared(prepared_operator, central.shape[0], mask)
+    else:
+        raise NotImplementedError('Data-parallel training is not available for *mat* mode.')
+    return grid, prepared_operator, prepared_bconds
+
+
+def shard_weights(counts: torch.Tensor) -> torch.Tensor:
+    """ Weights of the local mean terms (mean over the points of the shard),
+        so the average of the weighted terms over ranks is the mean over all points:
+        w = n_local * world_size / sum(n_local). Strided shards may differ in size
+        by one point, replicated terms (n_local is the same on every rank) get w = 1.
+
+    Args:
+        counts (torch.Tensor): local number of points of every term.
+
+    Returns:
+        torch.Tensor: weight of every term.
+    """
+    counts = counts.detach().clone().double()
+    total = counts.clone()
+    if is_distributed():
+        dist.all_reduce(total, op=dist.ReduceOp.SUM)
+    return counts * get_world_size() / torch.clamp(total, min=1)
+
+
+def all_reduce_mean(value: Union[torch.Tensor, float]) -> torch.Tensor:
+    """ Averages the (detached) value across ranks. Serves to keep the
+        stop criteria consistent on every rank.
+
+    Args:
+        value (Union[torch.Tensor, float]): local value.
+
+    Returns:
+        torch.Tensor: value averaged over the group.
+    """
+    value = torch.as_tensor(value).detach().clone().float()
+    if is_distributed():
+        dist.all_reduce(value, op=dist.ReduceOp.SUM)
+        value /= get_world_size()
+    return value
+
+
+def all_reduce_gradients(model: Union[torch.nn.Module, torch.Tensor]) -> None:
+    """ Averages gradients of the model parameters across ranks with one
+        flattened all-reduce. The local loss terms should be weighted by the
+        shard sizes (see shard_weights) to get the gradients of the loss on all points.
+
+    Args:
+        model (Union[torch.nn.Module, torch.Tensor]): *NN or autograd* model.
+    """
+    if not is_distributed():
+        return
+    params = [p for p in model.parameters() if p.grad is not None]
+    if len(params) == 0:
+        return
+    grads = torch.cat([p.grad.reshape(-1) for p in params])
+    dist.all_reduce(grads, op=dist.ReduceOp.SUM)
+    grads /= get_world_size()
+    offset = 0
+    for p in params:
+        numel = p.grad.numel()
+        p.grad.copy_(grads[offset:offset + numel].reshape(p.grad.shape))
+        offset += numel
+
+
+def broadcast_object(obj: Any, src: int = 0) -> Any:
+    """ Sends the (picklable) object of the source rank to every rank.
+
+    Args:
+        obj (Any): object (ignored on the other ranks).
+        src (int, optional): source rank. Defaults to 0.
+
+    Returns:
+        Any: object of the source rank.
+    """
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def broadcast_parameters(model: Union[torch.nn.Module, torch.Tensor], src: int = 0) -> None:
+    """ Makes model parameters identical on every rank.
+
+    Args:
+        model (Union[torch.nn.Module, torch.Tensor]): *NN or autograd* model.
+        src (int, optional): source rank. Defaults to 0.
+    """
+    if not is_distributed():
+        return
+    with torch.no_grad():
+        for p in model.parameters():
+            dist.broadcast(p.data, src=src)
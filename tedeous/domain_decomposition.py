@@ -0,0 +1,312 @@
+"""Module for domain decomposition (XPINN-like) solution of P/O DE."""
+
+import multiprocessing
+from copy import deepcopy
+from typing import Union, List
+import torch
+
+from tedeous.derivative import Derivative_autograd
+from tedeous.device import check_device, device_type
+from tedeous.input_preprocessing import Operator_bcond_preproc, EquationMixin
+from tedeous.solver import Solver
+from tedeous.utils import bcond_select
+
+
+_worker_dd = None
+
+
+def _subdomain_init(dd: 'DomainDecomposition',
+                    problems: list,
+                    solve_kwargs: dict,
+                    threads: int) -> None:
+    """ Initializer of the subdomains training worker, the worker keeps
+        the subdomain problems of the current iteration inherited by fork.
+    """
+    global _worker_dd
+    torch.set_num_threads(threads)
+    _worker_dd = (dd, problems, solve_kwargs)
+
+
+def _subdomain_train(k: int) -> torch.nn.Module:
+    """ Trains the model of k-th subdomain in the worker.
+    """
+    dd, problems, solve_kwargs = _worker_dd
+    return dd._train(k, problems[k], solve_kwargs)
+
+
+class DecomposedModel(torch.nn.Module):
+    """
+    Piecewise model assembled from subdomain models. Every point is
+    evaluated by the model of the subdomain, which core contains the point.
+    """
+    def __init__(self,
+                 models: List[torch.nn.Module],
+                 cuts: torch.Tensor,
+                 axis: int):
+        """
+        Args:
+            models (List[torch.nn.Module]): subdomain models.
+            cuts (torch.Tensor): coordinates of the interfaces along *axis*.
+            axis (int): decomposition axis.
+        """
+        super().__init__()
+        self.models = torch.nn.ModuleList(models)
+        self.register_buffer('cuts', cuts)
+        self.axis = axis
+
+    def forward(self, grid: torch.Tensor) -> torch.Tensor:
+        """ Forward pass for the decomposed model.
+
+        Args:
+            grid (torch.Tensor): calculation domain.
+
+        Returns:
+            torch.Tensor: predicted values.
+        """
+        owner = torch.bucketize(grid[:, self.axis].contiguous(), self.cuts)
+        positions, values = [], []
+        for k, model in enumerate(self.models):
+            pos = torch.where(owner == k)[0]
+            if len(pos) == 0:
+                continue
+            positions.append(pos)
+            values.append(model(grid[pos]))
+        positions = torch.cat(positions)
+        values = torch.cat(values)
+        out = torch.zeros((grid.shape[0], values.shape[-1]), dtype=values.dtype,
+                          device=values.device)
+        return out.index_put((positions,), values)
+
+
+class DomainDecomposition():
+    """
+    Splits the grid along one axis into overlapping or non-overlapping
+    subdomains, each with its own model. Subdomains are coupled by interface
+    continuity (and flux) conditions, which are generated as usual boundary
+    conditions with values taken from the neighbour models (additive Schwarz
+    iteration). Periodic conditions, whose sides fall in different subdomains,
+    couple these subdomains the same way. So between the exchanges every
+    subdomain is trained by Solver independently in its own worker process.
+    Only *autograd* mode is supported.
+    """
+
+    def __init__(self,
+                 grid: torch.Tensor,
+                 equal_cls,
+                 models: Union[List[torch.nn.Module], callable],
+                 n_subdomains: int = 2,
+                 axis: int = 0,
+                 overlap: int = 0,
+                 flux: bool = True):
+        """
+        Args:
+            grid (torch.Tensor): grid (domain discretization) in *autograd* form.
+            equal_cls (Equation_autograd): Equation_autograd object (e.g. Model.compile result).
+            models (Union[List[torch.nn.Module], callable]): list of subdomain models
+                or function that creates new model for every subdomain.
+            n_subdomains (int, optional): number of subdomains. Defaults to 2.
+            axis (int, optional): decomposition axis. Defaults to 0.
+            overlap (int, optional): number of grid layers, that subdomain takes
+                from every neighbour. Defaults to 0 (subdomains share only interface layer).
+            flux (bool, optional): add continuity of the derivative along *axis*
+                at interfaces. Defaults to True.
+        """
+        self.grid = check_device(grid)
+        self.equal_cls = equal_cls
+        self.axis = axis
+        self.flux = flux
+        if callable(models) and not isinstance(models, torch.nn.Module):
+            models = [models() for _ in range(n_subdomains)]
+        if len(models) != n_subdomains:
+            raise ValueError('Number of models should be equal to n_subdomains.')
+        self.models = list(models)
+        self.n_subdomains = n_subdomains
+
+        layers = torch.unique(self.grid[:, axis])
+        if len(layers) < 2 * n_subdomains:
+            raise ValueError('Grid is too coarse for {} subdomains.'.format(n_subdomains))
+        bounds = torch.linspace(0, len(layers) - 1, n_subdomains + 1).round().long()
+        self.cuts = layers[bounds[1:-1]]
+        self.subdomains = []
+        for k in range(n_subdomains):
+            lower = layers[max(int(bounds[k]) - overlap, 0)]
+            upper = layers[min(int(bounds[k + 1]) + overlap, len(layers) - 1)]
+            self.subdomains.append((lower, upper))
+
+    def _subdomain_mask(self, k: int) -> callable:
+        """ Creates mask function for points of k-th subdomain.
+        """
+        lower, upper = self.subdomains[k]
+
+        def mask_fn(points: torch.Tensor) -> torch.Tensor:
+            coord = points.reshape(points.shape[0], -1)[:, self.axis]
+            return (coord >= lower) & (coord <= upper)
+
+        return mask_fn
+
+    def _layer(self, value: torch.Tensor) -> torch.Tensor:
+        """ Grid points on the layer *axis=value*.
+        """
+        return self.grid[torch.isclose(self.grid[:, self.axis], value)]
+
+    def _flux_value(self, model: torch.nn.Module, points: torch.Tensor, var: int) -> torch.Tensor:
+        """ Derivative of the model along decomposition axis.
+        """
+        points = points.clone().requires_grad_(True)
+        grads, = torch.autograd.grad(model(points)[:, var].sum(), points)
+        return grads[:, self.axis].detach()
+
+    def _bop_value(self,
+                   model: torch.nn.Module,
+                   points: torch.Tensor,
+                   bop: Union[dict, None],
+                   var: int) -> torch.Tensor:
+        """ Values of the boundary operator (or of the variable if bop is None)
+            for the model in the points.
+        """
+        if bop is None:
+            with torch.no_grad():
+                return model(points)[:, var]
+        points = points.clone().requires_grad_(True)
+        derivative = Derivative_autograd(model)
+        value = sum(derivative.take_derivative(term, points) for term in bop.values())
+        return value.reshape(-1).detach()
+
+    def _periodic_bconds(self, k: int) -> list:
+        """ Periodic conditions, whose sides fall in different subdomains, as coupling
+            conditions of k-th subdomain: the side in the subdomain takes the values
+            of the other side from the model of the subdomain that owns it
+            (pairs inside the subdomain are kept by bcond_select).
+
+        Args:
+            k (int): subdomain number.
+
+        Returns:
+            list: boundary conditions in input form.
+        """
+        mask_fn = self._subdomain_mask(k)
+        bconds = []
+        for bcond in self.equal_cls.bconds:
+            if bcond['type'] != 'periodic':
+                continue
+            masks = [mask_fn(bnd) for bnd in bcond['bnd']]
+            for side, bnd in enumerate(bcond['bnd']):
+                for other, other_bnd in enumerate(bcond['bnd']):
+                    pairs = masks[side] & ~masks[other]
+                    if other == side or not pairs.any():
+                        continue
+                    partner = other_bnd[pairs]
+                    owner = torch.bucketize(partner[:, self.axis].contiguous(), self.cuts)
+                    bval = torch.zeros(len(partner), dtype=partner.dtype, device=partner.device)
+                    for j in torch.unique(owner).tolist():
+                        bval[owner == j] = self._bop_value(
+                            self.models[j], partner[owner == j], bcond['bop'], bcond['var']
+                        ).to(bval.dtype)
+                    bconds.append({'bnd': bnd[pairs],
+                                   'bop': bcond['bop'],
+                                   'bval': bval,
+                                   'var': bcond['var'],
+                                   'type': 'data' if bcond['bop'] is None else 'operator'})
+        return bconds
+
+    def _interface_bconds(self, k: int) -> list:
+        """ Continuity (and flux) conditions on the edges of k-th subdomain,
+            values are taken from the current neighbour models.
+
+        Args:
+            k (int): subdomain number.
+
+        Returns:
+            list: boundary conditions in input form.
+        """
+        bconds = []
+        neighbours = []
+        if k > 0:
+            neighbours.append((self.subdomains[k][0], self.models[k - 1]))
+        if k < self.n_subdomains - 1:
+            neighbours.append((self.subdomains[k][1], self.models[k + 1]))
+        for edge, neighbour in neighbours:
+            points = self._layer(edge)
+            with torch.no_grad():
+                values = neighbour(points)
+            for var in range(values.shape[-1]):
+                bconds.append({'bnd': points,
+                               'bop': None,
+                               'bval': values[:, var],
+                               'var': var,
+                               'type': 'data'})
+                if self.flux:
+                    bop = EquationMixin.equation_unify({
+                        'du/dn': {'coeff': 1,
+                                  'du/dn': [self.axis],
+                                  'pow': 1,
+                                  'var': var}})
+                    bconds.append({'bnd': points,
+                                   'bop': bop,
+                                   'bval': self._flux_value(neighbour, points, var),
+                                   'var': var,
+                                   'type': 'operator'})
+        return bconds
+
+    def _subdomain_problem(self, k: int):
+        """ Grid and Equation_autograd object of the k-th subdomain.
+        """
+        mask_fn = self._subdomain_mask(k)
+        grid = self.grid[mask_fn(self.grid)]
+        bconds = bcond_select(self.equal_cls.bconds, mask_fn) + self._interface_bconds(k) + \
+            self._periodic_bconds(k)
+        equal_cls = Operator_bcond_preproc(grid, deepcopy(self.equal_cls.operator),
+                                           bconds).set_strategy('autograd')
+        return grid, equal_cls
+
+    def _train(self, k: int, problem: tuple, solve_kwargs: dict) -> torch.nn.Module:
+        """ Trains the model of k-th subdomain by Solver.
+        """
+        grid, equal_cls = problem
+        return Solver(grid, equal_cls, self.models[k], 'autograd').solve(**solve_kwargs)
+
+    def solve(self,
+              n_iterations: int = 5,
+              workers: Union[int, None] = None,
+              **solve_kwargs) -> DecomposedModel:
+        """ Schwarz iterations: every subdomain is trained with interface values
+            from previous iteration, then interface values are exchanged.
+            Subdomains are trained in the worker processes (forked at every iteration
+            with the subdomain problems), torch threads are split between the workers.
+
+        Args:
+            n_iterations (int, optional): number of exchanges. Defaults to 5.
+            workers (Union[int, None], optional): number of processes that train
+                subdomains. Defaults to None (one per subdomain, if the fork start
+                method is available and the device is cpu, one otherwise).
+                With one worker subdomains are trained one by one in the current process.
+            **solve_kwargs: parameters of Solver.solve for every subdomain.
+
+        Raises:
+            NotImplementedError: several workers without fork start method or on cuda.
+
+        Returns:
+            DecomposedModel: model for the whole domain.
+        """
+        solve_kwargs.setdefault('use_cache', False)
+        forkable = 'fork' in multiprocessing.get_all_start_methods() and device_type() == 'cpu'
+        if workers is None:
+            workers = self.n_subdomains if forkable else 1
+        workers = min(workers, self.n_subdomains)
+        if workers > 1 and not forkable:
+            raise NotImplementedError('Parallel training of subdomains requires fork '
+                                      'start method and cpu device.')
+        threads = max(torch.get_num_threads() // workers, 1)
+
+        for _ in range(n_iterations):
+            problems = [self._subdomain_problem(k) for k in range(self.n_subdomains)]
+            if workers == 1:
+                self.models = [self._train(k, problems[k], solve_kwargs)
+                               for k in range(self.n_subdomains)]
+                continue
+            with multiprocessing.get_context('fork').Pool(
+                    workers, initializer=_subdomain_init,
+                    initargs=(self, problems, solve_kwargs, threads)) as pool:
+                self.models = pool.map(_subdomain_train, range(self.n_subdomains))
+
+        return DecomposedModel(self.models, self.cuts, self.axis)
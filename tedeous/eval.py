@@ -1,89 +1,12 @@
 """Module for operatoins with operator and boundaru con-ns."""
 
-from typing import Tuple, Union, List
+from typing import Tuple, Union
 import torch
 
 from tedeous.points_type import Points_type
 from tedeous.derivative import Derivative
 from tedeous.device import device_type, check_device
-from tedeous.utils import PadTransform
-
-
-def integration(func: torch.Tensor,
-                grid: torch.Tensor,
-                power: int = 2) \
-                -> Union[Tuple[float, float], Tuple[list, torch.Tensor]]:
-    """ Function realize 1-space integrands,
-    where func=(L(u)-f)*weak_form subintegrands function and
-    definite integral parameter is grid.
-
-    Args:
-        func (torch.Tensor): operator multiplied on test function
-        grid (torch.Tensor): array of a n-D points.
-        power (int, optional): power of func points. Defults to 2.
-
-    Returns:
-        'result' is integration result through one grid axis
-        'grid' is initial grid without last column or zero (if grid.shape[N,1])
-    """
-    if grid.shape[-1] == 1:
-        column = -1
-    else:
-        column = -2
-    marker = grid[0][column]
-    index = [0]
-    result = []
-    u = 0.
-    for i in range(1, len(grid)):
-        if grid[i][column] == marker or column == -1:
-            u += (grid[i][-1] - grid[i - 1][-1]).item() * \
-                 (func[i] ** power + func[i - 1] ** power) / 2
-        else:
-            result.append(u)
-            marker = grid[i][column]
-            index.append(i)
-            u = 0.
-    if column == -1:
-        return u, 0.
-    else:
-        result.append(u)
-        grid = grid[index, :-1]
-        return result, grid
-
-
-def dict_to_matrix(bval: dict, true_bval: dict)\
-    -> Tuple[torch.Tensor, torch.Tensor, List, List]:
-    """ Function for bounaries values matrix creation from dictionary.
-
-    Args:
-        bval (dict): dictionary with predicted boundaries values,
-              where keys are boundaries types.
-        true_bval (dict): dictionary with true boundaries values,
-                   where keys are boundaries types.
-
-    Returns:
-        matrix_bval (torch.Tensor): matrix, where each column is predicted
-                      boundary values of one boundary type.
-        matrix_true_bval (torch.Tensor):matrix, where each column is true
-                           boundary values of one boundary type.
-        keys (list): boundary types list corresponding matrix_bval columns.
-        len_list (list): list of length of each boundary type column.
-    """
-
-    keys = list(bval.keys())
-    max_len = max([len(i) for i in bval.values()])
-    pad = PadTransform(max_len, 0)
-    matrix_bval = pad(bval[keys[0]]).float().reshape(-1,1)
-    matrix_true_bval = pad(true_bval[keys[0]]).float().reshape(-1,1)
-    len_list = [len(bval[keys[0]])]
-    for key in keys[1:]:
-        bval_i = pad(bval[key]).float().reshape(-1,1)
-        true_bval_i = pad(true_bval[key]).float().reshape(-1,1)
-        matrix_bval = torch.hstack((matrix_bval, bval_i))
-        matrix_true_bval = torch.hstack((matrix_true_bval, true_bval_i))
-        len_list.append(len(bval[key]))
-
-    return matrix_bval, matrix_true_bval, keys, len_list
+from tedeous.quadrature import Quadrature, TestFunctionBank
 
 
 class Operator():
@@ -120,6 +43,10 @@ class Operator():
             self.sorted_grid = self.grid
         self.derivative = Derivative(self.model,
                                 self.derivative_points).set_strategy(self.mode).take_derivative
+        if self.weak_form is not None and self.weak_form != [] and self.mode != 'mat':
+            self.grid_central = self.grid_dict['central'] if self.mode == 'NN' else self.grid
+            self.quadrature = Quadrature(self.grid_central)
+        self.test_product = None
 
     def apply_operator(self,
                        operator: list,
@@ -172,21 +99,19 @@ class Operator():
             torch.Tensor: weak PDE residual.
         """
 
-        device = device_type()
-        if self.mode == 'NN':
-            grid_central = self.grid_dict['central']
-        elif self.mode == 'autograd':
-            grid_central = self.grid
-
         op = self._pde_compute()
+        if isinstance(self.weak_form, TestFunctionBank):
+            return self.weak_form.residual(op, self.quadrature)
+
+        if self.test_product is None:
+            device = device_type()
+            self.test_product = 1
+            for func in self.weak_form:
+                self.test_product = self.test_product * \
+                    func(self.grid_central.detach()).to(device).reshape(-1)
         sol_list = []
         for i in range(op.shape[-1]):
-            sol = op[:, i]
-            for func in self.weak_form:
-                sol = sol * func(grid_central).to(device).reshape(-1)
-            grid_central1 = torch.clone(grid_central)
-            for _ in range(grid_central.shape[-1]):
-                sol, grid_central1 = integration(sol, grid_central1)
+            sol = self.quadrature.integrate(op[:, i] * self.test_product)
             sol_list.append(sol.reshape(-1, 1))
         if len(sol_list) == 1:
             return sol_list[0]
@@ -223,7 +148,8 @@ class Bounds():
             prepared_bconds (Union[list,dict]): prepared (after Equation class) baund-y con-s.
             model (Union[torch.nn.Sequential, torch.Tensor]): *mat or NN or autograd* model.
             mode (str): *mat or NN or autograd*
-            weak_form (list[callable]): list with basis functions (if the form is *weak*).
+            weak_form (list[callable]): list with basis functions (if the form is *weak*),
+                boundary conditions are computed in strong form anyway.
             derivative_points (int): points number for derivative calculation.
                                      For details to Derivative_mat class.
         """
@@ -231,9 +157,67 @@ class Bounds():
         self.prepared_bconds = prepared_bconds
         self.model = model.to(device_type())
         self.mode = mode
+        # boundary operators are computed in strong form, so the internal
+        # Operator does not need the weak form quadrature.
         self.apply_operator = Operator(self.grid, self.prepared_bconds,
-                                       self.model, self.mode, weak_form,
+                                       self.model, self.mode, None,
                                        derivative_points).apply_operator
+        # boundary plan, it is built on the first apply_bcs() call.
+        self.bconds_order = None
+        self.keys = None
+        self.bval_length = None
+        self.seg_ids = None
+        self.counts = None
+        self.true_bval = None
+        self.fused_points = None
+        self.fused_slices = {}
+        if self.mode in ('NN', 'autograd'):
+            self._fuse()
+
+    @staticmethod
+    def _value_only(bcond: dict) -> bool:
+        """ Condition needs only model values in boundary points (no derivatives).
+        """
+        return bcond['type'] == 'dirichlet' or \
+            (bcond['type'] in ('periodic', 'data') and bcond['bop'] is None)
+
+    def _fuse(self):
+        """ Concatenates points of all value-only conditions (dirichlet, periodic
+            and data without operator) to evaluate the model once per step.
+            fused_slices stores (start, end) of every side of the condition.
+        """
+
+        points = []
+        start = 0
+        for i, bcond in enumerate(self.prepared_bconds):
+            if not self._value_only(bcond):
+                continue
+            sides = bcond['bnd'] if bcond['type'] == 'periodic' else [bcond['bnd']]
+            self.fused_slices[i] = []
+            for bnd in sides:
+                points.append(bnd)
+                self.fused_slices[i].append((start, start + len(bnd)))
+                start += len(bnd)
+        if points:
+            self.fused_points = torch.cat(points)
+
+    def _fused_val(self, i: int, values: torch.Tensor) -> torch.Tensor:
+        """ Value of the fused condition from the model values in fused points.
+
+        Args:
+            i (int): condition number in prepared_bconds.
+            values (torch.Tensor): model values in fused_points.
+
+        Returns:
+            torch.Tensor: calculated condition (for periodic: first side minus other sides).
+        """
+
+        var = self.prepared_bconds[i]['var']
+        (start, end), *others = self.fused_slices[i]
+        b_op_val = values[start:end, var]
+        for start, end in others:
+            b_op_val = b_op_val - values[start:end, var]
+        return b_op_val
 
     def _apply_bconds_set(self, operator_set: list) -> torch.Tensor:
         """ Method only for *NN* mode. Calculate boundary conditions with derivatives
@@ -368,32 +352,87 @@ class Bounds():
                                            bcond['var'])
         return b_op_val
 
+    def _plan(self, b_op_vals: list):
+        """ Builds boundary plan: conditions are ordered by type (so every type
+        is contiguous segment), true values are concatenated once, scalar
+        true values are broadcasted to the number of boundary points.
+
+        Args:
+            b_op_vals (list): calculated values of every condition in prepared_bconds.
+
+        Raises:
+            ValueError: number of true values does not match number of boundary points.
+        """
+
+        keys = []
+        for bcond in self.prepared_bconds:
+            if bcond['type'] not in keys:
+                keys.append(bcond['type'])
+        self.bconds_order = sorted(range(len(self.prepared_bconds)),
+                                   key=lambda i: keys.index(self.prepared_bconds[i]['type']))
+        self.keys = keys
+
+        true_bval = []
+        lengths = [0] * len(keys)
+        seg_ids = []
+        for i in self.bconds_order:
+            bcond = self.prepared_bconds[i]
+            length = len(b_op_vals[i])
+            value = torch.as_tensor(bcond['bval'], device=b_op_vals[i].device).reshape(-1)
+            if len(value) == 1 and length != 1:
+                value = value.expand(length)
+            elif len(value) != length:
+                raise ValueError('{} condition has {} true values for {} boundary points.'
+                                 .format(bcond['type'], len(value), length))
+            true_bval.append(value)
+            k = keys.index(bcond['type'])
+            lengths[k] += length
+            seg_ids.append(torch.full((length,), k, dtype=torch.long, device=value.device))
+
+        self.true_bval = torch.cat(true_bval).to(b_op_vals[0].dtype)
+        self.bval_length = lengths
+        self.seg_ids = torch.cat(seg_ids)
+        self.counts = torch.tensor(lengths, dtype=self.true_bval.dtype,
+                                   device=self.true_bval.device)
+
     def apply_bcs(self) -> Tuple[torch.Tensor, torch.Tensor, list, list]:
         """ Applies boundary and data conditions for each *type* in prepared_bconds.
 
         Returns:
-            bval (torch.Tensor): matrix, where each column is predicted
-                      boundary values of one boundary type.
-            true_bval (torch.Tensor):matrix, where each column is true
-                            boundary values of one boundary type.
-            keys (list): boundary types list corresponding matrix_bval columns.
-            bval_length (list): list of length of each boundary type column.
+            bval (torch.Tensor): predicted boundary values of all conditions,
+                      every boundary type is a contiguous segment.
+            true_bval (torch.Tensor): true boundary values (ordered as bval).
+            keys (list): boundary types list corresponding bval segments.
+            bval_length (list): list of length of each boundary type segment.
         """
 
-        bval_dict = {}
-        true_bval_dict = {}
+        if self.fused_points is not None:
+            values = self.model(self.fused_points)
+        b_op_vals = [self._fused_val(i, values) if i in self.fused_slices
+                     else self.b_op_val_calc(bcond).reshape(-1)
+                     for i, bcond in enumerate(self.prepared_bconds)]
+        b_op_vals = [val.float() if val.dtype in (torch.float16, torch.bfloat16) else val
+                     for val in b_op_vals]
+        if self.bconds_order is None:
+            self._plan(b_op_vals)
 
-        for bcond in self.prepared_bconds:
-            try:
-                bval_dict[bcond['type']] = torch.cat((bval_dict[bcond['type']],
-                                                    self.b_op_val_calc(bcond).reshape(-1)))
-                true_bval_dict[bcond['type']] = torch.cat((true_bval_dict[bcond['type']],
-                                                    bcond['bval'].reshape(-1)))
-            except:
-                bval_dict[bcond['type']] = self.b_op_val_calc(bcond).reshape(-1)
-                true_bval_dict[bcond['type']] = bcond['bval'].reshape(-1)
-
-        bval, true_bval, keys, bval_length = dict_to_matrix(
-                                                    bval_dict, true_bval_dict)
-
-        return bval, true_bval, keys, bval_length
+        bval = torch.cat([b_op_vals[i] for i in self.bconds_order])
+        true_bval = self.true_bval.to(bval.dtype)
+
+        return bval, true_bval, self.keys, self.bval_length
+
+    def bcs_mse(self, bval: torch.Tensor, true_bval: torch.Tensor) -> torch.Tensor:
+        """ Mean squared error of every boundary type.
+
+        Args:
+            bval (torch.Tensor): predicted boundary values (see apply_bcs).
+            true_bval (torch.Tensor): true boundary values (see apply_bcs).
+
+        Returns:
+            torch.Tensor: MSE of every boundary type (ordered as keys).
+        """
+
+        sq_diff = (bval - true_bval)**2
+        mse = torch.zeros(len(self.keys), dtype=sq_diff.dtype,
+                          device=sq_diff.device).index_add(0, self.seg_ids, sq_diff)
+        return mse / self.counts.to(sq_diff.dtype)
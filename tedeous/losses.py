@@ -15,19 +15,25 @@ class Losses():
                  mode: str,
                  weak_form: Union[None, list],
                  n_t: int,
-                 tol: Union[int, float]):
+                 tol: Union[int, float],
+                 t_bins: Union[torch.Tensor, None] = None):
         """
         Args:
             mode (str): calculation mode, *NN, autograd, mat*.
             weak_form (Union[None, list]): list of basis functions if form is weak.
             n_t (int): number of unique points in time dinension.
             tol (Union[int, float])): penalty in *casual loss*.
+            t_bins (Union[torch.Tensor, None], optional): index of the time moment
+                for every row of the operator residual. Defaults to None
+                (residual rows are sorted by time, n_t rows blocks of equal size).
         """
 
         self.mode = mode
         self.weak_form = weak_form
         self.n_t = n_t
         self.tol = tol
+        self.t_bins = t_bins
+        self.t_counts = None if t_bins is None else torch.bincount(t_bins, minlength=n_t)
         # TODO: refactor loss_op, loss_bcs into one function, carefully figure out when bval
         # is None + fix causal_loss operator crutch (line 76).
 
@@ -56,31 +62,46 @@ class Losses():
 
 
     def _loss_bcs(self,
-                 bval: torch.Tensor,
-                 true_bval: torch.Tensor,
-                 lambda_bound: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+                 bval_diff: torch.Tensor,
+                 lambda_bound: torch.Tensor) -> torch.Tensor:
         """ Computes boundary loss for corresponding type.
 
         Args:
-            bval (torch.Tensor): calculated values of boundary conditions.
-            true_bval (torch.Tensor): true values of boundary conditions.
+            bval_diff (torch.Tensor): MSE of every boundary type (see Bounds.bcs_mse).
             lambda_bound (torch.Tensor): regularization parameter for boundary term in loss.
 
         Returns:
             loss_bnd (torch.Tensor): boundary term in loss.
-            bval_diff (torch.Tensor): MSE of all boundary con-s.
         """
 
-        bval_diff = torch.mean((bval - true_bval)**2, 0)
-
         loss_bnd = bval_diff @ lambda_bound.T
-        return loss_bnd, bval_diff
+        return loss_bnd
+
+
+    def group_losses(self,
+                     operator: torch.Tensor,
+                     bval_diff: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """ Loss values of every equation and every boundary type
+        (the terms weighted by lambda_op and lambda_bound).
+
+        Args:
+            operator (torch.Tensor): operator calc-n result.
+            bval_diff (torch.Tensor): MSE of every boundary type.
 
+        Returns:
+            op (torch.Tensor): operator term of every equation.
+            bval_diff (torch.Tensor): boundary term of every boundary type.
+        """
+
+        if self.weak_form is not None and self.weak_form != []:
+            op = operator.reshape(-1)
+        else:
+            op = torch.mean(operator**2, 0)
+        return op, bval_diff
 
     def _default_loss(self,
                      operator: torch.Tensor,
-                     bval: torch.Tensor,
-                     true_bval: torch.Tensor,
+                     bval_diff: torch.Tensor,
                      lambda_op: torch.Tensor,
                      lambda_bound: torch.Tensor,
                      save_graph: bool = True) -> Tuple[torch.Tensor, torch.Tensor]:
@@ -89,8 +110,7 @@ class Losses():
         Args:
             operator (torch.Tensor): operator calc-n result.
             For more details to eval module -> operator_compute().
-            bval (torch.Tensor): calculated values of boundary conditions.
-            true_bval (torch.Tensor): true values of boundary conditions.
+            bval_diff (torch.Tensor): MSE of every boundary type (see Bounds.bcs_mse).
             lambda_op (torch.Tensor): regularization parameter for operator term in loss.
             lambda_bound (torch.Tensor): regularization parameter for boundary term in loss.
             save_graph (bool, optional): saving computational graph. Defaults to True.
@@ -100,16 +120,16 @@ class Losses():
             loss_normalized (torch.Tensor): loss, where regularization parameters are 1.
         """
 
-        if bval is None:
+        if bval_diff is None:
             return torch.sum(torch.mean((operator) ** 2, 0))
 
         loss_oper, op = self._loss_op(operator, lambda_op)
 
-        loss_bnd, bval_diff = self._loss_bcs(bval, true_bval, lambda_bound)
+        loss_bnd = self._loss_bcs(bval_diff, lambda_bound)
         loss = loss_oper + loss_bnd
 
         lambda_op_normalized = lambda_prepare(operator, 1)
-        lambda_bound_normalized = lambda_prepare(bval, 1)
+        lambda_bound_normalized = lambda_prepare(bval_diff, 1)
 
         with torch.no_grad():
             loss_normalized = op @ lambda_op_normalized.T +\
@@ -126,20 +146,20 @@ class Losses():
 
     def _causal_loss(self,
                     operator: torch.Tensor,
-                    bval: torch.Tensor,
-                    true_bval: torch.Tensor,
+                    bval_diff: torch.Tensor,
                     lambda_op: torch.Tensor,
                     lambda_bound: torch.Tensor)-> Tuple[torch.Tensor, torch.Tensor]:
         """ Computes causal loss, which is calculated with weights matrix:
         W = exp(-tol*(Loss_i)) where Loss_i is sum of the L2 loss from 0
         to t_i moment of time. This loss function should be used when one
         of the DE independent parameter is time.
+        Residual is averaged over the points of every time moment (t_bins index),
+        so grid points may be in arbitrary order.
 
         Args:
             operator (torch.Tensor): operator calc-n result.
             For more details to eval module -> operator_compute().
-            bval (torch.Tensor): calculated values of boundary conditions.
-            true_bval (torch.Tensor): true values of boundary conditions.
+            bval_diff (torch.Tensor): MSE of every boundary type (see Bounds.bcs_mse).
             lambda_op (torch.Tensor): regularization parameter for operator term in loss.
             lambda_bound (torch.Tensor): regularization parameter for boundary term in loss.
 
@@ -148,19 +168,23 @@ class Losses():
             loss_normalized (torch.Tensor): loss, where regularization parameters are 1.
         """
 
-        res = torch.sum(operator**2, dim=1).reshape(self.n_t, -1)
-        res = torch.mean(res, axis=1).reshape(self.n_t, 1)
-        m = torch.triu(torch.ones((self.n_t, self.n_t), dtype=res.dtype), diagonal=1).T
+        res = torch.sum(operator**2, dim=1)
+        if self.t_bins is None:
+            self.t_bins = torch.arange(len(res), device=res.device) // (len(res) // self.n_t)
+            self.t_counts = torch.bincount(self.t_bins, minlength=self.n_t)
+        res = torch.zeros(self.n_t, dtype=res.dtype,
+                          device=res.device).index_add(0, self.t_bins, res)
+        res = res / torch.clamp(self.t_counts, min=1)
         with torch.no_grad():
-            w = torch.exp(- self.tol * (m @ res))
+            w = torch.exp(- self.tol * (torch.cumsum(res, 0) - res))
 
-        loss_oper = torch.mean(w * res)
+        loss_oper = torch.sum(w * res) / torch.count_nonzero(self.t_counts)
 
-        loss_bnd, bval_diff = self._loss_bcs(bval, true_bval, lambda_bound)
+        loss_bnd = self._loss_bcs(bval_diff, lambda_bound)
 
         loss = loss_oper + loss_bnd
 
-        lambda_bound_normalized = lambda_prepare(bval, 1)
+        lambda_bound_normalized = lambda_prepare(bval_diff, 1)
         with torch.no_grad():
             loss_normalized = loss_oper +\
                         lambda_bound_normalized @ bval_diff
@@ -169,8 +193,7 @@ class Losses():
 
     def _weak_loss(self,
                   operator: torch.Tensor,
-                  bval: torch.Tensor,
-                  true_bval: torch.Tensor,
+                  bval_diff: torch.Tensor,
                   lambda_op: torch.Tensor,
                   lambda_bound: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         """ Weak solution of O/PDE problem.
@@ -178,8 +201,7 @@ class Losses():
         Args:
             operator (torch.Tensor): operator calc-n result.
             For more details to eval module -> operator_compute().
-            bval (torch.Tensor): calculated values of boundary conditions.
-            true_bval (torch.Tensor): true values of boundary conditions.
+            bval_diff (torch.Tensor): MSE of every boundary type (see Bounds.bcs_mse).
             lambda_op (torch.Tensor): regularization parameter for operator term in loss.
             lambda_bound (torch.Tensor): regularization parameter for boundary term in loss.
 
@@ -188,16 +210,16 @@ class Losses():
             loss_normalized (torch.Tensor): loss, where regularization parameters are 1.
         """
 
-        if bval is None:
+        if bval_diff is None:
             return sum(operator)
 
         loss_oper, op = self._loss_op(operator, lambda_op)
 
-        loss_bnd, bval_diff = self._loss_bcs(bval, true_bval, lambda_bound)
+        loss_bnd = self._loss_bcs(bval_diff, lambda_bound)
         loss = loss_oper + loss_bnd
 
         lambda_op_normalized = lambda_prepare(operator, 1)
-        lambda_bound_normalized = lambda_prepare(bval, 1)
+        lambda_bound_normalized = lambda_prepare(bval_diff, 1)
 
         with torch.no_grad():
             loss_normalized = op @ lambda_op_normalized.T +\
@@ -207,8 +229,7 @@ class Losses():
 
     def compute(self,
                 operator: torch.Tensor,
-                bval: torch.Tensor,
-                true_bval: torch.Tensor,
+                bval_diff: torch.Tensor,
                 lambda_op: torch.Tensor,
                 lambda_bound: torch.Tensor,
                 save_graph: bool = True) -> Union[_default_loss, _weak_loss, _causal_loss]:
@@ -217,8 +238,7 @@ class Losses():
         Args:
             operator (torch.Tensor): operator calc-n result.
             For more details to eval module -> operator_compute().
-            bval (torch.Tensor): calculated values of boundary conditions.
-            true_bval (torch.Tensor): true values of boundary conditions.
+            bval_diff (torch.Tensor): MSE of every boundary type (see Bounds.bcs_mse).
             lambda_op (torch.Tensor): regularization parameter for operator term in loss.
             lambda_bound (torch.Tensor): regularization parameter for boundary term in loss.
             save_graph (bool, optional): saving computational graph. Defaults to True.
@@ -228,10 +248,10 @@ class Losses():
         """
 
         if self.mode in ('mat', 'autograd'):
-            if bval is None:
+            if bval_diff is None:
                 print('No bconds is not possible, returning infinite loss')
                 return np.inf
-        inputs = [operator, bval, true_bval, lambda_op, lambda_bound]
+        inputs = [operator, bval_diff, lambda_op, lambda_bound]
 
         if self.weak_form is not None and self.weak_form != []:
             return self._weak_loss(*inputs)
@@ -1,16 +1,70 @@
 """Module for custom optimizers"""
 
 from copy import copy
-from typing import Tuple
+from typing import Tuple, Union
 import math
+import multiprocessing
+import os
 import torch
 import numpy as np
+from torch.func import functional_call, vmap, grad_and_value
 from torch.nn.utils import parameters_to_vector, vector_to_parameters
 from tedeous.device import device_type
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 
 
+class _SolutionLoss(torch.nn.Module):
+    """
+    Loss of the Solution as the module with the model parameters,
+    so the loss is a function of the parameters for torch.func transforms.
+    """
+    def __init__(self, sln_cls):
+        """
+        Args:
+            sln_cls (Solution): Solution class object.
+        """
+        super().__init__()
+        self.model = sln_cls.model
+        self.sln_cls = sln_cls
+
+    def forward(self) -> torch.Tensor:
+        """ Loss for the current parameters of the model.
+
+        Returns:
+            torch.Tensor: loss (scalar).
+        """
+        loss, _ = self.sln_cls.evaluate()
+        return loss.reshape(())
+
+
+_worker_pso = None
+
+
+def _process_init(pso: 'PSO') -> None:
+    """ Initializer of the *process* backend worker, the worker keeps
+        the PSO replica (with the prepared Solution) inherited by fork.
+    """
+    global _worker_pso
+    torch.set_num_threads(1)
+    _worker_pso = pso
+
+
+def _process_fitness(bounds: Tuple[int, int]) -> None:
+    """ Evaluates the particles of the shared swarm in the worker
+        and writes their losses and gradients to the shared buffers.
+
+    Args:
+        bounds (Tuple[int, int]): first and last (exclusive) particles indices.
+    """
+    swarm, losses, grads = _worker_pso._shared
+    for i in range(*bounds):
+        _worker_pso.vec_to_params(swarm[i].clone())
+        loss, grad = _worker_pso.loss_grads()
+        losses[i] = loss.detach().reshape(())
+        grads[i] = grad.detach().reshape(-1)
+
+
 class PSO():
     """Custom PSO optimizer.
     """
@@ -23,7 +77,13 @@ class PSO():
                  betas: Tuple = (0.99, 0.999),
                  c_decrease: bool = False,
                  variance: float = 1,
-                 epsilon: float = 1e-8):
+                 epsilon: float = 1e-8,
+                 backend: str = 'loop',
+                 workers: Union[int, None] = None,
+                 subspace: Union[int, None] = None,
+                 basis: str = 'random',
+                 subspace_layers: Union[int, None] = None,
+                 verbose: bool = False):
         """The Particle Swarm Optimizer class.
 
         Args:
@@ -39,7 +99,35 @@ class PSO():
                 based on model. Defaults to 1.
             epsilon (float, optional): some add to gradient descent like in Adam optimizer.
                 Defaults to 1e-8.
+            backend (str, optional): swarm evaluation way, *loop* (particles are evaluated
+                one by one in the model) or *vmap* (whole swarm is evaluated by one batched
+                pass with torch.func.vmap over the stacked parameters vectors, *NN* mode).
+                If the loss could not be vmapped (e.g. *autograd* derivatives), *loop* is used.
+                *process* evaluates the particles by the persistent pool of worker processes
+                (cpu only), which hold the Solution replicas, particles, losses and gradients
+                are exchanged through the shared memory (call close() to stop the pool).
+                Defaults to 'loop'.
+            workers (Union[int, None], optional): number of worker processes for *process*
+                backend. Defaults to None (number of cpu).
+            subspace (Union[int, None], optional): dimension k of the subspace around the
+                initial model, where the swarm is run: particle z is the model
+                theta_0 + B @ z, so the swarm buffers are pop_size x k. Defaults to None
+                (the swarm is run in the whole parameters space).
+            basis (str, optional): subspace basis B, *random* (random orthonormal directions)
+                or *pca* (principal directions of the loss gradients sampled around
+                the initial model). Defaults to 'random'.
+            subspace_layers (Union[int, None], optional): number of the last layers (modules
+                with parameters) spanned by the subspace, other parameters are fixed
+                (*NN, autograd* modes). Defaults to None (all parameters).
+            verbose (bool, optional): print the backend fallback. Defaults to False.
+
+        Raises:
+            ValueError: unknown backend or basis.
         """
+        if backend not in ('loop', 'vmap', 'process'):
+            raise ValueError('Unknown PSO backend: {}'.format(backend))
+        if basis not in ('random', 'pca'):
+            raise ValueError('Unknown PSO subspace basis: {}'.format(basis))
         self.pop_size = pop_size
         self.b = b
         self.c1 = c1
@@ -50,6 +138,12 @@ class PSO():
         self.lr = lr * np.sqrt(1 - self.beta2) / (1 - self.beta1)
         self.use_grad = True if self.lr != 0 else False
         self.variance = variance
+        self.backend = backend
+        self.workers = os.cpu_count() if workers is None else workers
+        self.subspace = subspace
+        self.basis = basis
+        self.subspace_layers = subspace_layers
+        self.verbose = verbose
         self.name = "PSO"
 
         """other parameters are determined in param_init method"""
@@ -64,8 +158,15 @@ class PSO():
         self.m1 = None
         self.m2 = None
         self.n_iter = None
-
-    def params_to_vec(self) -> torch.Tensor:
+        self._swarm_fn = None
+        self._pool = None
+        self._shared = None
+        self._chunks = None
+        self.theta_0 = None
+        self.offset = None
+        self.basis_matrix = None
+
+    def model_to_vec(self) -> torch.Tensor:
         """ Method for converting model parameters *NN and autograd*
            or model values *mat* to vector.
 
@@ -80,6 +181,68 @@ class PSO():
 
         return vec
 
+    def params_to_vec(self) -> torch.Tensor:
+        """ Particle of the current model: model parameters/model values vector
+            or its coordinates in the subspace (see subspace_init).
+
+        Returns:
+            torch.Tensor: particle vector.
+        """
+        vec = self.model_to_vec()
+        if self.basis_matrix is not None:
+            vec = self.basis_matrix.T @ (vec - self.theta_0)[self.offset:]
+
+        return vec
+
+    def full_vec(self, vec: torch.Tensor) -> torch.Tensor:
+        """ Model parameters/model values vector of the subspace particle.
+
+        Args:
+            vec (torch.Tensor): subspace coordinates z.
+
+        Returns:
+            torch.Tensor: theta_0 + B @ z.
+        """
+        return torch.cat((self.theta_0[:self.offset],
+                          self.theta_0[self.offset:] + self.basis_matrix @ vec))
+
+    def subspace_init(self) -> None:
+        """ Builds the subspace basis around the current model. The subspace spans
+            the parameters of the last *subspace_layers* layers (the tail of the
+            parameters vector). *pca* basis is the principal directions of the loss
+            gradients in 2k random points around the model.
+
+        Raises:
+            NotImplementedError: *subspace_layers* for *mat* mode.
+        """
+        self.basis_matrix = None
+        self.theta_0 = self.model_to_vec().detach().clone()
+        self.offset = 0
+        if self.subspace_layers is not None:
+            if self.sln_cls.mode == 'mat':
+                raise NotImplementedError('Subspace of the last layers is not available for *mat* mode.')
+            layers = [module for module in self.sln_cls.model.modules()
+                      if len(list(module.parameters(recurse=False))) != 0]
+            n_layer_params = sum(param.numel() for module in layers[-self.subspace_layers:]
+                                 for param in module.parameters(recurse=False))
+            self.offset = len(self.theta_0) - n_layer_params
+        n_subspace = len(self.theta_0) - self.offset
+        k = min(self.subspace, n_subspace)
+        if self.basis == 'random':
+            basis = torch.randn(n_subspace, k, dtype=self.theta_0.dtype, device=self.theta_0.device)
+        else:
+            grads = []
+            for _ in range(2 * k):
+                noise = torch.zeros_like(self.theta_0)
+                noise[self.offset:].uniform_(-self.variance, self.variance)
+                self.vec_to_params(self.theta_0 + noise)
+                loss, _ = self.sln_cls.evaluate()
+                grads.append(self.gradient(loss)[self.offset:].detach())
+            self.vec_to_params(self.theta_0.clone())
+            _, _, basis = torch.linalg.svd(torch.stack(grads), full_matrices=False)
+            basis = basis[:k].T
+        self.basis_matrix, _ = torch.linalg.qr(basis)
+
     def vec_to_params(self, vec: torch.Tensor) -> None:
         """Method for converting vector to model parameters (NN, autograd)
            or model values (mat)
@@ -87,10 +250,13 @@ class PSO():
         Args:
             vec (torch.Tensor): The particle of swarm. 
         """
+        if self.basis_matrix is not None:
+            vec = self.full_vec(vec)
         if self.sln_cls.mode != 'mat':
-            vector_to_parameters(vec, self.sln_cls.model.parameters())
+            params = list(self.sln_cls.model.parameters())
+            vector_to_parameters(vec.to(params[0].dtype), params)
         else:
-            self.sln_cls.model.data = vec.reshape(self.model_shape).data
+            self.sln_cls.model.data = vec.reshape(self.model_shape).to(self.sln_cls.model.dtype).data
 
     def param_init(self, sln_cls, tmax) -> None:
         """Method for additional class objects initializing.
@@ -100,12 +266,24 @@ class PSO():
         """
         self.sln_cls = sln_cls
         self.sln_cls.model.requires_grad_()
+        if self.subspace is not None:
+            self.subspace_init()
         vec_shape = self.params_to_vec().shape
         self.vec_shape = list(vec_shape)[0]
+        if self.backend == 'vmap' and self.sln_cls.mode != 'mat':
+            self._swarm_fn = self.vmap_fn()
+            if not self.vmap_check():
+                self._swarm_fn = None
+        elif self.backend == 'process':
+            self.start_pool()
 
-        self.swarm = self.build_swarm()
+        try:
+            self.swarm = self.build_swarm()
 
-        self.loss_swarm, self.grads_swarm = self.fitness_fn()
+            self.loss_swarm, self.grads_swarm = self.fitness_fn()
+        except BaseException:
+            self.close()
+            raise
 
         self.p, self.f_p = copy(self.swarm).detach(), copy(self.loss_swarm).detach()
 
@@ -162,6 +340,8 @@ class PSO():
             dl_dparam = torch.autograd.grad(loss, self.sln_cls.model)
 
         grads = parameters_to_vector(dl_dparam)
+        if self.basis_matrix is not None:
+            grads = self.basis_matrix.T @ grads[self.offset:]
 
         return grads
 
@@ -176,17 +356,125 @@ class PSO():
         loss, _ = self.sln_cls.evaluate()
         if self.use_grad:
             grads = self.gradient(loss)
-            grads = torch.where(grads==float('nan'), torch.zeros_like(grads), grads)
+            grads = torch.where(torch.isnan(grads), torch.zeros_like(grads), grads)
         else:
             grads = torch.tensor([0.])
         return loss, grads
 
+    def vmap_fn(self) -> callable:
+        """ Batched loss and gradient of the swarm (*vmap* backend): the model is
+            called with every particle as its parameters by torch.func.functional_call,
+            per-particle gradients are computed by vmap(grad_and_value).
+
+        Returns:
+            callable: function of the swarm, that returns gradients and losses
+            (only losses if gradient is not used).
+        """
+        module = _SolutionLoss(self.sln_cls)
+        names, shapes = [], []
+        for name, param in self.sln_cls.model.named_parameters():
+            names.append('model.' + name)
+            shapes.append(param.shape)
+        numels = [math.prod(shape) for shape in shapes]
+
+        def particle_loss(particle: torch.Tensor) -> torch.Tensor:
+            if self.basis_matrix is not None:
+                particle = self.full_vec(particle)
+            params = {name: param.view(shape) for name, param, shape in
+                      zip(names, particle.split(numels), shapes)}
+            return functional_call(module, params, ())
+
+        if self.use_grad:
+            return vmap(grad_and_value(particle_loss))
+        return vmap(particle_loss)
+
+    def vmap_check(self) -> bool:
+        """ Probe call of the *vmap* backend on the current model. If it fails,
+            the loss is evaluated in the usual way, so the errors of the problem
+            itself are raised, and only the loss that could not be vmapped
+            (e.g. *autograd* derivatives) leads to *loop* backend.
+
+        Returns:
+            bool: True if the loss could be vmapped.
+        """
+        try:
+            self._swarm_fn(self.params_to_vec().detach().reshape(1, -1))
+        except RuntimeError:
+            self.loss_grads()
+            if self.verbose:
+                print('Loss could not be vmapped, PSO uses loop backend')
+            return False
+        return True
+
+    def vmap_fitness(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """ Fitness function for the whole swarm by one batched pass (*vmap* backend).
+
+        Returns:
+            tuple(torch.Tensor, torch.Tensor): the losses and gradients for all particles.
+        """
+        swarm = self.swarm.detach()
+        if self.use_grad:
+            grads, losses = self._swarm_fn(swarm)
+            grads = torch.where(torch.isnan(grads), torch.zeros_like(grads), grads)
+        else:
+            losses = self._swarm_fn(swarm)
+            grads = torch.zeros(self.pop_size, 1)
+        return losses.detach(), grads.detach()
+
+    def start_pool(self) -> None:
+        """ Starts the worker processes of *process* backend. The workers are forked
+            with the Solution replica, the swarm, losses and gradients buffers are
+            in the shared memory, so only the particles indices are sent to the workers.
+
+        Raises:
+            NotImplementedError: fork start method is not available or the model is on cuda.
+        """
+        self.close()
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise NotImplementedError('Process backend of PSO requires fork start method.')
+        if self.params_to_vec().device.type != 'cpu':
+            raise NotImplementedError('Process backend of PSO is available for cpu only.')
+        grads_size = self.vec_shape if self.use_grad else 1
+        dtype = self.params_to_vec().dtype
+        self._shared = (torch.zeros(self.pop_size, self.vec_shape, dtype=dtype).share_memory_(),
+                        torch.zeros(self.pop_size, dtype=dtype).share_memory_(),
+                        torch.zeros(self.pop_size, grads_size, dtype=dtype).share_memory_())
+        workers = min(self.workers, self.pop_size)
+        bounds = np.linspace(0, self.pop_size, workers + 1).astype(int)
+        self._chunks = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+        self._pool = multiprocessing.get_context('fork').Pool(
+            workers, initializer=_process_init, initargs=(self,))
+
+    def process_fitness(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """ Fitness function for the whole swarm by the worker processes (*process* backend).
+
+        Returns:
+            tuple(torch.Tensor, torch.Tensor): the losses and gradients for all particles.
+        """
+        swarm, losses, grads = self._shared
+        swarm.copy_(self.swarm.detach())
+        self._pool.map(_process_fitness, self._chunks)
+        return losses.clone(), grads.clone()
+
+    def close(self) -> None:
+        """ Stops the worker processes of *process* backend.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+        self._shared = None
+
     def fitness_fn(self) -> Tuple[torch.Tensor, torch.Tensor]:
         """Fitness function for the whole swarm.
 
         Returns:
             tuple(torch.Tensor, torch.Tensor): the losses and gradients for all particles.
         """
+        if self._pool is not None:
+            return self.process_fitness()
+        if self._swarm_fn is not None:
+            return self.vmap_fitness()
         loss_swarm = []
         grads_swarm = []
         for particle in self.swarm:
@@ -253,3 +541,72 @@ class PSO():
         min_loss =  torch.min(self.f_p)
 
         return min_loss
+
+
+class OptimizerSchedule():
+    """Sequence of optimizers (e.g. Adam -> LBFGS), that are used one after another.
+    """
+    def __init__(self, stages: list):
+        """
+        Args:
+            stages (list): list of stages in form (optimizer, learning_rate) or
+                (optimizer, learning_rate, until). Optimizer is the same as
+                *optimizer_mode* in Solver.solve ('Adam', 'SGD', 'LBFGS', 'PSO' or custom).
+                *until* is the number of steps of the stage, if it is None (default)
+                the stage is switched when plateau is detected by the
+                window/patience stop criteria. The last stage works until the end of the solution.
+
+        Examples:
+            OptimizerSchedule([('Adam', 1e-3, 5000), ('LBFGS', 1e-1)])
+        """
+        self.stages = []
+        for stage in stages:
+            stage = tuple(stage)
+            if len(stage) == 2:
+                stage = stage + (None,)
+            self.stages.append(stage)
+        self.stage = 0
+        self.t_start = 0
+
+    def current(self) -> tuple:
+        """ Current stage.
+
+        Returns:
+            tuple: (optimizer, learning_rate, until).
+        """
+        return self.stages[self.stage]
+
+    def is_last(self) -> bool:
+        """ Checks if the current stage is the last one.
+        """
+        return self.stage == len(self.stages) - 1
+
+    def need_switch(self, t: int, plateau: bool) -> bool:
+        """ Checks stage switching criteria.
+
+        Args:
+            t (int): current optimization step.
+            plateau (bool): stop criteria (window/patience) is achieved at this step.
+
+        Returns:
+            bool: True if the next stage should be started.
+        """
+        if self.is_last():
+            return False
+        until = self.current()[2]
+        if until is None:
+            return plateau
+        return t - self.t_start >= until
+
+    def switch(self, t: int) -> tuple:
+        """ Starts the next stage.
+
+        Args:
+            t (int): current optimization step.
+
+        Returns:
+            tuple: (optimizer, learning_rate, until) of the new stage.
+        """
+        self.stage += 1
+        self.t_start = t
+        return self.current()
@@ -0,0 +1,139 @@
+"""Module for per-component precision policy."""
+
+from copy import deepcopy
+from typing import Union, Any
+import torch
+
+from tedeous.data import tensor_dtype
+
+
+class PrecisionModel(torch.nn.Module):
+    """
+    Wrapper that feeds the network in its own dtype and returns outputs
+    in the residual dtype, so derivative terms are accumulated in the residual dtype.
+    """
+    def __init__(self, model: torch.nn.Module, policy: 'PrecisionPolicy'):
+        """
+        Args:
+            model (torch.nn.Module): *NN or autograd* model.
+            policy (PrecisionPolicy): precision policy.
+        """
+        super().__init__()
+        self.model = model
+        self.policy = policy
+
+    def forward(self, grid: torch.Tensor) -> torch.Tensor:
+        """ Forward pass with dtype casting.
+
+        Args:
+            grid (torch.Tensor): points (in grid or stencil dtype).
+
+        Returns:
+            torch.Tensor: model outputs in residual dtype.
+        """
+        return self.model(grid.to(self.policy.model)).to(self.policy.residual)
+
+
+class PrecisionPolicy():
+    """
+    Sets dtypes separately for the grid, stencil shifts, network weights,
+    residual accumulation and loss reduction. Optionally all components are
+    escalated to higher precision at some point of the training
+    (e.g. train in float32, finish in float64 with LBFGS).
+    """
+    def __init__(self,
+                 grid: Union[str, torch.dtype] = 'float32',
+                 stencil: Union[str, torch.dtype, None] = None,
+                 model: Union[str, torch.dtype] = 'float32',
+                 residual: Union[str, torch.dtype, None] = None,
+                 loss: Union[str, torch.dtype, None] = None,
+                 escalate_to: Union[str, torch.dtype, None] = None,
+                 escalate_at: Union[int, None] = None):
+        """
+        Args:
+            grid (Union[str, torch.dtype], optional): dtype of the grid and
+                boundary points. Defaults to 'float32'.
+            stencil (Union[str, torch.dtype, None], optional): dtype of shifted
+                finite-difference points (*NN* mode). Defaults to None (same as grid).
+            model (Union[str, torch.dtype], optional): dtype of network weights
+                (solution tensor in *mat* mode). Defaults to 'float32'.
+            residual (Union[str, torch.dtype, None], optional): dtype of model outputs
+                and derivative terms accumulation. Defaults to None (same as model).
+            loss (Union[str, torch.dtype, None], optional): dtype of the loss
+                reduction. Defaults to None (same as residual).
+            escalate_to (Union[str, torch.dtype, None], optional): dtype for all
+                components after escalation. Defaults to None (no escalation).
+            escalate_at (Union[int, None], optional): step of escalation. If None,
+                escalation is done at the start of the last stage of the optimizer
+                schedule (see OptimizerSchedule). Defaults to None.
+        """
+        self.grid = tensor_dtype(grid)
+        self.stencil = self.grid if stencil is None else tensor_dtype(stencil)
+        self.model = tensor_dtype(model)
+        self.residual = self.model if residual is None else tensor_dtype(residual)
+        self.loss = self.residual if loss is None else tensor_dtype(loss)
+        self.escalate_to = None if escalate_to is None else tensor_dtype(escalate_to)
+        self.escalate_at = escalate_at
+
+    def need_escalation(self, t: int, schedule: Any = None) -> bool:
+        """ Checks escalation criteria.
+
+        Args:
+            t (int): current optimization step.
+            schedule (Any, optional): OptimizerSchedule object. Defaults to None.
+
+        Returns:
+            bool: True if it is time to escalate precision.
+        """
+        if self.escalate_to is None:
+            return False
+        if self.escalate_at is not None:
+            return t >= self.escalate_at
+        return schedule is not None and schedule.is_last()
+
+    def escalated(self) -> 'PrecisionPolicy':
+        """ Policy after escalation.
+
+        Returns:
+            PrecisionPolicy: policy with all components in *escalate_to* dtype.
+        """
+        dtype = self.escalate_to
+        return PrecisionPolicy(grid=dtype, stencil=dtype, model=dtype,
+                               residual=dtype, loss=dtype)
+
+    def prepare_model(self,
+                      model: Union[torch.nn.Module, torch.Tensor]) -> Union[torch.nn.Module, torch.Tensor]:
+        """ Casts model weights (or *mat* model values) to model dtype.
+
+        Args:
+            model (Union[torch.nn.Module, torch.Tensor]): *mat, NN, autograd* model.
+
+        Returns:
+            Union[torch.nn.Module, torch.Tensor]: casted model.
+        """
+        if isinstance(model, torch.nn.Module):
+            return model.to(self.model)
+        return model.detach().to(self.model)
+
+    def prepare_equation(self, equal_cls: Any) -> Any:
+        """ Copy of Equation_{NN, mat, autograd} object with grid in stencil dtype,
+            boundary points in grid dtype and boundary values in residual dtype.
+
+        Args:
+            equal_cls (Any): Equation_{NN, mat, autograd} object.
+
+        Returns:
+            Any: casted copy of equal_cls.
+        """
+        equal_cls = deepcopy(equal_cls)
+        equal_cls.grid = equal_cls.grid.detach().to(self.stencil)
+        if equal_cls.bconds is None:
+            return equal_cls
+        for bcond in equal_cls.bconds:
+            if isinstance(bcond['bnd'], list):
+                bcond['bnd'] = [bnd.detach().to(self.grid) for bnd in bcond['bnd']]
+            else:
+                bcond['bnd'] = bcond['bnd'].detach().to(self.grid)
+            if isinstance(bcond['bval'], torch.Tensor):
+                bcond['bval'] = bcond['bval'].to(self.residual)
+        return equal_cls
@@ -0,0 +1,278 @@
+"""Module for vectorized quadrature rules (weak form integrals)."""
+
+from typing import Union, List
+import numpy as np
+import torch
+
+
+class Quadrature():
+    """
+    Integration over the grid. Points may be in any order, they are sorted
+    once in lexicographic (torch.cartesian_prod) order and the integrand is
+    permuted in the same way. For the cartesian grid the integrand is reshaped
+    to the grid axes and integrated by tensor product of one-dimensional rules
+    (trapezoid or Gauss-Legendre). For other grids the integral is computed by
+    segment sums over the runs of points with the same coordinate (last but one column).
+    As in the original weak form, the integrand is raised to *power* before
+    the integration along every axis (from the last axis to the first).
+    """
+
+    def __init__(self, grid: torch.Tensor, rule: str = 'trapezoid'):
+        """
+        Args:
+            grid (torch.Tensor): grid points (n_points, n_dims).
+            rule (str, optional): *trapezoid* or *gauss* (grid nodes along every axis
+                should be Gauss-Legendre nodes, see gauss_nodes). Defaults to 'trapezoid'.
+
+        Raises:
+            ValueError: unknown rule or *gauss* rule for not structured grid.
+        """
+
+        if rule not in ('trapezoid', 'gauss'):
+            raise ValueError('Unknown quadrature rule: {}'.format(rule))
+        self.grid = grid.detach()
+        self.rule = rule
+        self.order = self._lexsort(self.grid)
+        self.points = self.grid if self.order is None else self.grid[self.order]
+        self.axes = self._cartesian_axes(self.points)
+        if self.axes is None and rule == 'gauss':
+            raise ValueError('Gauss-Legendre rule requires cartesian grid.')
+        if self.axes is not None:
+            self.axis_weights = [self._axis_weights(axis) for axis in self.axes]
+        self._weights = None
+
+    @staticmethod
+    def _lexsort(grid: torch.Tensor) -> Union[torch.Tensor, None]:
+        """ Permutation of the points to lexicographic order
+            (the first column changes slowest, as in torch.cartesian_prod).
+
+        Args:
+            grid (torch.Tensor): grid points.
+
+        Returns:
+            Union[torch.Tensor, None]: permutation (None if points are already sorted).
+        """
+
+        order = torch.arange(len(grid), device=grid.device)
+        for k in reversed(range(grid.shape[-1])):
+            order = order[torch.sort(grid[order, k], stable=True).indices]
+        if torch.equal(order, torch.arange(len(grid), device=grid.device)):
+            return None
+        return order
+
+    @staticmethod
+    def _cartesian_axes(grid: torch.Tensor) -> Union[List[torch.Tensor], None]:
+        """ Axes of the cartesian grid.
+
+        Args:
+            grid (torch.Tensor): grid points.
+
+        Returns:
+            Union[List[torch.Tensor], None]: sorted nodes along every axis
+            (None if grid is not the cartesian product in torch.cartesian_prod order).
+        """
+
+        axes = [torch.unique(grid[:, k]) for k in range(grid.shape[-1])]
+        if np.prod([len(axis) for axis in axes]) != len(grid):
+            return None
+        product = torch.cartesian_prod(*axes).reshape(grid.shape)
+        if not torch.equal(product, grid):
+            return None
+        return axes
+
+    @staticmethod
+    def gauss_nodes(start: float, end: float, n: int) -> torch.Tensor:
+        """ Gauss-Legendre nodes on the segment (for building grid with *gauss* rule).
+
+        Args:
+            start (float): segment start.
+            end (float): segment end.
+            n (int): number of nodes.
+
+        Returns:
+            torch.Tensor: nodes.
+        """
+
+        nodes, _ = np.polynomial.legendre.leggauss(n)
+        return torch.from_numpy((end - start) / 2 * nodes + (end + start) / 2)
+
+    def _axis_weights(self, axis: torch.Tensor) -> torch.Tensor:
+        """ One-dimensional quadrature weights for the axis nodes.
+
+        Args:
+            axis (torch.Tensor): sorted nodes.
+
+        Raises:
+            ValueError: nodes are not Gauss-Legendre nodes (for *gauss* rule).
+
+        Returns:
+            torch.Tensor: weights.
+        """
+
+        if len(axis) == 1:
+            return torch.zeros_like(axis)
+        if self.rule == 'trapezoid':
+            dx = axis[1:] - axis[:-1]
+            weights = torch.zeros_like(axis)
+            weights[:-1] += dx / 2
+            weights[1:] += dx / 2
+            return weights
+        nodes, weights = np.polynomial.legendre.leggauss(len(axis))
+        nodes = torch.from_numpy(nodes).to(axis)
+        scale = (axis[-1] - axis[0]) / (nodes[-1] - nodes[0])
+        center = axis.mean() - scale * nodes.mean()
+        if not torch.allclose(scale * nodes + center, axis):
+            raise ValueError('Grid nodes are not Gauss-Legendre nodes.')
+        return scale * torch.from_numpy(weights).to(axis)
+
+    def _structured(self, func: torch.Tensor, power: int) -> torch.Tensor:
+        """ Tensor product rule for cartesian grid.
+        """
+
+        sol = func.reshape([len(axis) for axis in self.axes])
+        for weights in reversed(self.axis_weights):
+            sol = torch.einsum('...i,i->...', sol ** power, weights.to(sol.dtype))
+        return sol
+
+    @staticmethod
+    def _runs(func: torch.Tensor, grid: torch.Tensor, power: int):
+        """ Trapezoid integration along the last column over the runs of
+            points with the same value in the last but one column.
+
+        Returns:
+            sol (torch.Tensor): integral for every run.
+            grid (torch.Tensor): first points of the runs without last column.
+        """
+
+        dx = (grid[1:, -1] - grid[:-1, -1]).to(func.dtype)
+        terms = dx * (func[1:] ** power + func[:-1] ** power) / 2
+        if grid.shape[-1] == 1:
+            return torch.sum(terms), None
+        new_run = torch.cat((torch.tensor([True], device=grid.device),
+                             grid[1:, -2] != grid[:-1, -2]))
+        run_ids = torch.cumsum(new_run, 0) - 1
+        terms = terms * (~new_run[1:])
+        sol = torch.zeros(int(run_ids[-1]) + 1, dtype=func.dtype,
+                          device=func.device).index_add(0, run_ids[1:], terms)
+        return sol, grid[new_run, :-1]
+
+    def _unstructured(self, func: torch.Tensor, power: int) -> torch.Tensor:
+        """ Segment sums rule for not cartesian grid.
+        """
+
+        sol, grid = func, self.points
+        while grid is not None:
+            sol, grid = self._runs(sol, grid, power)
+        return sol
+
+    def integrate(self, func: torch.Tensor, power: int = 2) -> torch.Tensor:
+        """ Integral of the function values over the grid.
+
+        Args:
+            func (torch.Tensor): function values in grid points (in the order of the grid).
+            power (int, optional): power of the integrand along every axis. Defaults to 2.
+
+        Returns:
+            torch.Tensor: integral (scalar).
+        """
+
+        func = func.reshape(-1)
+        if self.order is not None:
+            func = func[self.order]
+        if self.axes is not None:
+            return self._structured(func, power)
+        return self._unstructured(func, power)
+
+    @property
+    def weights(self) -> torch.Tensor:
+        """ Weights of the linear rule (power=1): integral = weights @ func.
+
+        Returns:
+            torch.Tensor: weights for every grid point.
+        """
+
+        if self._weights is None:
+            ones = torch.ones(len(self.grid), dtype=self.grid.dtype,
+                              device=self.grid.device, requires_grad=True)
+            self._weights, = torch.autograd.grad(self.integrate(ones, power=1), ones)
+        return self._weights
+
+
+class TestFunctionBank():
+    """
+    Set of K test functions for variational (hp-VPINN like) weak form.
+    Test functions are evaluated once on the grid and cached with quadrature
+    weights as K x N matrix, so weak residuals of all test functions
+    R_k = integral(phi_k * residual) are computed by one matmul.
+    Loss term of every equation is mean(R_k^2) over test functions.
+    """
+
+    def __init__(self, functions: List[callable]):
+        """
+        Args:
+            functions (List[callable]): functions of grid, every function returns
+                values of one test function (n_points,) or of several ones (k, n_points).
+        """
+
+        self.functions = functions
+        self.matrix = None
+        self._quadrature = None
+
+    def evaluate(self, grid: torch.Tensor) -> torch.Tensor:
+        """ Values of all test functions.
+
+        Args:
+            grid (torch.Tensor): grid points.
+
+        Returns:
+            torch.Tensor: K x N matrix of test functions values.
+        """
+
+        values = [func(grid).reshape(-1, len(grid)) for func in self.functions]
+        return torch.cat(values).to(grid.device)
+
+    def residual(self, op: torch.Tensor, quadrature: Quadrature) -> torch.Tensor:
+        """ Weak residual of every equation.
+
+        Args:
+            op (torch.Tensor): strong residual (n_points, n_equations).
+            quadrature (Quadrature): quadrature for the grid points of op.
+
+        Returns:
+            torch.Tensor: mean of squared weak residuals over test functions (1, n_equations).
+        """
+
+        if self._quadrature is not quadrature:
+            self.matrix = self.evaluate(quadrature.grid) * quadrature.weights
+            self._quadrature = quadrature
+        weak = self.matrix.to(op.dtype) @ op
+        return torch.mean(weak ** 2, 0).reshape(1, -1)
+
+    @classmethod
+    def legendre(cls, order: int, bounds: List[tuple]) -> 'TestFunctionBank':
+        """ Tensor product test functions phi_k = P_{k+1} - P_{k-1}, k = 1..order
+            (P_k is Legendre polynomial), vanishing on the domain boundary.
+
+        Args:
+            order (int): number of test functions along every axis.
+            bounds (List[tuple]): (start, end) of the domain along every axis.
+
+        Returns:
+            TestFunctionBank: bank of order**n_dims test functions.
+        """
+
+        def functions(grid: torch.Tensor) -> torch.Tensor:
+            bank = None
+            for axis, (start, end) in enumerate(bounds):
+                x = (2 * grid[:, axis] - start - end) / (end - start)
+                poly = [torch.ones_like(x), x]
+                for n in range(1, order + 1):
+                    poly.append(((2 * n + 1) * x * poly[n] - n * poly[n - 1]) / (n + 1))
+                phi = torch.stack([poly[k + 1] - poly[k - 1] for k in range(1, order + 1)])
+                if bank is None:
+                    bank = phi
+                else:
+                    bank = (bank[:, None, :] * phi[None, :, :]).reshape(-1, len(x))
+            return bank
+
+        return cls([functions])
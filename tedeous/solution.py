@@ -12,7 +12,9 @@ from tedeous.eval import Operator, Bounds
 from tedeous.losses import Losses
 from tedeous.device import device_type, check_device
 from tedeous.input_preprocessing import lambda_prepare, Equation_NN, Equation_mat, Equation_autograd
-from tedeous.utils import bcs_reshape, samples_count, Lambda, lambda_print
+from tedeous.distributed import shard_problem, shard_mask, shard_weights
+from tedeous.precision import PrecisionPolicy, PrecisionModel
+from tedeous.utils import lambda_print, lambda_strategy_choice, SobolLambda
 
 
 flatten_list = lambda t: [item for sublist in t for item in sublist]
@@ -31,51 +33,99 @@ class Solution():
         lambda_operator,
         lambda_bound,
         tol: float = 0,
-        derivative_points: int = 2):
+        derivative_points: int = 2,
+        distributed: bool = False,
+        precision: Union[PrecisionPolicy, None] = None,
+        lambda_strategy: Union[str, Any] = 'sobol',
+        points_mask: Union[callable, None] = None):
         """
         Args:
             grid (torch.Tensor): discretization of comp-l domain.
             equal_cls (Union[Equation_NN, Equation_mat, Equation_autograd]): Equation_{NN, mat, autograd} object.
             model (Union[torch.nn.Sequential, torch.Tensor]): model of *mat or NN or autograd* mode.
             mode (str): *mat or NN or autograd*
-            weak_form (Union[None, list[callable]]): list with basis functions, if the form is *weak*.
+            weak_form (Union[None, list[callable]]): list with basis functions
+            or TestFunctionBank, if the form is *weak*.
             lambda_operator (_type_): regularization parameter for operator term in loss.
             lambda_bound (_type_): regularization parameter for boundary term in loss.
             tol (float, optional): penalty in *casual loss*. Defaults to 0.
             derivative_points (int, optional): points number for derivative calculation.
             For details to Derivative_mat class.. Defaults to 2.
+            distributed (bool, optional): shard collocation and boundary points
+            across ranks of the process group. Defaults to False.
+            precision (Union[PrecisionPolicy, None], optional): dtypes of model
+            outputs (residual) and loss reduction. Grid, model and equal_cls
+            are expected to be prepared by the policy already. Defaults to None.
+            lambda_strategy (Union[str, Any], optional): adaptive lambdas strategy
+            (*sobol, gradnorm, ntk, relobralo* or LambdaStrategy object). Defaults to 'sobol'.
+            points_mask (Union[callable, None], optional): function, that returns boolean
+            mask of the collocation and boundary points taken into the loss (e.g. subsample
+            for the cache screening, see shard_problem). Defaults to None (all points).
         """
 
         self.grid = check_device(grid)
-        if mode == 'NN':
-            sorted_grid = Points_type(self.grid).grid_sort()
-            self.n_t = len(sorted_grid['central'][:, 0].unique())
-        elif mode == 'autograd':
-            self.n_t = len(self.grid[:, 0].unique())
-        elif mode == 'mat':
-            self.n_t = grid.shape[1]
         equal_copy = deepcopy(equal_cls)
         prepared_operator = equal_copy.operator_prepare()
         self._operator_coeff(equal_cls, prepared_operator)
         prepared_bconds = equal_copy.bnd_prepare()
+        operator_grid = self.grid
+        mask_fn = shard_mask if distributed else points_mask
+        if mask_fn is not None:
+            operator_grid, prepared_operator, prepared_bconds = shard_problem(
+                self.grid, prepared_operator, prepared_bconds, mode, mask_fn)
+        self.t_bins, self.n_t = self._time_bins(operator_grid, mode, mask_fn)
         self.model = model.to(device_type())
         self.mode = mode
         self.weak_form = weak_form
         self.lambda_operator = lambda_operator
         self.lambda_bound = lambda_bound
         self.tol = tol
+        self.derivative_points = derivative_points
+        self.precision = precision
+        self.lambda_strategy = lambda_strategy_choice(lambda_strategy)
 
+        model = self.model
+        if precision is not None and mode in ('NN', 'autograd'):
+            model = PrecisionModel(self.model, precision)
 
-        self.operator = Operator(self.grid, prepared_operator, self.model,
+        self.operator = Operator(operator_grid, prepared_operator, model,
                                    self.mode, weak_form, derivative_points)
-        self.boundary = Bounds(self.grid, prepared_bconds, self.model,
+        self.boundary = Bounds(self.grid, prepared_bconds, model,
                                    self.mode, weak_form, derivative_points)
 
-        self.loss_cls = Losses(self.mode, self.weak_form, self.n_t, self.tol)
+        self.loss_cls = Losses(self.mode, self.weak_form, self.n_t, self.tol, self.t_bins)
         self.eps = 0
-        self.op_list = []
-        self.bval_list = []
-        self.loss_list = []
+        self.distributed = distributed
+        self._shard_weights = None
+
+    @staticmethod
+    def _time_bins(operator_grid: torch.Tensor,
+                   mode: str,
+                   mask_fn: Union[callable, None]) -> Tuple[torch.Tensor, int]:
+        """ Time moment index for every row of the operator residual
+            (for *casual loss*), the residual rows are the points of the shard
+            or the masked points if the problem is sharded (see shard_problem).
+
+        Args:
+            operator_grid (torch.Tensor): grid of the operator computation.
+            mode (str): *mat or NN or autograd*.
+            mask_fn (Union[callable, None]): mask function of the shard_problem.
+
+        Returns:
+            t_bins (torch.Tensor): time moment index of every residual row.
+            n_t (int): number of time moments.
+        """
+        if mode == 'NN':
+            central = Points_type(operator_grid).grid_sort()['central']
+            if mask_fn is not None:
+                central = central[mask_fn(central)]
+            t = central[:, 0]
+        elif mode == 'autograd':
+            t = operator_grid[:, 0]
+        elif mode == 'mat':
+            t = operator_grid[0].reshape(-1)
+        _, t_bins = torch.unique(t, return_inverse=True)
+        return t_bins, int(t_bins.max()) + 1
 
     @staticmethod
     def _operator_coeff(equal_cls: Any, operator: list):
@@ -95,6 +145,27 @@ class Solution():
                         eq[key]['coeff'] = equal_cls.operator[key]['coeff'].to(device_type())
 
 
+    def _shard_weighted(self,
+                        op: torch.Tensor,
+                        bval_diff: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """ Weights the local operator and boundary terms by the shard sizes
+            (see shard_weights), so the gradients averaged over ranks are the
+            gradients of the loss on all points.
+
+        Args:
+            op (torch.Tensor): operator residual of the shard.
+            bval_diff (torch.Tensor): MSE of every boundary type of the shard.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: weighted residual and boundary MSE.
+        """
+        if self._shard_weights is None:
+            counts = torch.tensor([op.shape[0]] + list(self.boundary.bval_length))
+            self._shard_weights = shard_weights(counts).to(op.device)
+        # the residual is squared in the loss
+        op = op * torch.sqrt(self._shard_weights[0]).to(op.dtype)
+        return op, bval_diff * self._shard_weights[1:].to(bval_diff.dtype)
+
     def evaluate(self,
                  second_order_interactions: bool = True,
                  sampling_N: int = 1,
@@ -118,44 +189,33 @@ class Solution():
         op = self.operator.operator_compute()
         bval, true_bval, bval_keys, bval_length = self.boundary.apply_bcs()
 
+        if self.precision is not None:
+            op = op.to(self.precision.loss)
+            bval = bval.to(self.precision.loss)
+            true_bval = true_bval.to(self.precision.loss)
+        bval_diff = self.boundary.bcs_mse(bval, true_bval)
+        if self.distributed:
+            op, bval_diff = self._shard_weighted(op, bval_diff)
+
         self.lambda_operator = lambda_prepare(op, self.lambda_operator)
-        self.lambda_bound = lambda_prepare(bval, self.lambda_bound)
+        self.lambda_bound = lambda_prepare(bval_diff, self.lambda_bound)
 
-        loss, loss_normalized = self.loss_cls.compute(op, bval, true_bval,
+        loss, loss_normalized = self.loss_cls.compute(op, bval_diff,
                                                       self.lambda_operator,
                                                       self.lambda_bound,
                                                       save_graph)
 
         if lambda_update:
-            # TODO refactor this lambda thing to class or function.
-            bcs = bcs_reshape(bval, true_bval, bval_length)
-            op_length = [op.shape[0]]*op.shape[-1]
-
-            self.op_list.append(torch.t(op).reshape(-1).cpu().detach().numpy())
-            self.bval_list.append(bcs.cpu().detach().numpy())
-            self.loss_list.append(float(loss_normalized.item()))
-
-            sampling_amount, sampling_D = samples_count(
-                        second_order_interactions = second_order_interactions,
-                        sampling_N = sampling_N,
-                        op_length=op_length,
-                        bval_length = bval_length)
-
-            if len(self.op_list) == sampling_amount:
-                self.lambda_operator, self.lambda_bound = Lambda(
-                                        self.op_list, self.bval_list,
-                                        self.loss_list,
-                                        second_order_interactions)\
-                                        .update(op_length=op_length,
-                                                bval_length=bval_length,
-                                                sampling_D=sampling_D)
-                self.op_list.clear()
-                self.bval_list.clear()
-                self.loss_list.clear()
-
-                oper_keys = [f'eq_{i}' for i in range(len(op_length))]
-                lambda_print(self.lambda_operator, oper_keys)
-                lambda_print(self.lambda_bound, bval_keys)
-
+            op_loss, bnd_loss = self.loss_cls.group_losses(op, bval_diff)
+            bcs = torch.split(bval - true_bval, bval_length)
+            lambdas = self.lambda_strategy.step(self.model, op, bcs,
+                                                op_loss, bnd_loss, sampling_N,
+                                                second_order_interactions)
+            if lambdas is not None:
+                self.lambda_operator, self.lambda_bound = lambdas
+                if isinstance(self.lambda_strategy, SobolLambda):
+                    oper_keys = [f'eq_{i}' for i in range(len(op_loss))]
+                    lambda_print(self.lambda_operator, oper_keys)
+                    lambda_print(self.lambda_bound, bval_keys)
 
         return loss, loss_normalized
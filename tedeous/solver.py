@@ -2,6 +2,7 @@
 
 import os
 import datetime
+import warnings
 from typing import Union, List, Any
 from torch.optim.lr_scheduler import ExponentialLR
 import numpy as np
@@ -13,8 +14,11 @@ import torch
 
 from tedeous.device import check_device, device_type
 from tedeous.solution import Solution
-from tedeous.optimizers import PSO
-from tedeous.cache import CacheUtils, create_random_fn, Cache
+from tedeous.optimizers import PSO, OptimizerSchedule
+from tedeous.cache import CacheUtils, CachePolicy, SnapshotWriter, create_random_fn, Cache
+from tedeous.distributed import init_distributed, is_main_process, all_reduce_mean, \
+    all_reduce_gradients, broadcast_parameters, broadcast_object
+from tedeous.precision import PrecisionPolicy
 
 
 def grid_format_prepare(
@@ -217,8 +221,8 @@ class Solver():
             equal_cls (Any): Equation_{NN, mat, autograd} object.
             model (Union[torch.Tensor, torch.nn.Module]): *mat, NN, autograd* model.
             mode (str): *mat, NN, autograd*, equation solving way.
-            weak_form (Union[None, list], optional): list with basis functions,
-            if the form is *weak*. Defaults to None.
+            weak_form (Union[None, list], optional): list with basis functions
+            or TestFunctionBank, if the form is *weak*. Defaults to None.
         """
 
         self.grid = check_device(grid)
@@ -246,6 +250,14 @@ class Solver():
         self.plot = None
         self.last_loss = None
         self.tmax = None
+        self._distributed = False
+        self._main_process = True
+        self._schedule = None
+        self._precision = None
+        self._optimizer_args = None
+        self._snapshot_writer = None
+        self._snapshot_every = None
+        self._snapshot_on_best = False
 
     def _optimizer_choice(
         self,
@@ -264,6 +276,8 @@ class Solver():
             optimzer: ready optimizer.
         """
 
+        self._optimizer_args = (optimizer, learning_rate)
+        self._optimizer_close()
         if optimizer == 'Adam':
             torch_optim = torch.optim.Adam
         elif optimizer == 'SGD':
@@ -271,15 +285,15 @@ class Solver():
         elif optimizer == 'LBFGS':
             torch_optim = torch.optim.LBFGS
         elif optimizer == 'PSO':
+            if self._distributed:
+                raise NotImplementedError('PSO optimizer is not available in data-parallel mode.')
             optimizer = PSO(lr=learning_rate)
             optimizer.param_init(self.sln_cls, self.tmax)
             return optimizer
         else:
-            try:
+            if hasattr(optimizer, 'param_init'):
                 optimizer.param_init(self.sln_cls, self.tmax)
                 print('Custom optimizer is activated')
-            except:
-                None
             return optimizer
 
         if self.mode in ('NN', 'autograd'):
@@ -289,6 +303,143 @@ class Solver():
 
         return optimizer
 
+    def _optimizer_close(self):
+        """ Releases the resources of the current optimizer
+        (worker processes of PSO with *process* backend).
+        """
+        if isinstance(self.optimizer, PSO):
+            self.optimizer.close()
+
+    def _optimizer_switch(self):
+        """ Starts the next stage of the optimizer schedule. The model state
+        is carried over, stop criteria counters are reset for the new optimizer.
+        """
+        optimizer_mode, learning_rate, _ = self._schedule.switch(self.t)
+        if self._precision is not None and \
+                self._precision.need_escalation(self.t, self._schedule):
+            self._precision_escalate()
+        self.optimizer = self._optimizer_choice(optimizer_mode, learning_rate)
+        self._stop_dings = 0
+        self._t_imp_start = self.t
+        if self._verbose and self._main_process:
+            print('[{}] Optimizer is switched to {}'.format(
+                datetime.datetime.now(), self.optimizer.__class__.__name__))
+
+    def _stage_amp(self, mixed_precision: bool, cuda_flag: bool):
+        """ Mixed precision flags for the current stage of the optimizer schedule.
+        AMP and the LBFGS optimizer are not compatible, so LBFGS stage works without AMP.
+
+        Args:
+            mixed_precision (bool): use or not torch.amp.
+            cuda_flag (bool): True, if CUDA is activated and mixed_precision=True.
+
+        Returns:
+            mixed_precision (bool): use or not torch.amp for the current stage.
+            cuda_flag (bool): cuda_flag for the current stage.
+        """
+        if self._schedule is not None and mixed_precision and \
+                isinstance(self.optimizer, torch.optim.LBFGS):
+            if self._verbose and self._main_process:
+                print('Mixed precision is disabled for the LBFGS stage.')
+            return False, False
+        return mixed_precision, cuda_flag
+
+    def _precision_check(self,
+                         precision: Union[PrecisionPolicy, None],
+                         mixed_precision: bool) -> Any:
+        """ Applies precision policy to the grid, the model and the equation.
+
+        Args:
+            precision (Union[PrecisionPolicy, None]): precision policy.
+            mixed_precision (bool): use or not torch.amp.
+
+        Raises:
+            NotImplementedError: precision policy and AMP are not compatible.
+
+        Returns:
+            Any: Equation_{NN, mat, autograd} object in policy dtypes.
+        """
+
+        self._precision = precision
+        if precision is None:
+            return self.equal_cls
+        if mixed_precision:
+            raise NotImplementedError('Precision policy and mixed precision are not compatible.')
+        self.grid = self.grid.detach().to(precision.grid)
+        self.model = precision.prepare_model(self.model)
+        return precision.prepare_equation(self.equal_cls)
+
+    def _precision_escalate(self):
+        """ Casts all components to the escalated precision and rebuilds the loss.
+        Lambdas are carried over. The optimizer should be recreated after this.
+        """
+
+        self._precision = self._precision.escalated()
+        equal_cls = self._precision_check(self._precision, False)
+        self.sln_cls = Solution(self.grid, equal_cls,
+                                self.model, self.mode, self.weak_form,
+                                self.sln_cls.lambda_operator, self.sln_cls.lambda_bound,
+                                self.sln_cls.tol, self.sln_cls.derivative_points,
+                                distributed=self._distributed,
+                                precision=self._precision,
+                                lambda_strategy=self.sln_cls.lambda_strategy)
+        self.plot.model = self.model
+        self.plot.grid = self.grid
+        if self._verbose and self._main_process:
+            print('[{}] Precision is escalated to {}'.format(
+                datetime.datetime.now(), self._precision.model))
+
+    def _lr_scheduler(self, gamma: Union[float, None]) -> Union[ExponentialLR, None]:
+        """ Learning rate scheduler for the current optimizer.
+
+        Args:
+            gamma (Union[float, None]): multiplicative factor of learning rate decay.
+
+        Returns:
+            Union[ExponentialLR, None]: scheduler (None for gamma=None or not torch optimizers).
+        """
+        if gamma is None or not isinstance(self.optimizer, torch.optim.Optimizer):
+            return None
+        return ExponentialLR(self.optimizer, gamma=gamma)
+
+    def _optimizer_restore(self,
+                           optimizer_state: Union[dict, None],
+                           scheduler: Union[ExponentialLR, None],
+                           cache_verbose: bool = False):
+        """ Restores the optimizer state (e.g. Adam moments) and the learning rate
+        decay of the cached model, if the optimizer is the same. Hyperparameters
+        (learning rate, gamma) of the current run are kept.
+
+        Args:
+            optimizer_state (Union[dict, None]): optimizer and scheduler states of
+                the cached model (see Cache.optimizer_state).
+            scheduler (Union[ExponentialLR, None]): learning rate scheduler.
+            cache_verbose (bool, optional): printing cache operations. Defaults to False.
+        """
+
+        if optimizer_state is None or not isinstance(self.optimizer, torch.optim.Optimizer):
+            return
+        cached = optimizer_state['optimizer']
+        if cached['name'] != type(self.optimizer).__name__:
+            return
+        hyperparameters = [{key: value for key, value in group.items() if key != 'params'}
+                           for group in self.optimizer.param_groups]
+        try:
+            self.optimizer.load_state_dict(cached['state_dict'])
+        except ValueError:
+            # parameter groups of the cached run are different (e.g. inverse parameters)
+            return
+        for group, group_hyperparameters in zip(self.optimizer.param_groups, hyperparameters):
+            group.update(group_hyperparameters)
+        cached = optimizer_state['scheduler']
+        if scheduler is not None and cached is not None and cached['name'] == type(scheduler).__name__:
+            scheduler.last_epoch = cached['state_dict']['last_epoch']
+            for group, base_lr in zip(self.optimizer.param_groups, scheduler.base_lrs):
+                group['lr'] = base_lr * scheduler.gamma ** scheduler.last_epoch
+            scheduler._last_lr = [group['lr'] for group in self.optimizer.param_groups]
+        if cache_verbose and self._main_process:
+            print('Optimizer state is restored from cache')
+
     def _str_param(self):
         """Print the coefficients determining during solution.
         (for inverse tasks)
@@ -311,6 +462,19 @@ class Solver():
         """
         self._line = np.polyfit(range(loss_oscillation_window), self.last_loss, 1)
 
+    def _model_randomize(self):
+        """ Adds some variance to the model weights (after stop ding) to avoid local optima.
+        In data-parallel mode rank 0 weights are broadcasted to keep replicas identical.
+        Skipped if the stop ding ends the current stage of the optimizer schedule,
+        so the next optimizer gets the trained model.
+        """
+        if self._schedule is not None and self._schedule.need_switch(self.t, True):
+            return
+        if self.mode in ('NN', 'autograd'):
+            self.model.apply(self._r)
+            if self._distributed:
+                broadcast_parameters(self.model)
+
     def _window_check(self, eps: float, loss_oscillation_window: int):
         """ Stopping criteria. We devide angle coeff of the approximating
         line (line_create()) on current loss value and compare one with *eps*
@@ -323,8 +487,7 @@ class Solver():
             self._line_create(loss_oscillation_window)
             if abs(self._line[0] / self.cur_loss) < eps and self.t > 0:
                 self._stop_dings += 1
-                if self.mode in ('NN', 'autograd'):
-                    self.model.apply(self._r)
+                self._model_randomize()
                 self._check = 'window_check'
 
     def _patience_check(self, no_improvement_patience: int):
@@ -338,8 +501,7 @@ class Solver():
         if (self.t - self._t_imp_start) == no_improvement_patience and self._check is None:
             self._t_imp_start = self.t
             self._stop_dings += 1
-            if self.mode in ('NN', 'autograd'):
-                self.model.apply(self._r)
+            self._model_randomize()
             self._check = 'patience_check'
 
     def _absloss_check(self, abs_loss: float):
@@ -374,6 +536,10 @@ class Solver():
             print_every (Union[None, int]): print or save after *print_every* steps.
         """
 
+        if not self._main_process:
+            self._check = None
+            return
+
         if self._check == 'window_check':
             print('[{}] Oscillation near the same loss'.format(
                             datetime.datetime.now()))
@@ -458,6 +624,10 @@ class Solver():
                                                               sampling_N, lambda_update)
 
             loss.backward()
+            if self._distributed:
+                all_reduce_gradients(self.model)
+                loss = all_reduce_mean(loss)
+                loss_normalized = all_reduce_mean(loss_normalized)
             self.cur_loss = loss_normalized if normalized_loss_stop else loss
             return loss
 
@@ -474,10 +644,9 @@ class Solver():
             self.cur_loss = loss_normalized if normalized_loss_stop else loss
             return loss
 
-        try:
-            self.optimizer.name == 'PSO'
+        if getattr(self.optimizer, 'name', None) == 'PSO':
             self.cur_loss = self.optimizer.step()
-        except:
+        else:
             self.optimizer.step(closure) if not cuda_flag else closure_cuda()
 
     def _model_save(
@@ -485,7 +654,8 @@ class Solver():
         cache_utils: CacheUtils,
         save_always: bool,
         scaler: Any,
-        name: str):
+        name: str,
+        scheduler: Union[ExponentialLR, None] = None):
         """ Model saving.
 
         Args:
@@ -493,13 +663,88 @@ class Solver():
             save_always (bool): flag for model saving.
             scaler (Any): GradScaler for CUDA.
             name (str): model name.
+            scheduler (Union[ExponentialLR, None], optional): learning rate scheduler,
+                its state is saved with the optimizer state. Defaults to None.
         """
-        if save_always:
+        if save_always and self._main_process:
+            loss = None if self.cur_loss is None else float(self.cur_loss)
             if self.mode == 'mat':
-                cache_utils.save_model_mat(model=self.model, grid=self.grid, name=name)
+                cache_utils.save_model_mat(model=self.model, grid=self.grid, name=name,
+                                           equal_cls=self.equal_cls, loss=loss)
             else:
                 scaler = scaler if scaler else None
-                cache_utils.save_model(model=self.model, name=name)
+                cache_utils.save_model(model=self.model, name=name, grid=self.grid,
+                                       equal_cls=self.equal_cls, loss=loss,
+                                       optimizer=self.optimizer, scheduler=scheduler)
+
+    def _snapshot_start(self,
+                        snapshot_every: Union[int, None],
+                        snapshot_on_best: bool,
+                        snapshot_keep: int,
+                        cache_dir: str,
+                        name: Union[str, None]):
+        """ Starts the background snapshots writer (see SnapshotWriter).
+
+        Args:
+            snapshot_every (Union[int, None]): snapshots period (steps).
+            snapshot_on_best (bool): take snapshot at every new minimal loss.
+            snapshot_keep (int): number of kept snapshots.
+            cache_dir (str): cache directory, snapshots are saved in
+                *snapshots/name* subdirectory.
+            name (Union[str, None]): model name.
+        """
+
+        self._snapshot_every = snapshot_every
+        self._snapshot_on_best = snapshot_on_best
+        self._snapshot_writer = None
+        if (snapshot_every is None and not snapshot_on_best) or not self._main_process:
+            return
+        if name is None:
+            name = str(datetime.datetime.now().timestamp())
+        self._snapshot_writer = SnapshotWriter(
+            self.model, os.path.join(cache_dir, 'snapshots', name), snapshot_keep, self.grid)
+
+    def _snapshot(self, improved: bool):
+        """ Takes the model snapshot if it is time to (returns without waiting for the saving).
+
+        Args:
+            improved (bool): the loss is a new minimum.
+        """
+
+        if self._snapshot_writer is None:
+            return
+        if (self._snapshot_on_best and improved) or \
+                (self._snapshot_every is not None and self.t % self._snapshot_every == 0):
+            self._snapshot_writer.snapshot(self.model, self.t, float(self.cur_loss))
+
+    def _distributed_check(self, distributed: bool, lambda_update: bool, tol: float):
+        """ Preparation for data-parallel training.
+
+        Args:
+            distributed (bool): use or not data-parallel training.
+            lambda_update (bool): adaptive lambdas computing.
+            tol (float): penalty in casual loss.
+
+        Raises:
+            NotImplementedError: *mat* mode, weak form, casual loss, adaptive lambdas
+            and cuda device are not compatible with data-parallel training.
+        """
+
+        self._distributed = distributed
+        if not distributed:
+            self._main_process = True
+            return
+        if self.mode == 'mat':
+            raise NotImplementedError('Data-parallel training is not available for *mat* mode.')
+        if self.weak_form is not None and self.weak_form != []:
+            raise NotImplementedError('Weak form and data-parallel training are not compatible.')
+        if tol != 0 or lambda_update:
+            raise NotImplementedError('Casual loss, adaptive lambdas and data-parallel'
+                                      ' training are not compatible.')
+        if self.device != 'cpu':
+            raise NotImplementedError('Data-parallel training uses gloo backend (cpu only).')
+        init_distributed('gloo')
+        self._main_process = is_main_process()
 
     def solve(
         self,
@@ -522,14 +767,24 @@ class Solver():
         use_cache: bool = True,
         cache_dir: str = '../cache/',
         cache_verbose: bool = False,
+        cache_workers: Union[int, None] = None,
+        cache_memory: Union[int, None] = None,
+        cache_screening: Union[int, None] = None,
+        cache_screening_points: int = 256,
+        cache_policy: Union[CachePolicy, None] = None,
+        cache_neighbours: Union[int, None] = None,
+        cache_blend: bool = False,
         save_always: bool = False,
+        snapshot_every: Union[int, None] = None,
+        snapshot_on_best: bool = False,
+        snapshot_keep: int = 3,
         print_every: Union[int, None] = 100,
         cache_model: Union[torch.nn.Sequential, None] = None,
         patience: int = 5,
         loss_oscillation_window: int = 100,
         no_improvement_patience: int = 1000,
         model_randomize_parameter: Union[int, float] = 0,
-        optimizer_mode: Union[str, Any] = 'Adam',
+        optimizer_mode: Union[str, Any, list] = 'Adam',
         step_plot_print: Union[bool, int] = False,
         step_plot_save: Union[bool, int] = False,
         image_save_dir: Union[str, None] = None,
@@ -537,7 +792,10 @@ class Solver():
         clear_cache: bool = False,
         normalized_loss_stop: bool = False,
         inverse_parameters: dict = None,
-        mixed_precision: bool = False) -> Union[torch.nn.Module, torch.Tensor]:
+        mixed_precision: bool = False,
+        distributed: bool = False,
+        precision: Union[PrecisionPolicy, None] = None,
+        lambda_strategy: Union[str, Any] = 'sobol') -> Union[torch.nn.Module, torch.Tensor]:
         """ High-level interface for solving equations.
 
         Args:
@@ -553,6 +811,11 @@ class Solver():
                 (serves for adaprive lambdas). Defaults to True.
             sampling_N (int, optional): essentially determines how often the
                 lambda will be re-evaluated. Defaults to 1.
+            lambda_strategy (Union[str, Any], optional): adaptive lambdas strategy,
+                *sobol* (variance-based sensitivity analysis of loss groups), *gradnorm* (gradients
+                magnitudes balancing), *ntk* (NTK traces balancing), *relobralo*
+                (relative loss balancing) or LambdaStrategy object. Strategies other than
+                *sobol* update lambdas every *sampling_N* steps. Defaults to 'sobol'.
             verbose (int, optional): detailed info about training process. Defaults to 0.
             learning_rate (float, optional): determines the step size at each iteration
                     while moving toward a minimum of a loss function. Defaults to 1e-4.
@@ -572,11 +835,35 @@ class Solver():
             use_cache (bool, optional): use or not cached models. Defaults to True.
             cache_dir (str, optional):directory where saved cache in. Defaults to '../cache/'.
             cache_verbose (bool, optional): printing cache operations. Defaults to False.
+            cache_workers (Union[int, None], optional): number of threads that evaluate
+                                                        cached models. Defaults to None (one thread).
+            cache_memory (Union[int, None], optional): memory budget (bytes) for cached models
+                                                       evaluated at the same time. Defaults to None.
+            cache_screening (Union[int, None], optional): number of cached models, that pass
+                                                          the screening on the random subsample of
+                                                          grid and boundary points to the full
+                                                          evaluation. Defaults to None (no screening).
+            cache_screening_points (int, optional): maximal number of grid and boundary points
+                                                    for the screening. Defaults to 256.
+            cache_policy (Union[CachePolicy, None], optional): size limits and eviction
+                                                               of the cache directory. Defaults to None.
+            cache_neighbours (Union[int, None], optional): number of the nearest solved problems of
+                                                           the equation family (same operator structure,
+                                                           nearest coefficients and boundary values)
+                                                           taken from cache. Defaults to None.
+            cache_blend (bool, optional): blend the nearest problems solutions with inverse distance
+                                          weights (the blend is distilled into the model). Defaults to False.
             save_always (bool, optional): saves trained model. Defaults to False.
+            snapshot_every (Union[int, None], optional): saves the model snapshot every
+                                                         *snapshot_every* step in the background
+                                                         (in *cache_dir/snapshots/name*). Defaults to None.
+            snapshot_on_best (bool, optional): saves the model snapshot at every new minimal loss
+                                               in the background. Defaults to False.
+            snapshot_keep (int, optional): number of kept (last) snapshots. Defaults to 3.
             print_every (Union[int, None], optional): prints the loss state and figures
                                                       every *print_every* step. Defaults to 100.
-            cache_model (Union[torch.nn.Sequential, None], optional): model that uses in cache for *mat* mode.
-                                                                      Defaults to None.
+            cache_model (Union[torch.nn.Sequential, None], optional): deprecated and ignored,
+                                                                      *mat* models are cached as tensors. Defaults to None.
             patience (int, optional): maximum number of times the stopping criterion
                                       can be satisfied. Defaults to 5.
             loss_oscillation_window (int, optional): number of iterations through which
@@ -585,8 +872,10 @@ class Solver():
                                                      the loss may not improve. Defaults to 1000.
             model_randomize_parameter (Union[int, float], optional): some error for resulting
                                         model weights to to avoid local optima.. Defaults to 0.
-            optimizer_mode (Union[str, Any], optional): optimizer choice (Adam, SGD, LBFGS, PSO)
-                    or custom optimizer. Defaults to 'Adam'.
+            optimizer_mode (Union[str, Any, list], optional): optimizer choice (Adam, SGD, LBFGS, PSO)
+                    or custom optimizer. It also may be the list of stages
+                    [(optimizer, learning_rate, until), ...] (see OptimizerSchedule),
+                    then *learning_rate* parameter is ignored. Defaults to 'Adam'.
             step_plot_print (Union[bool, int], optional): draws a figure through each given step.
                                                           Defaults to False.
             step_plot_save (Union[bool, int], optional):  saves a figure through each given step.
@@ -601,6 +890,13 @@ class Solver():
                                                  Defaults to None.
             mixed_precision (bool, optional): flag for using mixed precision
                                               operations. Defaults to False.
+            distributed (bool, optional): data-parallel training (gloo backend, CPU).
+                    Grid and boundary points are sharded across ranks of the
+                    process group (e.g. launched with torchrun), gradients are
+                    all-reduced. Defaults to False.
+            precision (Union[PrecisionPolicy, None], optional): dtypes of the grid,
+                    the stencil, the model, the residual and the loss, and optional
+                    escalation to higher precision (see PrecisionPolicy). Defaults to None.
 
         Returns:
             Union[torch.nn.Module, torch.Tensor]: trained model
@@ -615,80 +911,135 @@ class Solver():
         self._patience = patience
         self.tmax = tmax
         scaler, cuda_flag, dtype = self._amp_mixed(mixed_precision)
+        self._distributed_check(distributed, lambda_update, tol)
+
+        if cache_model is not None:
+            warnings.warn('cache_model is deprecated and ignored, *mat* models are cached as tensors.',
+                          DeprecationWarning, stacklevel=2)
 
         cache_utils = CacheUtils()
-        if use_cache:
-            cache_utils.cache_dir = cache_dir
+        cache_utils.cache_dir = cache_dir
+        cache_utils.policy = cache_policy
+        optimizer_state = None
+        if use_cache and self._main_process:
             cache_cls = Cache(self.grid, self.equal_cls, self.model,
-                              self.mode, self.weak_form, mixed_precision)
+                              self.mode, self.weak_form, mixed_precision, cache_dir)
             self.model = cache_cls.cache(nmodels,
                                          lambda_operator,
                                          lambda_bound,
                                          cache_verbose,
                                          model_randomize_parameter,
-                                         cache_model)
-        if clear_cache:
+                                         cache_workers,
+                                         cache_memory,
+                                         cache_screening,
+                                         cache_screening_points,
+                                         cache_neighbours,
+                                         cache_blend)
+            optimizer_state = cache_cls.optimizer_state
+        if use_cache and self._distributed:
+            # cache lookup runs on the main process only, other ranks take its result
+            self.model, optimizer_state = broadcast_object((self.model, optimizer_state))
+        if clear_cache and self._main_process:
             cache_utils.clear_cache_dir()
+        equal_cls = self._precision_check(precision, mixed_precision)
+        if self._distributed:
+            broadcast_parameters(self.model)
 
-        self.sln_cls = Solution(self.grid, self.equal_cls,
+        self.sln_cls = Solution(self.grid, equal_cls,
                            self.model, self.mode, self.weak_form,
-                           lambda_operator, lambda_bound, tol, derivative_points)
+                           lambda_operator, lambda_bound, tol, derivative_points,
+                           distributed=self._distributed,
+                           precision=self._precision,
+                           lambda_strategy=lambda_strategy)
         with torch.autocast(device_type=self.device, dtype=dtype, enabled=mixed_precision):
             min_loss, _ = self.sln_cls.evaluate()
+        if self._distributed:
+            min_loss = all_reduce_mean(min_loss)
 
         self.cur_loss = min_loss
 
         self.last_loss = np.zeros(loss_oscillation_window) + float(min_loss)
 
-        self.optimizer = self._optimizer_choice(optimizer_mode, learning_rate)
+        if isinstance(optimizer_mode, list):
+            self._schedule = OptimizerSchedule(optimizer_mode)
+            optimizer_mode, learning_rate, _ = self._schedule.current()
+
+        self._snapshot_start(snapshot_every, snapshot_on_best, snapshot_keep, cache_dir, name)
+
+        try:
+            self.optimizer = self._optimizer_choice(optimizer_mode, learning_rate)
+            stage_mixed, stage_cuda = self._stage_amp(mixed_precision, cuda_flag)
+
+            self.plot = Plots(self.model, self.grid, self.mode, tol)
+
+            scheduler = self._lr_scheduler(gamma)
+            if use_cache:
+                self._optimizer_restore(optimizer_state, scheduler, cache_verbose)
+
+            if verbose and self._main_process:
+                print('[{}] initial (min) loss is {}'.format(
+                    datetime.datetime.now(), min_loss.item()))
+
+            while self._stop_dings < self._patience or self.t < tmin:
+                self._optimizer_step(
+                    stage_mixed,
+                    scaler,
+                    stage_cuda,
+                    dtype,
+                    second_order_interactions,
+                    sampling_N,
+                    lambda_update,
+                    normalized_loss_stop)
+
+                if self.cur_loss != self.cur_loss:
+                    print(f'Loss is equal to NaN, something went wrong (LBFGS+high'
+                            f'learning rate and pytorch<1.12 could be the problem)')
+                    break
 
-        self.plot = Plots(self.model, self.grid, self.mode, tol)
+                self.last_loss[(self.t - 1) % loss_oscillation_window] = self.cur_loss
 
-        if gamma is not None:
-            scheduler = ExponentialLR(self.optimizer, gamma=gamma)
+                improved = self.cur_loss < min_loss
+                if improved:
+                    min_loss = self.cur_loss.item()
+                    self._t_imp_start = self.t
 
-        if verbose:
-            print('[{}] initial (min) loss is {}'.format(
-                datetime.datetime.now(), min_loss.item()))
+                self._snapshot(improved)
 
-        while self._stop_dings < self._patience or self.t < tmin:
-            self._optimizer_step(
-                mixed_precision,
-                scaler,
-                cuda_flag,
-                dtype,
-                second_order_interactions,
-                sampling_N,
-                lambda_update,
-                normalized_loss_stop)
+                if scheduler is not None and self.t % lr_decay == 0:
+                    scheduler.step()
 
-            if self.cur_loss != self.cur_loss:
-                print(f'Loss is equal to NaN, something went wrong (LBFGS+high'
-                        f'learning rate and pytorch<1.12 could be the problem)')
-                break
+                stop_dings = self._stop_dings
 
-            self.last_loss[(self.t - 1) % loss_oscillation_window] = self.cur_loss
-            
-            if self.cur_loss < min_loss:
-                min_loss = self.cur_loss.item()
-                self._t_imp_start = self.t
+                self._window_check(eps, loss_oscillation_window)
 
-            if gamma is not None and self.t % lr_decay == 0:
-                scheduler.step()
+                self._patience_check(no_improvement_patience)
 
-            self._window_check(eps, loss_oscillation_window)
+                self._absloss_check(abs_loss)
 
-            self._patience_check(no_improvement_patience)
+                plateau = self._check in ('window_check', 'patience_check') and \
+                    self._stop_dings > stop_dings
 
-            self._absloss_check(abs_loss)
+                if verbose:
+                    self._verbose_print(no_improvement_patience, print_every)
+                self._check = None
 
-            if verbose:
-                self._verbose_print(no_improvement_patience, print_every)
+                if self._schedule is not None and self._schedule.need_switch(self.t, plateau):
+                    self._optimizer_switch()
+                    stage_mixed, stage_cuda = self._stage_amp(mixed_precision, cuda_flag)
+                    scheduler = self._lr_scheduler(gamma)
+                elif self._precision is not None and self._precision.need_escalation(self.t):
+                    self._precision_escalate()
+                    self.optimizer = self._optimizer_choice(*self._optimizer_args)
+                    scheduler = self._lr_scheduler(gamma)
 
-            self.t += 1
-            if self.t > tmax:
-                break
+                self.t += 1
+                if self.t > tmax:
+                    break
+        finally:
+            if self._snapshot_writer is not None:
+                self._snapshot_writer.close()
+            self._optimizer_close()
 
-        self._model_save(cache_utils, save_always, scaler, name)
+        self._model_save(cache_utils, save_always, scaler, name, scheduler)
 
         return self.model
@@ -1,9 +1,7 @@
 """this one contain some stuff for computing different auxiliary things."""
 
-from typing import Tuple, List
+from typing import Tuple, List, Union, Any
 from torch.nn import Module
-from SALib import ProblemSpec
-import numpy as np
 import torch
 
 def samples_count(second_order_interactions: bool,
@@ -46,148 +44,315 @@ def lambda_print(lam: torch.Tensor, keys: List) -> None:
     for val, key in zip(lam, keys):
         print('lambda_{}: {}'.format(key, val.item()))
 
-def bcs_reshape(
-    bval: torch.Tensor,
-    true_bval: torch.Tensor,
-    bval_length: List) -> Tuple[dict, dict, dict, dict]:
-    """ Preprocessing for lambda evaluating.
+def bcond_select(bconds: list, mask_fn: callable) -> list:
+    """ Selects subset of points in every boundary condition
+        (bconds in input form, i.e. *bnd* are tensors of points).
+        Periodic conditions keep the pairs, where points of all sides are selected.
+        Conditions without selected points are dropped.
 
     Args:
-        bval (torch.Tensor): matrix, where each column is predicted
-                      boundary values of one boundary type.
-        true_bval (torch.Tensor): matrix, where each column is true
-                            boundary values of one boundary type.
-        bval_length (list): list of length of each boundary type column.
+        bconds (list): list of dictionaries where every dict is one boundary condition.
+        mask_fn (callable): function, that returns boolean mask for tensor of points.
 
     Returns:
-        torch.Tensor: vector of difference between bval and true_bval.
+        list: boundary conditions with selected points.
     """
 
-    bval_diff = bval - true_bval
-
-    bcs = torch.cat([bval_diff[0:bval_length[i], i].reshape(-1)
-                                        for i in range(bval_diff.shape[-1])])
-
-    return bcs
-
-
-class Lambda:
+    selected = []
+    for bcond in bconds:
+        bcond = dict(bcond)
+        if bcond['type'] == 'periodic':
+            mask = mask_fn(bcond['bnd'][0])
+            for bnd in bcond['bnd'][1:]:
+                mask = mask & mask_fn(bnd)
+            bcond['bnd'] = [bnd[mask] for bnd in bcond['bnd']]
+        else:
+            mask = mask_fn(bcond['bnd'])
+            bcond['bnd'] = bcond['bnd'][mask]
+        bval = bcond['bval']
+        if isinstance(bval, torch.Tensor) and bval.dim() > 0 and bval.shape[0] == len(mask):
+            bcond['bval'] = bval[mask]
+        if mask.any():
+            selected.append(bcond)
+    return selected
+
+
+class LambdaStrategy():
     """
-    Serves for computing adaptive lambdas.
+    Interface class for adaptive lambdas strategies. Strategy computes
+    lambdas for every equation and every boundary type from the current
+    residuals, the result is smoothed by exponential moving average.
     """
-    def __init__(self, op_list: list,
-                 bcs_list: list,
-                 loss_list: list,
-                 sampling_N: int = 1,
-                 second_order_interactions = True):
-        """_summary_
-
+    def __init__(self, alpha: float = 0.9):
+        """
         Args:
-            op_list (list): list with operator solution.
-            bcs_list (list): list with boundary solution.
-            loss_list (list): list with losses.
-            sampling_N (int, optional): parameter for accumulation of solutions (op, bcs).
-                The more sampling_N, the more accurate the estimation of the variance.. Defaults to 1.
-            second_order_interactions (bool, optional): computes second order Sobol indices. Defaults to True.
+            alpha (float, optional): moving average factor
+                (lambda = alpha*lambda_old + (1-alpha)*lambda_new). Defaults to 0.9.
         """
-
-        self.second_order_interactions = second_order_interactions
-        self.op_list = op_list
-        self.bcs_list = bcs_list
-        self.loss_list = loss_list
-        self.sampling_N = sampling_N
+        self.alpha = alpha
+        self.lambdas = None
+        self.steps = 0
 
     @staticmethod
-    def lambda_compute(pointer: int, length_list: list, ST: np.ndarray) -> dict:
-        """ Computes lambdas.
-
-        Args:
-            pointer (int): the label to calculate the lambda for the corresponding parameter.
-            length_list (list): dict where values are lengths.
-            ST (np.ndarray): result of SALib.ProblemSpec().
+    def _parameters(model: Union[Module, torch.Tensor], last_layer: bool = False) -> list:
+        """ Trainable parameters of *mat, NN, autograd* model
+        (only of the last layer with trainable parameters if *last_layer*).
+        """
+        if not isinstance(model, Module):
+            return [model]
+        if last_layer:
+            layers = [module for module in model.modules()
+                      if any(param.requires_grad for param in module.parameters(recurse=False))]
+            if layers:
+                return [param for param in layers[-1].parameters(recurse=False)
+                        if param.requires_grad]
+        return [param for param in model.parameters() if param.requires_grad]
 
-        Returns:
-            dict: _description_
+    @staticmethod
+    def _grads(value: torch.Tensor, params: list) -> torch.Tensor:
+        """ Flattened gradient of value with respect to params (the graph is retained).
         """
+        grads = torch.autograd.grad(value, params, retain_graph=True, allow_unused=True)
+        return torch.cat([torch.zeros_like(param).reshape(-1) if grad is None
+                          else grad.reshape(-1) for param, grad in zip(params, grads)])
 
-        lambdas = []
-        for value in length_list:
-            lambdas.append(sum(ST) / sum(ST[pointer:pointer + value]))
-            pointer += value
-        return torch.tensor(lambdas).float().reshape(1, -1)
+    @staticmethod
+    def _balance(stats: torch.Tensor) -> torch.Tensor:
+        """ Lambdas inversely proportional to statistics: lambda_i = sum(stats) / stats_i.
+        """
+        finfo = torch.finfo(stats.dtype)
+        stats = torch.clamp(stats, min=finfo.eps * stats.max().item() + finfo.tiny)
+        return stats.sum() / stats
 
-    def update(self, op_length: list,
-               bval_length: list,
-               sampling_D: int) -> Tuple[dict, dict]:
-        """ Updates all lambdas (operator and boundary).
+    def _smooth(self, lambdas: torch.Tensor, n_op: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """ Moving average of lambdas, split to operator and boundary parts.
+        """
+        if self.lambdas is None:
+            self.lambdas = lambdas
+        else:
+            self.lambdas = self.alpha * self.lambdas + (1 - self.alpha) * lambdas
+        return self.lambdas[:n_op].reshape(1, -1), self.lambdas[n_op:].reshape(1, -1)
+
+    def update(self,
+               model: Union[Module, torch.Tensor],
+               op: torch.Tensor,
+               bcs: Tuple[torch.Tensor],
+               op_loss: torch.Tensor,
+               bnd_loss: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """ Method that should be built in every child class.
 
         Args:
-            op_length (list): dict with lengths of operator solution.
-            bval_length (list): dict with lengths of boundary solution.
-            sampling_D (int): sum of op_length and bval_length.
+            model (Union[Module, torch.Tensor]): *mat, NN, autograd* model.
+            op (torch.Tensor): operator residual (column per equation).
+            bcs (Tuple[torch.Tensor]): boundary residual of every boundary type.
+            op_loss (torch.Tensor): loss of every equation.
+            bnd_loss (torch.Tensor): loss of every boundary type.
 
         Returns:
             lambda_op (torch.Tensor): values of lambdas for operator.
             lambda_bound (torch.Tensor): values of lambdas for boundary.
         """
+        raise NotImplementedError
+
+    def step(self,
+             model: Union[Module, torch.Tensor],
+             op: torch.Tensor,
+             bcs: Tuple[torch.Tensor],
+             op_loss: torch.Tensor,
+             bnd_loss: torch.Tensor,
+             sampling_N: int = 1,
+             second_order_interactions: bool = True) -> Union[Tuple[torch.Tensor, torch.Tensor], None]:
+        """ Called at every loss evaluation with lambda update,
+        lambdas are updated every *sampling_N* steps.
 
-        op_array = np.array(self.op_list)
-        bc_array = np.array(self.bcs_list)
-        loss_array = np.array(self.loss_list)
-
-        X_array = np.hstack((op_array, bc_array))
-
-        bounds = [[-100, 100] for _ in range(sampling_D)]
-        names = ['x{}'.format(i) for i in range(sampling_D)]
-
-        sp = ProblemSpec({'names': names, 'bounds': bounds})
+        Args:
+            model (Union[Module, torch.Tensor]): *mat, NN, autograd* model.
+            op (torch.Tensor): operator residual (column per equation).
+            bcs (Tuple[torch.Tensor]): boundary residual of every boundary type.
+            op_loss (torch.Tensor): loss of every equation.
+            bnd_loss (torch.Tensor): loss of every boundary type.
+            sampling_N (int, optional): lambdas update period. Defaults to 1.
+            second_order_interactions (bool, optional): used by SobolLambda only.
+                Defaults to True.
 
-        sp.set_samples(X_array)
-        sp.set_results(loss_array)
-        sp.analyze_sobol(calc_second_order=self.second_order_interactions)
+        Returns:
+            Union[Tuple[torch.Tensor, torch.Tensor], None]: new lambdas (operator, boundary)
+            or None if it is not the update step.
+        """
+        self.steps += 1
+        if self.steps % sampling_N != 0:
+            return None
+        return self.update(model, op, bcs, op_loss, bnd_loss)
 
-        #
-        # To assess variance we need total sensitiviy indices for every variable
-        #
-        ST = sp.analysis['ST']
 
-        lambda_op = self.lambda_compute(0, op_length, ST)
+class SobolLambda(LambdaStrategy):
+    """
+    Variance-based sensitivity analysis of the loss with respect to the loss groups
+    (every equation and every boundary type). The loss is the sum of the group
+    terms, so the total Sobol index of the group is Var_i / Var and lambdas are
+    lambda_i = sum(Var) / Var_i. Variances are accumulated in streaming fashion
+    (Welford algorithm) on the device.
+    """
+    def __init__(self):
+        super().__init__(alpha=0)
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def _accumulate(self, losses: torch.Tensor):
+        """ Welford update of the mean and the sum of squared deviations.
+        """
+        losses = losses.detach()
+        if self.mean is None:
+            self.mean = torch.zeros_like(losses)
+            self.m2 = torch.zeros_like(losses)
+        self.count += 1
+        delta = losses - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (losses - self.mean)
+
+    def update(self, model, op, bcs, op_loss, bnd_loss):
+        variance = self.m2 / max(self.count - 1, 1)
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        return self._smooth(self._balance(variance), len(op_loss))
+
+    def step(self, model, op, bcs, op_loss, bnd_loss,
+             sampling_N=1, second_order_interactions=True):
+        self._accumulate(torch.cat((op_loss, bnd_loss)))
+        sampling_amount, _ = samples_count(
+            second_order_interactions=second_order_interactions,
+            sampling_N=sampling_N,
+            op_length=[1] * len(op_loss),
+            bval_length=[1] * len(bnd_loss))
+        if self.count < sampling_amount:
+            return None
+        return self.update(model, op, bcs, op_loss, bnd_loss)
+
+
+class GradNormLambda(LambdaStrategy):
+    """
+    Learning rate annealing: lambdas balance mean absolute values
+    of gradients of every loss term with respect to model parameters.
+    Update costs one backward pass per loss term, by default it goes only
+    through the last layer (*last_layer=False* gives the full backward per term).
+    """
+    def __init__(self, alpha: float = 0.9, last_layer: bool = True):
+        """
+        Args:
+            alpha (float, optional): moving average factor. Defaults to 0.9.
+            last_layer (bool, optional): gradients with respect to the last layer
+                parameters only. Defaults to True.
+        """
+        super().__init__(alpha)
+        self.last_layer = last_layer
 
-        lambda_bnd = self.lambda_compute(sum(op_length), bval_length, ST)
+    def update(self, model, op, bcs, op_loss, bnd_loss):
+        params = self._parameters(model, self.last_layer)
+        losses = torch.cat((op_loss, bnd_loss))
+        stats = torch.stack([torch.mean(torch.abs(self._grads(loss, params)))
+                             for loss in losses]).detach()
+        return self._smooth(self._balance(stats), len(op_loss))
 
-        return lambda_op, lambda_bnd
 
-class PadTransform(Module):
-    """Pad tensor to a fixed length with given padding value.
-    
-    src: https://pytorch.org/text/stable/transforms.html#torchtext.transforms.PadTransform
-    
-    Done to avoid torchtext dependency (we need only this function).
+class NTKLambda(LambdaStrategy):
     """
-
-    def __init__(self, max_length: int, pad_value: int) -> None:
-        """_summary_
-
+    Lambdas balance traces of neural tangent kernel blocks of every loss term.
+    Trace (mean over points) is estimated by Hutchinson estimator
+    tr(J J^T) = E||J^T v||^2 with random Rademacher vector v.
+    Update costs n_probes backward passes per residual, by default they go only
+    through the last layer, i.e. the trace of the last layer NTK block is used.
+    """
+    def __init__(self, alpha: float = 0.9, n_probes: int = 1, last_layer: bool = True):
+        """
         Args:
-            max_length (int): Maximum length to pad to.
-            pad_value (int):  Value to pad the tensor with.
+            alpha (float, optional): moving average factor. Defaults to 0.9.
+            n_probes (int, optional): number of random vectors for trace estimation.
+                Defaults to 1.
+            last_layer (bool, optional): Jacobian with respect to the last layer
+                parameters only. Defaults to True.
         """
-        super().__init__()
-        self.max_length = max_length
-        self.pad_value = float(pad_value)
+        super().__init__(alpha)
+        self.n_probes = n_probes
+        self.last_layer = last_layer
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        """ Tensor padding
+    def _trace(self, residual: torch.Tensor, params: list) -> torch.Tensor:
+        """ Hutchinson estimation of the mean NTK trace for the residual vector.
+        """
+        trace = 0
+        for _ in range(self.n_probes):
+            v = torch.randint_like(residual, 2) * 2 - 1
+            trace = trace + torch.sum(self._grads(torch.sum(v * residual), params)**2)
+        return trace / (self.n_probes * len(residual))
 
-        Args:
-            x (torch.Tensor): tensor for padding.
+    def update(self, model, op, bcs, op_loss, bnd_loss):
+        params = self._parameters(model, self.last_layer)
+        residuals = [op[:, i] for i in range(op.shape[-1])] + list(bcs)
+        stats = torch.stack([self._trace(residual, params)
+                             for residual in residuals]).detach()
+        return self._smooth(self._balance(stats), op.shape[-1])
 
-        Returns:
-            torch.Tensor: filled tensor with pad value.
+
+class ReLoBRaLo(LambdaStrategy):
+    """
+    Relative loss balancing with random lookback: lambdas are softmax of
+    loss terms ratios to their previous and initial values. It needs only loss values.
+    """
+    def __init__(self, alpha: float = 0.999, temperature: float = 0.1, rho: float = 0.999):
+        """
+        Args:
+            alpha (float, optional): weight of the history (vs. initial values). Defaults to 0.999.
+            temperature (float, optional): softmax temperature. Defaults to 0.1.
+            rho (float, optional): expected value of the lookback Bernoulli variable.
+                Defaults to 0.999.
         """
+        super().__init__(alpha)
+        self.temperature = temperature
+        self.rho = rho
+        self.loss_init = None
+        self.loss_prev = None
+
+    def _balanced(self, losses: torch.Tensor, losses_ref: torch.Tensor) -> torch.Tensor:
+        """ Softmax lambdas for losses relative to reference losses.
+        """
+        finfo = torch.finfo(losses.dtype)
+        ratio = losses / (self.temperature * (losses_ref + finfo.tiny))
+        return len(losses) * torch.softmax(ratio, 0)
+
+    def update(self, model, op, bcs, op_loss, bnd_loss):
+        losses = torch.cat((op_loss, bnd_loss)).detach()
+        if self.loss_init is None:
+            self.loss_init = losses
+            self.loss_prev = losses
+            self.lambdas = torch.ones_like(losses)
+        rho = float(torch.rand(1) < self.rho)
+        history = rho * self.lambdas + (1 - rho) * self._balanced(losses, self.loss_init)
+        self.lambdas = self.alpha * history + \
+            (1 - self.alpha) * self._balanced(losses, self.loss_prev)
+        self.loss_prev = losses
+        n_op = len(op_loss)
+        return self.lambdas[:n_op].reshape(1, -1), self.lambdas[n_op:].reshape(1, -1)
+
+
+def lambda_strategy_choice(strategy: Union[str, LambdaStrategy, Any]) -> LambdaStrategy:
+    """ Setting adaptive lambdas strategy.
+
+    Args:
+        strategy (Union[str, LambdaStrategy, Any]): *sobol, gradnorm, ntk, relobralo*
+            or custom LambdaStrategy object.
 
-        max_encoded_length = x.size(-1)
-        if max_encoded_length < self.max_length:
-            pad_amount = self.max_length - max_encoded_length
-            x = torch.nn.functional.pad(x, (0, pad_amount), value=self.pad_value)
-        return x
+    Returns:
+        LambdaStrategy: strategy object.
+    """
+    if strategy == 'sobol':
+        return SobolLambda()
+    elif strategy == 'gradnorm':
+        return GradNormLambda()
+    elif strategy == 'ntk':
+        return NTKLambda()
+    elif strategy == 'relobralo':
+        return ReLoBRaLo()
+    elif isinstance(strategy, LambdaStrategy):
+        return strategy
+    raise ValueError('Unknown lambda strategy: {}'.format(strategy))